@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AchievementsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'achievements'
+
+    def ready(self):
+        from badgeup.images import register_variant_field
+
+        from . import signals  # noqa: F401
+        from .models import UserSticker
+
+        register_variant_field(UserSticker, "unlocked_photo", "unlocked_photo_variants")
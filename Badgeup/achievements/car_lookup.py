@@ -0,0 +1,163 @@
+"""
+Make/model/generation -> sticker lookup learned from approved captures.
+
+Every approved ``UserSticker`` records what the model recognized
+(``detected_make``/``detected_model``/``detected_generation``) and the sticker
+it unlocked. Only stickers chosen by the model count: captures the lookup
+itself resolved (``matched_by_lookup``) would otherwise keep confirming a
+wrong row. ``CarStickerLookup`` keeps, per album, how many approvals each
+normalized car gave to each sticker; a sticker's rows are recounted whenever
+one of its captures changes. Once the table covers enough of an album,
+``match_album_photo`` only asks the model to identify the car and resolves the
+sticker here, without sending the sticker list.
+"""
+
+import logging
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from albums.models import Sticker
+from .models import CarStickerLookup, UserSticker
+
+logger = logging.getLogger(__name__)
+
+
+def _min_approvals() -> int:
+    return int(getattr(settings, "CAR_LOOKUP_MIN_APPROVALS", 3))
+
+
+def _min_share() -> float:
+    # Share of the approvals for a car that must point to the same sticker.
+    return float(getattr(settings, "CAR_LOOKUP_MIN_SHARE", 0.8))
+
+
+def _min_coverage() -> float:
+    # Share of an album's stickers the lookup must resolve before the
+    # identify-only prompt is tried; below it most lookups would miss and pay
+    # for a second call.
+    return float(getattr(settings, "CAR_LOOKUP_MIN_COVERAGE", 0.5))
+
+
+def _confident(approvals: int, total: int) -> bool:
+    return approvals >= _min_approvals() and approvals / total >= _min_share()
+
+
+def normalize(value) -> str:
+    """``" Mercedes-Benz "`` -> ``"mercedes benz"``: lowercase ASCII words."""
+    value = unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.findall(r"[a-z0-9]+", value.lower()))
+
+
+def refresh_sticker(sticker_id: int) -> int:
+    """Recount the approved captures of ``sticker_id``. Returns the number of rows kept."""
+    with transaction.atomic():
+        # Locking the sticker serializes concurrent refreshes of its rows.
+        album_id = (
+            Sticker.objects.select_for_update().filter(pk=sticker_id).values_list("album_id", flat=True).first()
+        )
+        if album_id is None:
+            return 0
+
+        captures = UserSticker.objects.filter(
+            sticker_id=sticker_id,
+            status=UserSticker.STATUS_APPROVED,
+            validated=True,
+            matched_by_lookup=False,
+        ).values_list("detected_make", "detected_model", "detected_generation")
+        counts = Counter()
+        for make, model, generation in captures.iterator():
+            key = (normalize(make), normalize(model), normalize(generation))
+            if key[0] and key[1]:
+                counts[key] += 1
+
+        CarStickerLookup.objects.filter(sticker_id=sticker_id).delete()
+        CarStickerLookup.objects.bulk_create(
+            [
+                CarStickerLookup(
+                    album_id=album_id,
+                    sticker_id=sticker_id,
+                    make=make[:100],
+                    model=model[:100],
+                    generation=generation[:100],
+                    approvals=approvals,
+                )
+                for (make, model, generation), approvals in counts.items()
+            ]
+        )
+    return len(counts)
+
+
+def rebuild() -> int:
+    """Recount every sticker with approved captures or existing rows."""
+    sticker_ids = set(
+        UserSticker.objects.filter(status=UserSticker.STATUS_APPROVED, validated=True, matched_by_lookup=False)
+        .exclude(detected_make="")
+        .values_list("sticker_id", flat=True)
+    )
+    sticker_ids.update(CarStickerLookup.objects.values_list("sticker_id", flat=True))
+    return sum(refresh_sticker(sticker_id) for sticker_id in sorted(sticker_ids))
+
+
+def enqueue_refresh(sticker_id: int) -> None:
+    from .tasks import refresh_car_lookup
+
+    try:
+        refresh_car_lookup.delay(sticker_id)
+    except Exception:  # pragma: no cover - fallback for missing broker
+        refresh_car_lookup.apply(args=[sticker_id])
+
+
+def covers(album_id: int, sticker_count: int) -> bool:
+    """
+    Whether enough of the album's stickers can be resolved to try the lookup
+    first: a sticker counts once some car points to it with the approvals and
+    share ``lookup_sticker`` requires.
+    """
+    if not sticker_count:
+        return False
+    rows = list(
+        CarStickerLookup.objects.filter(album_id=album_id).values_list(
+            "make", "model", "generation", "sticker_id", "approvals"
+        )
+    )
+    totals = Counter()
+    for make, model, generation, _, approvals in rows:
+        totals[make, model, generation] += approvals
+    known = {
+        sticker_id
+        for make, model, generation, sticker_id, approvals in rows
+        if _confident(approvals, totals[make, model, generation])
+    }
+    return len(known) / sticker_count >= _min_coverage()
+
+
+def lookup_sticker(album_id: int, make, model, generation=None) -> int | None:
+    """
+    The sticker of ``album_id`` that approved captures of this car unlocked,
+    or ``None`` when the table has no clear answer. An unknown generation only
+    matches rows recorded without one, so a new generation of a known model
+    does not borrow its predecessor's sticker.
+    """
+    make, model, generation = normalize(make), normalize(model), normalize(generation)
+    if not make or not model:
+        return None
+
+    rows = CarStickerLookup.objects.filter(album_id=album_id, make=make, model=model).values_list(
+        "generation", "sticker_id", "approvals"
+    )
+    if generation:
+        rows = [row for row in rows if row[0] == generation] or [row for row in rows if not row[0]]
+    votes = Counter()
+    for _, sticker_id, approvals in rows:
+        votes[sticker_id] += approvals
+    if not votes:
+        return None
+
+    sticker_id, best = votes.most_common(1)[0]
+    if not _confident(best, sum(votes.values())):
+        return None
+    return sticker_id
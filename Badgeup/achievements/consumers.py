@@ -95,4 +95,7 @@ class NotificationsConsumer(AsyncJsonWebsocketConsumer):
         await self.channel_layer.group_discard("broadcast", self.channel_name)
 
     async def notification(self, event):
-        await self.send_json({"type": "notification", **event.get("payload", {})})
+        message = {"type": "notification", **event.get("payload", {})}
+        if "seq" in event:
+            message["seq"] = event["seq"]
+        await self.send_json(message)
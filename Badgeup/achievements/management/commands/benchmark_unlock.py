@@ -0,0 +1,137 @@
+import time
+from collections import Counter
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from achievements.models import UserSticker
+from achievements.services import analyze_car_photo
+from achievements.tasks import validate_user_sticker
+from achievements.vision_cache import bypassed, cache_stats
+from albums.matching import match_album_photo
+from albums.models import Album
+from badgeup.openai_backends import backend_name
+
+User = get_user_model()
+
+PIPELINES = ("match", "analyze", "validate")
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide latencia y throughput del flujo de desbloqueo (match-photo, analyze_car_photo o "
+        "validate_user_sticker). Con OPENAI_BACKEND=replay o synthetic no necesita API key."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("album", type=int, help="ID del álbum")
+        parser.add_argument("--pipeline", choices=PIPELINES, default="match")
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--photos",
+            help="Carpeta con fotos JPEG/PNG; por defecto las imágenes de referencia del álbum",
+        )
+        parser.add_argument("--username", default="benchmark")
+        parser.add_argument(
+            "--use-cache",
+            action="store_true",
+            help="Usar la caché de resultados de visión (por defecto se omite para medir el modelo)",
+        )
+
+    def _photos(self, album, directory):
+        if directory:
+            paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in {".jpg", ".jpeg", ".png"})
+            photos = [(p.name, p.read_bytes()) for p in paths]
+        else:
+            photos = []
+            for sticker in album.stickers.exclude(image_reference=""):
+                with sticker.image_reference.open("rb") as fh:
+                    photos.append((Path(sticker.image_reference.name).name, fh.read()))
+        if not photos:
+            raise CommandError("No hay fotos para el benchmark")
+        return photos
+
+    def handle(self, *args, **options):
+        album = Album.objects.filter(pk=options["album"]).first()
+        if album is None:
+            raise CommandError(f"El álbum {options['album']} no existe")
+        stickers = list(album.stickers.all())
+        if not stickers:
+            raise CommandError("El álbum no tiene stickers")
+        photos = self._photos(album, options["photos"])
+        user, _ = User.objects.get_or_create(
+            username=options["username"], defaults={"email": f"{options['username']}@example.com"}
+        )
+        UserSticker.objects.filter(user=user, sticker__album=album).delete()
+        pipeline = options["pipeline"]
+
+        def run(index):
+            name, content = photos[index % len(photos)]
+            photo = SimpleUploadedFile(name, content, content_type="image/jpeg")
+            started = time.perf_counter()
+            try:
+                if pipeline == "match":
+                    result = match_album_photo(user, album, photo)
+                    outcome = (
+                        "already_unlocked" if result.get("already_unlocked")
+                        else "unlocked" if result.get("unlocked") else "rejected"
+                    )
+                elif pipeline == "analyze":
+                    result = analyze_car_photo(photo, stickers)
+                    outcome = "error" if not result or result.get("error") else "analyzed"
+                else:
+                    user_sticker, _ = UserSticker.objects.get_or_create(
+                        user=user, sticker=stickers[index % len(stickers)]
+                    )
+                    user_sticker.photo = photo
+                    user_sticker.validated = False
+                    user_sticker.status = UserSticker.STATUS_VALIDATING
+                    user_sticker.save()
+                    validate_user_sticker.apply(args=[user_sticker.id])
+                    user_sticker.refresh_from_db(fields=["status"])
+                    outcome = user_sticker.status
+            except Exception as exc:
+                outcome = type(exc).__name__
+            finally:
+                connection.close()
+            return time.perf_counter() - started, outcome
+
+        stats_before = cache_stats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            if not options["use_cache"]:
+                stack.enter_context(bypassed())
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+                results = list(pool.map(run, range(options["requests"])))
+        wall = time.perf_counter() - started
+        stats_after = cache_stats()
+
+        latencies = [elapsed * 1000 for elapsed, _ in results]
+        outcomes = Counter(outcome for _, outcome in results)
+        self.stdout.write(
+            f"backend={backend_name()} pipeline={pipeline} requests={len(results)} "
+            f"concurrency={options['concurrency']} cache={'on' if options['use_cache'] else 'off'}"
+        )
+        self.stdout.write(f"tiempo total: {wall:.2f}s  throughput: {len(results) / wall:.1f} req/s")
+        self.stdout.write(
+            "latencia ms: "
+            f"p50={_percentile(latencies, 0.5):.0f} p90={_percentile(latencies, 0.9):.0f} "
+            f"p99={_percentile(latencies, 0.99):.0f} max={max(latencies):.0f}"
+        )
+        self.stdout.write("resultados: " + ", ".join(f"{k}={v}" for k, v in outcomes.most_common()))
+        cache = {key: value - stats_before.get(key, 0) for key, value in sorted(stats_after.items())}
+        self.stdout.write(
+            "caché de visión: "
+            + (", ".join(f"{key}={value}" for key, value in cache.items() if value) or "sin consultas")
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from achievements import car_lookup
+
+
+class Command(BaseCommand):
+    help = "Reconstruye la tabla marca/modelo/generación -> sticker a partir de las capturas aprobadas"
+
+    def handle(self, *args, **options):
+        rows = car_lookup.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"{rows} coches registrados en la tabla de búsqueda"))
@@ -1,7 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
 
-from achievements.utils import compute_user_points
+from achievements.utils import annotate_user_points
 
 User = get_user_model()
 
@@ -10,12 +10,12 @@ class Command(BaseCommand):
     help = "Sincroniza User.points con los UserSticker aprobados existentes"
 
     def handle(self, *args, **options):
-        users = User.objects.all()
+        users = annotate_user_points(User.objects.all())
         count = 0
         total_users = users.count()
         self.stdout.write(f"Sincronizando puntos para {total_users} usuarios...")
         for user in users:
-            computed = compute_user_points(user)
+            computed = user.computed_points
             if user.points != computed:
                 old_points = user.points
                 user.points = computed
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("achievements", "0008_chatmessage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="usersticker",
+            index=models.Index(fields=["location_lat", "location_lng"], name="usersticker_location_idx"),
+        ),
+    ]
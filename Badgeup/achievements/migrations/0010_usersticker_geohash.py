@@ -0,0 +1,64 @@
+from django.db import migrations, models
+
+# Frozen copy of the geohash encoder at the time of this migration, so later
+# changes to albums.geohash cannot alter what the backfill writes.
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9
+
+
+def location_geohash(lat, lng) -> str:
+    if lat is None or lng is None:
+        return ""
+    lat, lng = float(lat), float(lng)
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < PRECISION:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def backfill_geohash(apps, schema_editor):
+    UserSticker = apps.get_model("achievements", "UserSticker")
+    pending = []
+    located = UserSticker.objects.filter(location_lat__isnull=False, location_lng__isnull=False)
+    for user_sticker in located.iterator():
+        user_sticker.geohash = location_geohash(user_sticker.location_lat, user_sticker.location_lng)
+        pending.append(user_sticker)
+        if len(pending) >= 1000:
+            UserSticker.objects.bulk_update(pending, ["geohash"])
+            pending = []
+    if pending:
+        UserSticker.objects.bulk_update(pending, ["geohash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("achievements", "0009_usersticker_location_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usersticker",
+            name="geohash",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("achievements", "0010_usersticker_geohash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usersticker",
+            name="unlocked_photo_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("achievements", "0012_matchphotojob"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="usersticker",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("validating", "Validating"),
+                    ("approved", "Approved"),
+                    ("rejected", "Rejected"),
+                    ("deferred", "Deferred"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="matchphotojob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("running", "Running"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                    ("deferred", "Deferred"),
+                ],
+                default="pending",
+                max_length=16,
+            ),
+        ),
+    ]
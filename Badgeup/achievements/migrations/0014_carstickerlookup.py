@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("albums", "0005_image_variants"),
+        ("achievements", "0013_deferred_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CarStickerLookup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("make", models.CharField(max_length=100)),
+                ("model", models.CharField(max_length=100)),
+                ("generation", models.CharField(blank=True, max_length=100)),
+                ("approvals", models.PositiveIntegerField(default=0)),
+                (
+                    "album",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="car_lookups",
+                        to="albums.album",
+                    ),
+                ),
+                (
+                    "sticker",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="car_lookups",
+                        to="albums.sticker",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["album", "make", "model"], name="carlookup_album_car_idx")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="carstickerlookup",
+            constraint=models.UniqueConstraint(
+                fields=("album", "make", "model", "generation", "sticker"),
+                name="unique_car_sticker_lookup",
+            ),
+        ),
+    ]
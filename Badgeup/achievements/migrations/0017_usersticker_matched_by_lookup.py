@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("achievements", "0016_notification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usersticker",
+            name="matched_by_lookup",
+            field=models.BooleanField(default=False),
+        ),
+    ]
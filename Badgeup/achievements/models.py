@@ -1,7 +1,10 @@
+import uuid
+
 from django.conf import settings
 from django.db import models
 
-from albums.models import Sticker
+from albums.geohash import location_geohash, with_geohash_field
+from albums.models import Album, Sticker
 
 
 class UserSticker(models.Model):
@@ -13,12 +16,14 @@ class UserSticker(models.Model):
     STATUS_VALIDATING = "validating"
     STATUS_APPROVED = "approved"
     STATUS_REJECTED = "rejected"
+    STATUS_DEFERRED = "deferred"
 
     STATUS_CHOICES = [
         (STATUS_PENDING, "Pending"),
         (STATUS_VALIDATING, "Validating"),
         (STATUS_APPROVED, "Approved"),
         (STATUS_REJECTED, "Rejected"),
+        (STATUS_DEFERRED, "Deferred"),
     ]
 
     user = models.ForeignKey(
@@ -40,26 +45,39 @@ class UserSticker(models.Model):
     validation_notes = models.JSONField(blank=True, null=True)
     validation_score = models.FloatField(null=True, blank=True)
     unlocked_photo = models.ImageField(upload_to="user_stickers/", null=True, blank=True)
+    unlocked_photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     unlocked_at = models.DateTimeField(null=True, blank=True)
     detected_make = models.CharField(max_length=100, blank=True)
     detected_model = models.CharField(max_length=100, blank=True)
     detected_generation = models.CharField(max_length=100, blank=True)
     detected_year_range = models.CharField(max_length=100, blank=True)
+    # The sticker came from CarStickerLookup, not from the model; such captures
+    # do not count as approvals for the lookup.
+    matched_by_lookup = models.BooleanField(default=False)
     fun_fact = models.TextField(blank=True)
     user_message = models.TextField(blank=True)
     location_label = models.CharField(max_length=255, blank=True)
     location_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("user", "sticker")
         ordering = ["-updated_at"]
+        indexes = [
+            models.Index(fields=["location_lat", "location_lng"], name="usersticker_location_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user} - {self.sticker}"
 
+    def save(self, *args, **kwargs):
+        self.geohash = location_geohash(self.location_lat, self.location_lng)
+        kwargs["update_fields"] = with_geohash_field(kwargs.get("update_fields"))
+        super().save(*args, **kwargs)
+
 
 class FriendRequest(models.Model):
     STATUS_PENDING = "pending"
@@ -119,3 +137,137 @@ class ChatMessage(models.Model):
 
     def __str__(self) -> str:
         return f"{self.sender} -> {self.recipient} ({self.created_at})"
+
+
+class MatchPhotoJob(models.Model):
+    """
+    A match-photo request processed in the background; the result is pushed
+    over the notifications socket and can also be polled.
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_DEFERRED = "deferred"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_DEFERRED, "Deferred"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="match_photo_jobs",
+        on_delete=models.CASCADE,
+    )
+    album = models.ForeignKey(
+        Album,
+        related_name="match_photo_jobs",
+        on_delete=models.CASCADE,
+    )
+    photo = models.ImageField(upload_to="match_jobs/", null=True, blank=True)
+    location_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    result = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.album} ({self.status})"
+
+
+class CarStickerLookup(models.Model):
+    """
+    Normalized make/model/generation seen in approved captures and the sticker
+    they unlocked, per album. Maintained by ``achievements.car_lookup``.
+    """
+
+    album = models.ForeignKey(
+        Album,
+        related_name="car_lookups",
+        on_delete=models.CASCADE,
+    )
+    sticker = models.ForeignKey(
+        Sticker,
+        related_name="car_lookups",
+        on_delete=models.CASCADE,
+    )
+    make = models.CharField(max_length=100)
+    model = models.CharField(max_length=100)
+    generation = models.CharField(max_length=100, blank=True)
+    approvals = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["album", "make", "model", "generation", "sticker"],
+                name="unique_car_sticker_lookup",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["album", "make", "model"], name="carlookup_album_car_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.make} {self.model} {self.generation} -> {self.sticker}"
+
+
+class Outbox(models.Model):
+    """
+    Channel-layer messages written in the same transaction as the change they
+    announce. ``achievements.outbox.drain`` delivers them after commit and
+    deletes them (at-least-once).
+    """
+
+    groups = models.JSONField(default=list)
+    message = models.JSONField()
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self) -> str:
+        return f"{self.message.get('type')} -> {len(self.groups)} groups"
+
+
+class Notification(models.Model):
+    """
+    A notification kept for its recipient so it can be listed after the
+    websocket frame is gone. Written by ``send_notification``.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="notifications",
+        on_delete=models.CASCADE,
+    )
+    title = models.CharField(max_length=255)
+    message = models.TextField(blank=True)
+    category = models.CharField(max_length=32, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["user", "-id"], name="notification_user_id_idx"),
+            models.Index(
+                fields=["user"],
+                condition=models.Q(read=False),
+                name="notification_unread_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.title}"
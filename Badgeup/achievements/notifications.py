@@ -0,0 +1,167 @@
+"""
+Stored notifications and their unread counters.
+
+``record`` writes one ``Notification`` per recipient with ``bulk_create`` in
+the caller's transaction. Each user's unread count lives in Redis
+(``notifications:unread:<id>``) and is adjusted after commit. When the key is
+missing it is rebuilt from the partial ``notification_unread_idx`` index; it
+also expires after ``NOTIFICATION_UNREAD_TTL`` seconds so a counter that
+drifted (an increment racing a rebuild) corrects itself.
+
+Delivered notifications also get a per-user sequence number and are appended
+to a capped stream (``notifications:stream:<id>``, stream id ``<seq>-0``) so a
+reconnecting websocket can replay what it missed with one ``XRANGE``.
+"""
+
+import json
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from badgeup.redis_client import get_redis
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+PAYLOAD_FIELDS = ("title", "message", "category")
+
+# INCR and XADD in one step so concurrent dispatchers append in sequence order.
+APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'payload', ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+def _unread_key(user_id: int) -> str:
+    return f"notifications:unread:{user_id}"
+
+
+def _seq_key(user_id: int) -> str:
+    return f"notifications:seq:{user_id}"
+
+
+def _stream_key(user_id: int) -> str:
+    return f"notifications:stream:{user_id}"
+
+
+def _adjust_unread(deltas: dict[int, int]) -> None:
+    try:
+        client = get_redis()
+        pipe = client.pipeline()
+        for user_id, delta in deltas.items():
+            # Only keep counters that exist; missing ones are rebuilt on read.
+            if delta > 0:
+                pipe.eval(
+                    "if redis.call('EXISTS', KEYS[1]) == 1 then return redis.call('INCRBY', KEYS[1], ARGV[1]) end",
+                    1,
+                    _unread_key(user_id),
+                    delta,
+                )
+            else:
+                pipe.delete(_unread_key(user_id))
+        pipe.execute()
+    except (RedisError, RuntimeError):
+        logger.warning("Could not update unread notification counters")
+
+
+def record(user_ids: list[int], payload: dict) -> None:
+    """Store ``payload`` for every user in ``user_ids`` (one ``bulk_create``)."""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
+    fields = {
+        "title": str(payload.get("title") or "Notificación")[:255],
+        "message": payload.get("message") or "",
+        "category": str(payload.get("category") or "")[:32],
+        "data": {key: value for key, value in payload.items() if key not in PAYLOAD_FIELDS},
+    }
+    Notification.objects.bulk_create(
+        [Notification(user_id=user_id, **fields) for user_id in user_ids],
+        batch_size=int(getattr(settings, "NOTIFICATION_BULK_BATCH_SIZE", 500)),
+    )
+    transaction.on_commit(lambda: _adjust_unread({user_id: 1 for user_id in user_ids}))
+
+
+def unread_count(user_id: int) -> int:
+    key = _unread_key(user_id)
+    try:
+        cached = get_redis().get(key)
+        if cached is not None:
+            return max(0, int(cached))
+    except (RedisError, RuntimeError):
+        pass
+
+    count = Notification.objects.filter(user_id=user_id, read=False).count()
+    try:
+        get_redis().set(key, count, nx=True, ex=int(getattr(settings, "NOTIFICATION_UNREAD_TTL", 3600)))
+    except (RedisError, RuntimeError):
+        pass
+    return count
+
+
+def mark_read(user_id: int, up_to_id: int) -> int:
+    """Mark every notification of ``user_id`` up to ``up_to_id`` as read. Returns how many changed."""
+    updated = Notification.objects.filter(user_id=user_id, id__lte=up_to_id, read=False).update(read=True)
+    if updated:
+        # Rebuilt exactly on the next read rather than decremented, so races
+        # with concurrent inserts cannot leave the counter off.
+        transaction.on_commit(lambda: _adjust_unread({user_id: 0}))
+    return updated
+
+
+def append_to_streams(entries: list[tuple[int, dict]]) -> list[int]:
+    """
+    Append every ``(user_id, payload)`` to that user's stream under the user's
+    next sequence number, in one pipeline. Returns the sequence numbers in
+    order; raises ``RedisError``/``RuntimeError`` when Redis is unavailable.
+    """
+    if not entries:
+        return []
+    client = get_redis()
+    script = client.register_script(APPEND_SCRIPT)
+    maxlen = int(getattr(settings, "NOTIFICATION_STREAM_MAXLEN", 200))
+    ttl = int(getattr(settings, "NOTIFICATION_STREAM_TTL", 7 * 24 * 3600))
+    pipe = client.pipeline()
+    for user_id, payload in entries:
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        script(keys=[_seq_key(user_id), _stream_key(user_id)], args=[maxlen, data, ttl], client=pipe)
+    return [int(seq) for seq in pipe.execute()]
+
+
+def current_seq(user_id: int) -> int:
+    return int(get_redis().get(_seq_key(user_id)) or 0)
+
+
+def missed_since(user_id: int, last_seq: int) -> tuple[int, list[tuple[int, dict]] | None]:
+    """
+    Return ``(current_seq, missed)`` where ``missed`` lists the ``(seq, payload)``
+    sent after ``last_seq``, or is ``None`` when part of the gap already fell
+    out of the stream and the client has to resync over REST.
+    """
+    client = get_redis()
+    pipe = client.pipeline()
+    pipe.get(_seq_key(user_id))
+    pipe.xrange(_stream_key(user_id), min=f"{last_seq + 1}-0", max="+")
+    current, entries = pipe.execute()
+    current = int(current or 0)
+    if current < last_seq:
+        # The counter was reset (Redis flushed): the client's position is meaningless.
+        return current, None
+    if current == last_seq:
+        return current, []
+    missed = [
+        (int(entry_id.decode().split("-")[0]), json.loads(fields[b"payload"]))
+        for entry_id, fields in entries
+    ]
+    if not missed or missed[0][0] != last_seq + 1:
+        return current, None
+    return current, missed
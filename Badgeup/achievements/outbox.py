@@ -0,0 +1,172 @@
+"""
+Transactional outbox for websocket messages.
+
+Views write an ``Outbox`` row in the same transaction as the change it
+announces, so nothing is sent for a rolled-back change and nothing is lost if
+the channel layer is down. After commit a ``drain_outbox`` task on the
+``realtime`` queue locks a batch (``SELECT ... FOR UPDATE SKIP LOCKED``, so
+several dispatchers never send the same row), sends every message with
+concurrent ``group_send`` calls from one event loop and deletes what was
+delivered. Failed groups stay in their row and are retried.
+
+Before its first send a notification row is sequenced: each ``user_<id>``
+group gets the user's next sequence number (see ``notifications``), kept in
+the row under ``seqs`` so retries resend the same numbers.
+"""
+
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from badgeup.redis_client import get_redis
+from . import notifications
+from .models import Outbox
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+SCHEDULED_KEY = "outbox:drain:scheduled"
+
+
+def _batch_size() -> int:
+    return int(getattr(settings, "OUTBOX_BATCH_SIZE", 200))
+
+
+def enqueue(groups: list[str], message: dict) -> None:
+    """Record ``message`` for ``groups``; delivery is scheduled once the transaction commits."""
+    groups = list(dict.fromkeys(groups))
+    if not groups:
+        return
+    Outbox.objects.create(groups=groups, message=message)
+    transaction.on_commit(schedule_drain)
+
+
+def schedule_drain(countdown: float = 0) -> None:
+    """
+    Queue one ``drain_outbox`` run. Commits landing while a run is already
+    queued share it; the flag expires in case the task is lost, and the
+    ``sweep-outbox`` beat entry drains anything a lost task left behind.
+    """
+    from .tasks import drain_outbox
+
+    try:
+        if not get_redis().set(SCHEDULED_KEY, 1, nx=True, ex=int(countdown) + 30):
+            return
+    except (RedisError, RuntimeError):
+        pass
+    try:
+        drain_outbox.apply_async(countdown=countdown or None)
+    except Exception:
+        # Broker down: let the next commit try again, and deliver this batch
+        # from here rather than waiting for the beat sweep.
+        clear_scheduled()
+        if countdown:
+            logger.warning("Could not queue drain_outbox; the beat sweep will retry")
+            return
+        logger.warning("Could not queue drain_outbox; draining inline")
+        try:
+            drain()
+        except Exception:
+            logger.exception("Inline outbox drain failed; rows stay for the beat sweep")
+
+
+def clear_scheduled() -> None:
+    try:
+        get_redis().delete(SCHEDULED_KEY)
+    except (RedisError, RuntimeError):
+        pass
+
+
+async def agroup_send_many(sends: list[tuple[str, dict]]) -> list[Exception | None]:
+    """
+    ``group_send`` every ``(group, message)`` from the running loop, with up to
+    ``NOTIFICATION_FANOUT_CONCURRENCY`` calls in flight. Returns the error of
+    each send (``None`` when delivered).
+    """
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return [None] * len(sends)
+    concurrency = int(getattr(settings, "NOTIFICATION_FANOUT_CONCURRENCY", 100))
+    errors = []
+    for start in range(0, len(sends), concurrency):
+        results = await asyncio.gather(
+            *(channel_layer.group_send(group, message) for group, message in sends[start:start + concurrency]),
+            return_exceptions=True,
+        )
+        errors.extend(result if isinstance(result, Exception) else None for result in results)
+    return errors
+
+
+USER_GROUP_PREFIX = "user_"
+
+
+def _sequence(rows: list[Outbox]) -> None:
+    pending = [
+        row for row in rows if row.message.get("type") == "notification" and "seqs" not in row.message
+    ]
+    targets = [
+        (row, group)
+        for row in pending
+        for group in row.groups
+        if group.startswith(USER_GROUP_PREFIX)
+    ]
+    try:
+        seqs = notifications.append_to_streams(
+            [(int(group[len(USER_GROUP_PREFIX):]), row.message.get("payload", {})) for row, group in targets]
+        )
+    except (RedisError, RuntimeError):
+        logger.warning("Could not sequence %s outbox rows; sending them without replay", len(pending))
+        targets, seqs = [], []
+    assigned = {row.id: {} for row in pending}
+    for (row, group), seq in zip(targets, seqs):
+        assigned[row.id][group] = seq
+    for row in pending:
+        row.message = {**row.message, "seqs": assigned[row.id]}
+
+
+def _group_message(row: Outbox, group: str) -> dict:
+    seqs = row.message.get("seqs")
+    if seqs is None:
+        return row.message
+    message = {key: value for key, value in row.message.items() if key != "seqs"}
+    if group in seqs:
+        message["seq"] = seqs[group]
+    return message
+
+
+def drain() -> tuple[int, int]:
+    """Deliver one locked batch. Returns ``(rows_delivered, rows_failed)``."""
+    max_attempts = int(getattr(settings, "OUTBOX_MAX_ATTEMPTS", 10))
+    with transaction.atomic():
+        rows = list(Outbox.objects.select_for_update(skip_locked=True).order_by("id")[:_batch_size()])
+        if not rows:
+            return 0, 0
+
+        _sequence(rows)
+        sends = [(group, _group_message(row, group)) for row in rows for group in row.groups]
+        errors = iter(async_to_sync(agroup_send_many)(sends))
+        delivered, retry, dropped = [], [], []
+        for row in rows:
+            failed = [group for group in row.groups if next(errors) is not None]
+            if not failed:
+                delivered.append(row.id)
+            elif row.attempts + 1 >= max_attempts:
+                logger.error("Dropping outbox row %s after %s attempts", row.id, row.attempts + 1)
+                dropped.append(row.id)
+            else:
+                row.groups = failed
+                row.attempts += 1
+                retry.append(row)
+
+        Outbox.objects.filter(id__in=delivered + dropped).delete()
+        if retry:
+            Outbox.objects.bulk_update(retry, ["groups", "attempts", "message"])
+    return len(delivered), len(retry)
@@ -2,8 +2,8 @@ from rest_framework import serializers
 
 from users.models import User
 
-from .models import ChatMessage, FriendRequest, UserSticker
-from .utils import compute_user_points
+from .models import ChatMessage, FriendRequest, MatchPhotoJob, Notification, UserSticker
+from .utils import user_points
 
 
 class UserSummarySerializer(serializers.ModelSerializer):
@@ -24,7 +24,7 @@ class UserSummarySerializer(serializers.ModelSerializer):
         )
 
     def get_computed_points(self, user):
-        return compute_user_points(user)
+        return user_points(user)
 
 
 class MemberSerializer(serializers.ModelSerializer):
@@ -44,7 +44,7 @@ class MemberSerializer(serializers.ModelSerializer):
         )
 
     def get_computed_points(self, user):
-        return compute_user_points(user)
+        return user_points(user)
 
 
 class UserStickerSerializer(serializers.ModelSerializer):
@@ -165,6 +165,15 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class MatchPhotoJobSerializer(serializers.ModelSerializer):
+    album_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = MatchPhotoJob
+        fields = ("id", "album_id", "status", "result", "created_at", "updated_at")
+        read_only_fields = fields
+
+
 class UserStickerHistorySerializer(serializers.ModelSerializer):
     sticker_id = serializers.IntegerField(source="sticker.id", read_only=True)
     sticker_name = serializers.CharField(source="sticker.name", read_only=True)
@@ -179,3 +188,10 @@ class UserStickerHistorySerializer(serializers.ModelSerializer):
             "album_title",
             "unlocked_at",
         )
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ("id", "title", "message", "category", "data", "read", "created_at")
+        read_only_fields = fields
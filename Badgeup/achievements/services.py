@@ -1,16 +1,119 @@
+import asyncio
 import base64
+import hashlib
 import json
 import logging
+import time
+from functools import lru_cache
 from typing import Any, Dict, Iterable, Optional
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.files.storage import default_storage
 
+from albums.embeddings import shortlist_stickers
 from albums.models import Sticker
-from badgeup.openai_client import get_openai_client
+from badgeup.circuit_breaker import CircuitOpen, get_openai_breaker
+from badgeup.images import UnreadableImage, prepare_for_vision
+from badgeup.openai_client import RateLimitError, get_async_openai_client, get_openai_client, is_outage
+from badgeup.rate_limit import RateLimited, get_openai_limiter, retry_after_from
+from badgeup.redis_client import get_redis
 from .models import UserSticker
+from .vision_cache import get_result, result_key, store_result
 
 logger = logging.getLogger(__name__)
 
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+
+# Images are downscaled to VISION_IMAGE_LONG_EDGE (768px): at most four 512px
+# tiles at high detail, 4 * 170 + 85 tokens.
+IMAGE_TOKENS = 765
+
+
+def _estimate_tokens(texts: Iterable[str], images: int, max_output: int) -> int:
+    return sum(len(t) for t in texts) // 4 + images * IMAGE_TOKENS + max_output
+
+
+def _usage_tokens(response) -> int | None:
+    return getattr(getattr(response, "usage", None), "total_tokens", None)
+
+
+def _create_with_limits(create, estimate: int, **request):
+    """
+    Call ``create(**request)`` through the OpenAI circuit breaker and inside
+    the shared budget. Raises ``CircuitOpen`` while the API is considered down
+    and ``RateLimited`` when the budget is exhausted or the provider answers 429.
+    Every call made settles the breaker (only outages count as failures), so a
+    half-open probe always closes or reopens the circuit.
+    """
+    breaker = get_openai_breaker()
+    breaker.allow()
+    limiter = get_openai_limiter()
+    try:
+        limiter.acquire(estimate)
+    except RateLimited:
+        breaker.cancel()
+        raise
+    started = time.monotonic()
+    try:
+        response = create(**request)
+    except Exception as exc:
+        _record_error(breaker, exc, time.monotonic() - started)
+        if isinstance(exc, RateLimitError):
+            raise RateLimited(retry_after_from(exc)) from exc
+        raise
+    breaker.record_success(time.monotonic() - started)
+    limiter.record_usage(estimate, _usage_tokens(response))
+    return response
+
+
+async def _acreate_with_limits(create, estimate: int, **request):
+    breaker = get_openai_breaker()
+    await sync_to_async(breaker.allow, thread_sensitive=False)()
+    limiter = get_openai_limiter()
+    try:
+        await limiter.aacquire(estimate)
+    except (RateLimited, asyncio.CancelledError):
+        await sync_to_async(breaker.cancel, thread_sensitive=False)()
+        raise
+    started = time.monotonic()
+    try:
+        response = await create(**request)
+    except asyncio.CancelledError:
+        # The client went away mid-call: no outcome to record.
+        await sync_to_async(breaker.cancel, thread_sensitive=False)()
+        raise
+    except Exception as exc:
+        await sync_to_async(_record_error, thread_sensitive=False)(breaker, exc, time.monotonic() - started)
+        if isinstance(exc, RateLimitError):
+            raise RateLimited(retry_after_from(exc)) from exc
+        raise
+    await sync_to_async(breaker.record_success, thread_sensitive=False)(time.monotonic() - started)
+    await sync_to_async(limiter.record_usage, thread_sensitive=False)(estimate, _usage_tokens(response))
+    return response
+
+
+def _record_error(breaker, exc: Exception, elapsed: float) -> None:
+    # A 4xx (429 included) means the API answered: that is not an outage.
+    if is_outage(exc):
+        breaker.record_failure()
+    else:
+        breaker.record_success(elapsed)
+
+
+def _car_photo_estimate(request: dict[str, Any]) -> int:
+    system, user = request["messages"]
+    return _estimate_tokens([system["content"], user["content"][0]["text"]], 1, request["max_tokens"])
+
+
+def _jpeg_data_url(fileobj) -> str:
+    encoded = base64.b64encode(prepare_for_vision(fileobj)).decode("utf-8")
+    return f"data:image/jpeg;base64,{encoded}"
+
 
 def _image_payload(user_sticker: UserSticker) -> Optional[Dict[str, Any]]:
     if user_sticker.photo_url:
@@ -19,13 +122,11 @@ def _image_payload(user_sticker: UserSticker) -> Optional[Dict[str, Any]]:
     if user_sticker.photo:
         try:
             with user_sticker.photo.open("rb") as uploaded:
-                encoded = base64.b64encode(uploaded.read()).decode("utf-8")
-            return {
-                "type": "input_image",
-                "image_url": f"data:image/jpeg;base64,{encoded}",
-            }
+                return {"type": "input_image", "image_url": _jpeg_data_url(uploaded)}
         except FileNotFoundError:
             logger.warning("UserSticker photo file not found for id=%s", user_sticker.id)
+        except UnreadableImage as exc:
+            logger.warning("Unreadable UserSticker photo id=%s: %s", user_sticker.id, exc)
         except (NotImplementedError, ValueError):
             try:
                 return {"type": "input_image", "image_url": user_sticker.photo.url}
@@ -35,6 +136,31 @@ def _image_payload(user_sticker: UserSticker) -> Optional[Dict[str, Any]]:
     return None
 
 
+@lru_cache(maxsize=int(getattr(settings, "VISION_REFERENCE_CACHE_SIZE", 128)))
+def _reference_data_url(name: str, version: str) -> str:
+    """
+    Prepared data URL of a sticker reference image. Cached per worker (LRU) and
+    shared through Redis; ``name`` + ``version`` (Sticker.updated_at) change
+    whenever the reference is replaced, so stale entries are never read.
+    """
+    key = f"vision:reference:{hashlib.sha256(name.encode('utf-8')).hexdigest()}:{version}"
+    try:
+        cached = get_redis().get(key)
+    except (RedisError, RuntimeError):
+        cached = None
+    if cached:
+        return cached.decode("utf-8")
+
+    with default_storage.open(name, "rb") as ref:
+        data_url = _jpeg_data_url(ref)
+    timeout = int(getattr(settings, "VISION_REFERENCE_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+    try:
+        get_redis().set(key, data_url, ex=timeout)
+    except (RedisError, RuntimeError):
+        logger.warning("Could not store sticker reference payload in Redis")
+    return data_url
+
+
 def _sticker_reference_payload(sticker: Sticker) -> Optional[Dict[str, Any]]:
     """
     Build an image payload for the sticker reference if available.
@@ -42,11 +168,12 @@ def _sticker_reference_payload(sticker: Sticker) -> Optional[Dict[str, Any]]:
     if not sticker.image_reference:
         return None
     try:
-        with sticker.image_reference.open("rb") as ref:
-            encoded = base64.b64encode(ref.read()).decode("utf-8")
-        return {"type": "input_image", "image_url": f"data:image/jpeg;base64,{encoded}"}
+        data_url = _reference_data_url(sticker.image_reference.name, sticker.updated_at.isoformat())
+        return {"type": "input_image", "image_url": data_url}
     except FileNotFoundError:
         logger.warning("Sticker reference image not found for id=%s", sticker.id)
+    except UnreadableImage as exc:
+        logger.warning("Unreadable sticker reference id=%s: %s", sticker.id, exc)
     except (NotImplementedError, ValueError):
         try:
             return {"type": "input_image", "image_url": sticker.image_reference.url}
@@ -55,22 +182,12 @@ def _sticker_reference_payload(sticker: Sticker) -> Optional[Dict[str, Any]]:
     return None
 
 
-def analyze_car_photo(photo_file, stickers: Iterable[Sticker]) -> dict[str, Any] | None:
-    """
-    Analiza la foto con OpenAI y regresa un JSON con recognized/make/model/.../fun_fact.
-    """
-    if not settings.USE_OPENAI_STICKER_VALIDATION:
-        return {"error": "validación por IA deshabilitada"}
-
+def _photo_data_url(photo_file) -> str | None:
     try:
-        client = get_openai_client()
-    except Exception:  # pragma: no cover
-        logger.exception("No se pudo inicializar el cliente de OpenAI")
+        return _jpeg_data_url(photo_file)
+    except UnreadableImage as exc:
+        logger.warning("Foto de usuario ilegible: %s", exc)
         return None
-
-    try:
-        raw = photo_file.read()
-        b64 = base64.b64encode(raw).decode("utf-8")
     except Exception:
         logger.exception("No se pudo leer la foto del usuario")
         return None
@@ -80,10 +197,25 @@ def analyze_car_photo(photo_file, stickers: Iterable[Sticker]) -> dict[str, Any]
         except Exception:
             pass
 
+
+def _prepare_car_photo(photo_file, stickers: Iterable[Sticker]) -> tuple[str, str] | None:
+    """
+    Return ``(photo_url, stickers_text)`` for the car-photo prompt. Large
+    albums are narrowed to the stickers whose reference images look closest
+    to the photo (``albums.embeddings``).
+    """
+    stickers = shortlist_stickers(photo_file, stickers)
+    photo_url = _photo_data_url(photo_file)
+    if photo_url is None:
+        return None
+
     stickers_text = "\n".join(
         f"- ID {s.id}: {s.name} — {s.description or ''}" for s in stickers
     ) or "No hay stickers en este álbum."
+    return photo_url, stickers_text
+
 
+def _car_photo_request(photo_url: str, stickers_text: str) -> dict[str, Any]:
     system_msg = (
         "Eres un experto en autos. Recibes UNA foto y una lista de stickers de un álbum (solo texto). "
         "Debes identificar el coche usando SOLO la foto y tu conocimiento, y luego decidir si alguno de los stickers coincide.\n\n"
@@ -109,31 +241,67 @@ def analyze_car_photo(photo_file, stickers: Iterable[Sticker]) -> dict[str, Any]
         "Analiza la foto y devuelve SOLO el JSON, sin texto extra."
     )
 
-    try:
-        completion = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": system_msg},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_text},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{b64}"},
-                        },
-                    ],
-                },
-            ],
-            max_tokens=400,
-        )
-        raw_content = completion.choices[0].message.content or "{}"
-        data = json.loads(raw_content)
-    except Exception:
-        logger.exception("No se pudo parsear JSON de OpenAI")
-        return None
+    return {
+        "model": "gpt-4.1-mini",
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": system_msg},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": user_text},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": photo_url},
+                    },
+                ],
+            },
+        ],
+        "max_tokens": 400,
+    }
+
+
+def _identify_car_request(photo_url: str) -> dict[str, Any]:
+    system_msg = (
+        "Eres un experto en autos. Recibes UNA foto y debes identificar el coche usando SOLO la foto y tu conocimiento.\n\n"
+        "Responde SIEMPRE un JSON válido con este esquema EXACTO:\n"
+        "{\n"
+        '  \"recognized\": boolean,            # true si es claramente un coche identificable\n'
+        '  \"make\": string|null,\n'
+        '  \"model\": string|null,\n'
+        '  \"generation\": string|null,\n'
+        '  \"year_range\": string|null,\n'
+        '  \"confidence\": number,            # 0-1 sobre la marca, el modelo y la generación\n'
+        '  \"reason\": string,                # qué detalles de la foto lo identifican\n'
+        '  \"fun_fact\": string               # un dato curioso corto sobre ese modelo; si no es un coche, un mensaje tipo \"no es un coche\"\n'
+        "}\n"
+        "Si NO es un coche (o no estás seguro), usa recognized=false, deja make/model/generation/year_range en null, "
+        "confidence=0, y en fun_fact pon un mensaje divertido tipo \"Uy, esto no parece un coche.\""
+    )
+
+    return {
+        "model": "gpt-4.1-mini",
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": system_msg},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Identifica el coche y devuelve SOLO el JSON, sin texto extra."},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": photo_url},
+                    },
+                ],
+            },
+        ],
+        "max_tokens": 250,
+    }
+
 
+def _parse_car_photo(completion) -> dict[str, Any]:
+    raw_content = completion.choices[0].message.content or "{}"
+    data = json.loads(raw_content)
     data.setdefault("recognized", False)
     data.setdefault("make", None)
     data.setdefault("model", None)
@@ -146,10 +314,125 @@ def analyze_car_photo(photo_file, stickers: Iterable[Sticker]) -> dict[str, Any]
     return data
 
 
+def _complete_car_photo(cache_key: str, request: dict[str, Any]) -> dict[str, Any] | None:
+    cached = get_result(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        client = get_openai_client()
+    except Exception:  # pragma: no cover
+        logger.exception("No se pudo inicializar el cliente de OpenAI")
+        return None
+
+    try:
+        completion = _create_with_limits(
+            client.chat.completions.create, _car_photo_estimate(request), **request
+        )
+        data = _parse_car_photo(completion)
+    except (RateLimited, CircuitOpen):
+        raise
+    except Exception:
+        logger.exception("No se pudo parsear JSON de OpenAI")
+        return None
+
+    store_result(cache_key, data)
+    return data
+
+
+async def _acomplete_car_photo(cache_key: str, request: dict[str, Any]) -> dict[str, Any] | None:
+    cached = await sync_to_async(get_result, thread_sensitive=False)(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        client = get_async_openai_client()
+    except Exception:  # pragma: no cover
+        logger.exception("No se pudo inicializar el cliente de OpenAI")
+        return None
+
+    try:
+        completion = await _acreate_with_limits(
+            client.chat.completions.create, _car_photo_estimate(request), **request
+        )
+        data = _parse_car_photo(completion)
+    except (RateLimited, CircuitOpen):
+        raise
+    except Exception:
+        logger.exception("No se pudo parsear JSON de OpenAI")
+        return None
+
+    await sync_to_async(store_result, thread_sensitive=False)(cache_key, data)
+    return data
+
+
+def analyze_car_photo(photo_file, stickers: Iterable[Sticker]) -> dict[str, Any] | None:
+    """
+    Analiza la foto con OpenAI y regresa un JSON con recognized/make/model/.../fun_fact.
+    Lanza ``RateLimited`` si no hay presupuesto de OpenAI o el proveedor responde 429,
+    y ``CircuitOpen`` si el circuito de OpenAI está abierto.
+    """
+    if not settings.USE_OPENAI_STICKER_VALIDATION:
+        return {"error": "validación por IA deshabilitada"}
+
+    prepared = _prepare_car_photo(photo_file, stickers)
+    if prepared is None:
+        return None
+
+    return _complete_car_photo(result_key("car", *prepared), _car_photo_request(*prepared))
+
+
+def identify_car(photo_file) -> dict[str, Any] | None:
+    """
+    Solo identifica marca/modelo/generación, sin la lista de stickers: el
+    sticker lo resuelve ``achievements.car_lookup``. Mismo formato que
+    ``analyze_car_photo`` con ``sticker_id`` en null.
+    """
+    if not settings.USE_OPENAI_STICKER_VALIDATION:
+        return {"error": "validación por IA deshabilitada"}
+
+    photo_url = _photo_data_url(photo_file)
+    if photo_url is None:
+        return None
+
+    return _complete_car_photo(result_key("identify", photo_url), _identify_car_request(photo_url))
+
+
+async def aanalyze_car_photo(photo_file, stickers: Iterable[Sticker]) -> dict[str, Any] | None:
+    """
+    Versión asíncrona de ``analyze_car_photo`` sobre ``AsyncOpenAI``: la llamada
+    al modelo no ocupa un hilo; solo la preparación de la imagen y la caché
+    (Pillow/Redis, síncronas) corren en el pool de hilos.
+    """
+    if not settings.USE_OPENAI_STICKER_VALIDATION:
+        return {"error": "validación por IA deshabilitada"}
+
+    stickers = list(stickers)
+    prepared = await sync_to_async(_prepare_car_photo, thread_sensitive=False)(photo_file, stickers)
+    if prepared is None:
+        return None
+
+    return await _acomplete_car_photo(result_key("car", *prepared), _car_photo_request(*prepared))
+
+
+async def aidentify_car(photo_file) -> dict[str, Any] | None:
+    """Versión asíncrona de ``identify_car``."""
+    if not settings.USE_OPENAI_STICKER_VALIDATION:
+        return {"error": "validación por IA deshabilitada"}
+
+    photo_url = await sync_to_async(_photo_data_url, thread_sensitive=False)(photo_file)
+    if photo_url is None:
+        return None
+
+    return await _acomplete_car_photo(result_key("identify", photo_url), _identify_car_request(photo_url))
+
+
 def analyze_user_sticker(user_sticker: UserSticker) -> dict[str, Any]:
     """
     Validate a user sticker submission using OpenAI Vision when enabled.
     Falls back to auto-approve when no API key is configured.
+    Raises ``RateLimited`` when the shared OpenAI budget is exhausted or on 429,
+    and ``CircuitOpen`` while the OpenAI circuit is open.
     """
 
     user_image = _image_payload(user_sticker)
@@ -157,7 +440,6 @@ def analyze_user_sticker(user_sticker: UserSticker) -> dict[str, Any]:
         return {"approved": False, "reason": "No image provided"}
 
     sticker: Sticker = user_sticker.sticker
-    reference_image = _sticker_reference_payload(sticker)
 
     if not settings.USE_OPENAI_STICKER_VALIDATION:
         return {
@@ -166,6 +448,13 @@ def analyze_user_sticker(user_sticker: UserSticker) -> dict[str, Any]:
             "details": {},
         }
 
+    cache_key = result_key("sticker", user_image["image_url"], sticker.id, sticker.updated_at.isoformat())
+    cached = get_result(cache_key)
+    if cached is not None:
+        return cached
+
+    reference_image = _sticker_reference_payload(sticker)
+
     try:
         client = get_openai_client()
     except Exception as exc:  # pragma: no cover - guarded by flag
@@ -194,7 +483,9 @@ def analyze_user_sticker(user_sticker: UserSticker) -> dict[str, Any]:
     content.append(user_image)
 
     try:
-        response = client.responses.create(
+        response = _create_with_limits(
+            client.responses.create,
+            _estimate_tokens([prompt], len(content) - 1, 200),
             model="gpt-4.1-mini",
             input=[
                 {
@@ -212,7 +503,7 @@ def analyze_user_sticker(user_sticker: UserSticker) -> dict[str, Any]:
         approved = is_match and match_score >= 0.6
         request_id = getattr(response, "id", None)
 
-        return {
+        result = {
             "approved": approved,
             "match_score": match_score,
             "is_match": is_match,
@@ -220,7 +511,11 @@ def analyze_user_sticker(user_sticker: UserSticker) -> dict[str, Any]:
             "raw_response": data,
             "request_id": request_id,
         }
+        store_result(cache_key, result)
+        return result
 
+    except (RateLimited, CircuitOpen):
+        raise
     except json.JSONDecodeError as exc:
         logger.exception("Failed to parse OpenAI response for UserSticker %s", user_sticker.id)
         return {"approved": False, "error": f"Invalid JSON response: {exc}"}
@@ -0,0 +1,54 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from badgeup.circuit_breaker import circuit_closed
+from .car_lookup import enqueue_refresh
+from .models import UserSticker
+from .tasks import resume_deferred_validations
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(circuit_closed)
+def openai_circuit_closed(sender, name, **kwargs):
+    if name != "openai":
+        return
+    try:
+        resume_deferred_validations.delay()
+    except Exception:  # pragma: no cover - missing broker
+        logger.exception("Could not enqueue resume_deferred_validations")
+
+
+# Fields whose changes can alter what a capture teaches the car lookup.
+LOOKUP_FIELDS = {
+    "sticker",
+    "status",
+    "validated",
+    "detected_make",
+    "detected_model",
+    "detected_generation",
+    "matched_by_lookup",
+}
+
+
+@receiver(post_save, sender=UserSticker)
+def capture_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not LOOKUP_FIELDS.intersection(update_fields)):
+        return
+    approved = instance.status == UserSticker.STATUS_APPROVED and instance.detected_make
+    # A rejection may revoke an approval that was already counted.
+    if not approved and instance.status != UserSticker.STATUS_REJECTED:
+        return
+    sticker_id = instance.sticker_id
+    transaction.on_commit(lambda: enqueue_refresh(sticker_id))
+
+
+@receiver(post_delete, sender=UserSticker)
+def capture_deleted(sender, instance, **kwargs):
+    if instance.status != UserSticker.STATUS_APPROVED:
+        return
+    sticker_id = instance.sticker_id
+    transaction.on_commit(lambda: enqueue_refresh(sticker_id))
@@ -1,14 +1,62 @@
 import logging
+import os
 
 from celery import shared_task
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
 from django.db.models import F
 from django.utils import timezone
 
-from .models import UserSticker
+from albums.matching import match_album_photo
+from badgeup.circuit_breaker import CLOSED, CircuitOpen, get_openai_breaker
+from badgeup.rate_limit import RateLimited, backoff_delay
+from badgeup.redis_client import get_redis
+from . import car_lookup, outbox
+from .models import MatchPhotoJob, UserSticker
+from .serializers import MatchPhotoJobSerializer
 from .services import analyze_user_sticker
+from .utils import send_notification
 
 logger = logging.getLogger(__name__)
 
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+RESUME_LOCK_KEY = "circuit:openai:resume"
+
+
+def _retry_rate_limited(task, exc: RateLimited) -> None:
+    """
+    Reschedule ``task`` with jittered exponential backoff (at least the
+    provider's ``Retry-After``). Returns only once the retry budget is spent.
+    """
+    max_retries = int(getattr(settings, "OPENAI_RATE_LIMIT_MAX_RETRIES", 10))
+    if task.request.retries >= max_retries:
+        return
+    countdown = backoff_delay(task.request.retries, exc.retry_after)
+    logger.info("%s rate limited; retrying in %.1fs", task.name, countdown)
+    raise task.retry(exc=exc, countdown=countdown, max_retries=max_retries)
+
+
+def schedule_deferred_resume(countdown: float) -> None:
+    """
+    Make sure ``resume_deferred_validations`` runs once the circuit may
+    accept probes again; one scheduled run is shared by every deferral.
+    """
+    countdown = max(1, int(countdown) + 1)
+    try:
+        if not get_redis().set(RESUME_LOCK_KEY, 1, nx=True, ex=countdown):
+            return
+    except (RedisError, RuntimeError):
+        pass
+    try:
+        resume_deferred_validations.apply_async(countdown=countdown)
+    except Exception:  # pragma: no cover - missing broker
+        logger.exception("Could not schedule resume_deferred_validations")
+
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=30)
 def validate_user_sticker(self, user_sticker_id: int):
@@ -27,7 +75,17 @@ def validate_user_sticker(self, user_sticker_id: int):
     user_sticker.status = UserSticker.STATUS_VALIDATING
     user_sticker.save(update_fields=["status", "updated_at"])
 
-    result = analyze_user_sticker(user_sticker)
+    try:
+        result = analyze_user_sticker(user_sticker)
+    except RateLimited as exc:
+        _retry_rate_limited(self, exc)
+        result = {"approved": False, "error": str(exc)}
+    except CircuitOpen as exc:
+        user_sticker.status = UserSticker.STATUS_DEFERRED
+        user_sticker.save(update_fields=["status", "updated_at"])
+        schedule_deferred_resume(exc.retry_after)
+        logger.info("UserSticker %s deferred: %s", user_sticker_id, exc)
+        return
 
     if result.get("error"):
         user_sticker.status = UserSticker.STATUS_PENDING
@@ -72,3 +130,134 @@ def validate_user_sticker(self, user_sticker_id: int):
         )
     else:
         logger.info("UserSticker %s rejected: %s", user_sticker_id, result)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def run_match_photo_job(self, job_id: str):
+    try:
+        job = MatchPhotoJob.objects.select_related("user", "album").get(pk=job_id)
+    except MatchPhotoJob.DoesNotExist:
+        logger.warning("MatchPhotoJob %s no longer exists.", job_id)
+        return
+
+    if job.status in {MatchPhotoJob.STATUS_DONE, MatchPhotoJob.STATUS_FAILED}:
+        logger.info("MatchPhotoJob %s already finished. Skipping.", job_id)
+        return
+
+    job.status = MatchPhotoJob.STATUS_RUNNING
+    job.save(update_fields=["status", "updated_at"])
+
+    try:
+        with job.photo.open("rb") as fh:
+            photo = File(fh, name=os.path.basename(job.photo.name))
+            result = match_album_photo(
+                job.user,
+                job.album,
+                photo,
+                lat=job.location_lat,
+                lng=job.location_lng,
+            )
+        job.status = MatchPhotoJob.STATUS_DONE
+    except RateLimited as exc:
+        job.status = MatchPhotoJob.STATUS_PENDING
+        job.save(update_fields=["status", "updated_at"])
+        _retry_rate_limited(self, exc)
+        result = {
+            "unlocked": False,
+            "message": "El servicio de IA está saturado. Intenta de nuevo en unos minutos.",
+        }
+        job.status = MatchPhotoJob.STATUS_FAILED
+    except CircuitOpen as exc:
+        job.status = MatchPhotoJob.STATUS_DEFERRED
+        job.save(update_fields=["status", "updated_at"])
+        schedule_deferred_resume(exc.retry_after)
+        logger.info("MatchPhotoJob %s deferred: %s", job_id, exc)
+        return
+    except Exception:
+        logger.exception("MatchPhotoJob %s failed", job_id)
+        result = {
+            "unlocked": False,
+            "message": "No pudimos analizar la foto. Intenta de nuevo.",
+        }
+        job.status = MatchPhotoJob.STATUS_FAILED
+
+    job.result = result
+    job.photo.delete(save=False)
+    sticker = result.get("sticker") or {}
+    if result.get("unlocked"):
+        message = f"Desbloqueaste {sticker.get('name') or 'un sticker'}"
+    else:
+        message = result.get("message") or "No se desbloqueó ningún sticker."
+    with transaction.atomic():
+        job.save(update_fields=["status", "result", "photo", "updated_at"])
+        send_notification(
+            [job.user_id],
+            {
+                "title": "Resultado de tu foto",
+                "message": message,
+                "category": "match_photo",
+                "job": MatchPhotoJobSerializer(job).data,
+            },
+        )
+
+
+@shared_task
+def resume_deferred_validations():
+    """
+    Re-enqueue the validations and match-photo jobs parked while the OpenAI
+    circuit was open. While half-open only a few go out as probes; the rest
+    follow when a probe closes the circuit.
+    """
+    breaker = get_openai_breaker()
+    state, remaining = breaker.status()
+    if remaining > 0:
+        schedule_deferred_resume(remaining)
+        return
+    limit = None if state == CLOSED else breaker.half_open_calls
+
+    sticker_ids = list(
+        UserSticker.objects.filter(status=UserSticker.STATUS_DEFERRED)
+        .order_by("updated_at")
+        .values_list("id", flat=True)[:limit]
+    )
+    if limit is not None:
+        limit -= len(sticker_ids)
+    job_ids = list(
+        MatchPhotoJob.objects.filter(status=MatchPhotoJob.STATUS_DEFERRED)
+        .order_by("created_at")
+        .values_list("id", flat=True)[:limit]
+    )
+    UserSticker.objects.filter(
+        id__in=sticker_ids, status=UserSticker.STATUS_DEFERRED
+    ).update(status=UserSticker.STATUS_VALIDATING, updated_at=timezone.now())
+    MatchPhotoJob.objects.filter(
+        id__in=job_ids, status=MatchPhotoJob.STATUS_DEFERRED
+    ).update(status=MatchPhotoJob.STATUS_PENDING, updated_at=timezone.now())
+
+    for user_sticker_id in sticker_ids:
+        validate_user_sticker.delay(user_sticker_id)
+    for job_id in job_ids:
+        run_match_photo_job.delay(str(job_id))
+    logger.info("Resumed %s deferred validations and %s match jobs", len(sticker_ids), len(job_ids))
+
+
+@shared_task
+def refresh_car_lookup(sticker_id: int):
+    rows = car_lookup.refresh_sticker(sticker_id)
+    logger.info("Car lookup for sticker %s refreshed (%s cars)", sticker_id, rows)
+
+
+@shared_task
+def drain_outbox():
+    outbox.clear_scheduled()
+    delivered = 0
+    while True:
+        sent, failed = outbox.drain()
+        delivered += sent
+        if failed:
+            outbox.schedule_drain(countdown=float(getattr(settings, "OUTBOX_RETRY_DELAY", 5)))
+            break
+        if not sent:
+            break
+    if delivered:
+        logger.info("Delivered %s outbox rows", delivered)
@@ -1,3 +1,324 @@
-from django.test import TestCase
+import io
+import itertools
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from channels.testing import WebsocketCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from albums.consumers import NotificationConsumer
+from albums.models import Album, Sticker
+from users.models import User
+
+from badgeup.circuit_breaker import CLOSED, HALF_OPEN, OPEN, get_openai_breaker
+
+from . import services, tasks, vision_cache
+from .models import FriendRequest, MatchPhotoJob, Notification, UserSticker
+from .utils import send_notification
+
+
+class NotificationListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_history_is_keyset_paginated_and_marked_read_in_bulk(self):
+        for index in range(25):
+            send_notification([self.user.id], {"title": f"Aviso {index}", "category": "info", "album_id": 1})
+
+        first = self.client.get(reverse("notification-list"))
+        self.assertEqual(len(first.data["results"]), 20)
+        self.assertEqual(first.data["results"][0]["title"], "Aviso 24")
+        self.assertEqual(first.data["results"][0]["data"], {"album_id": 1})
+        self.assertEqual(first.data["unread"], 25)
+
+        second = self.client.get(first.data["next"])
+        self.assertEqual([item["title"] for item in second.data["results"]], [f"Aviso {i}" for i in range(4, -1, -1)])
+        self.assertIsNone(second.data["next"])
+
+        up_to = first.data["results"][-1]["id"]
+        response = self.client.post(reverse("notification-read"), {"up_to": up_to}, format="json")
+        self.assertEqual(response.data, {"updated": 6, "unread": 19})
+        self.assertEqual(Notification.objects.filter(user=self.user, read=False).count(), 19)
+
+    async def test_reconnect_replays_only_missed_notifications(self):
+        token = str(AccessToken.for_user(self.user))
+        missed = (3, [(2, {"title": "Aviso 2"}), (3, {"title": "Aviso 3"})])
+        with mock.patch("albums.consumers.notifications.missed_since", return_value=missed) as missed_since:
+            communicator = WebsocketCommunicator(
+                NotificationConsumer.as_asgi(), f"/ws/notifications/?token={token}&last_seq=1"
+            )
+            connected, _ = await communicator.connect()
+            frames = [await communicator.receive_json_from() for _ in range(3)]
+            await communicator.disconnect()
+
+        self.assertTrue(connected)
+        missed_since.assert_called_once_with(self.user.id, 1)
+        self.assertEqual([frame.get("seq") for frame in frames], [2, 3, 3])
+        self.assertEqual(frames[0]["title"], "Aviso 2")
+        self.assertEqual(frames[-1], {"type": "sync", "seq": 3, "complete": True})
+
+
+class UserPointsQueryCountTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+        album = Album.objects.create(title="Deportivos")
+        self.sticker = Sticker.objects.create(album=album, name="Supra", reward_points=15)
+
+    def _add_members(self, start: int, count: int) -> None:
+        for index in range(start, start + count):
+            member = User.objects.create_user(
+                username=f"member{index}", email=f"member{index}@example.com", password="secret"
+            )
+            UserSticker.objects.create(user=member, sticker=self.sticker, status=UserSticker.STATUS_APPROVED)
+            FriendRequest.objects.create(from_user=member, to_user=self.user)
+
+    def _count_queries(self, name: str) -> int:
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_member_and_request_lists_annotate_points(self):
+        self._add_members(0, 2)
+        members, requests = self._count_queries("friends-members"), self._count_queries("friend-requests")
+        self._add_members(2, 10)
+
+        self.assertEqual(self._count_queries("friends-members"), members)
+        self.assertEqual(self._count_queries("friend-requests"), requests)
+        data = self.client.get(reverse("friends-members")).data
+        self.assertEqual({member["computed_points"] for member in data}, {15})
+
+
+class VisionPayloadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("achievements.services.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        services._reference_data_url.cache_clear()
+        self.addCleanup(services._reference_data_url.cache_clear)
+
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.album = Album.objects.create(title="Deportivos")
+
+    @staticmethod
+    def _upload(name: str, size=(64, 64)) -> SimpleUploadedFile:
+        buffer = io.BytesIO()
+        Image.new("RGB", size, "green").save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_photo_is_sent_as_a_downscaled_jpeg(self):
+        sticker = Sticker.objects.create(album=self.album, name="Coupé")
+        capture = UserSticker.objects.create(user=self.user, sticker=sticker, photo=self._upload("coupe.png"))
+
+        payload = services._image_payload(capture)
+
+        self.assertTrue(payload["image_url"].startswith("data:image/jpeg;base64,"))
+
+    def test_bomb_or_oversized_images_are_not_sent(self):
+        sticker = Sticker.objects.create(
+            album=self.album, name="Coupé", image_reference=self._upload("reference.png")
+        )
+        capture = UserSticker.objects.create(user=self.user, sticker=sticker, photo=self._upload("coupe.png"))
+
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            self.assertIsNone(services._image_payload(capture))
+            self.assertIsNone(services._sticker_reference_payload(sticker))
+        with mock.patch("badgeup.images.VISION_MAX_PIXELS", 100):
+            self.assertIsNone(services._image_payload(capture))
+            self.assertIsNone(services._sticker_reference_payload(sticker))
+
+
+    def test_reference_is_prepared_once_per_sticker_version(self):
+        sticker = Sticker.objects.create(
+            album=self.album, name="Coupé", image_reference=self._upload("reference.png")
+        )
+
+        with mock.patch("achievements.services.prepare_for_vision", wraps=services.prepare_for_vision) as prepare:
+            first = services._sticker_reference_payload(sticker)
+            self.assertEqual(services._sticker_reference_payload(sticker), first)
+            # Another worker: empty LRU, same Redis entry.
+            services._reference_data_url.cache_clear()
+            self.assertEqual(services._sticker_reference_payload(sticker), first)
+            self.assertEqual(prepare.call_count, 1)
+
+            sticker.save()
+            services._sticker_reference_payload(sticker)
+
+        self.assertEqual(prepare.call_count, 2)
+        self.assertEqual(len(self.redis.keys("vision:reference:*")), 2)
+
+class VisionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for patcher in (
+            mock.patch("achievements.vision_cache.get_redis", return_value=self.redis),
+            # Strictly increasing recency scores.
+            mock.patch("achievements.vision_cache.time", time=mock.Mock(side_effect=itertools.count(1))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_hits_and_misses_are_counted_per_kind(self):
+        key = vision_cache.result_key("car", "photo", "stickers")
+
+        self.assertIsNone(vision_cache.get_result(key))
+        vision_cache.store_result(key, {"recognized": True})
+
+        self.assertEqual(vision_cache.get_result(key), {"recognized": True})
+        self.assertEqual(vision_cache.cache_stats(), {"car:misses": 1, "car:hits": 1})
+        self.assertLessEqual(self.redis.ttl(key), 60 * 60 * 24)
+
+    def test_key_depends_on_every_part(self):
+        self.assertNotEqual(
+            vision_cache.result_key("sticker", "photo", 1, "v1"),
+            vision_cache.result_key("sticker", "photo", 1, "v2"),
+        )
+
+    def test_bypass_skips_reads_writes_and_stats(self):
+        key = vision_cache.result_key("car", "photo")
+        vision_cache.store_result(key, {"recognized": True})
+
+        with vision_cache.bypassed():
+            self.assertIsNone(vision_cache.get_result(key))
+            vision_cache.store_result(vision_cache.result_key("car", "other"), {"recognized": False})
+
+        self.assertEqual(vision_cache.cache_stats(), {})
+        self.assertEqual(self.redis.zcard(vision_cache.INDEX_KEY), 1)
+        self.assertEqual(vision_cache.get_result(key), {"recognized": True})
+
+    @override_settings(VISION_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entry_is_evicted(self):
+        first, second, third = (vision_cache.result_key("identify", n) for n in range(3))
+        vision_cache.store_result(first, {"n": 1})
+        vision_cache.store_result(second, {"n": 2})
+        vision_cache.get_result(first)
+
+        vision_cache.store_result(third, {"n": 3})
+
+        self.assertIsNone(vision_cache.get_result(second))
+        self.assertEqual(vision_cache.get_result(first), {"n": 1})
+        self.assertEqual(vision_cache.get_result(third), {"n": 3})
+        self.assertEqual(self.redis.zcard(vision_cache.INDEX_KEY), 2)
+
+
+@override_settings(OPENAI_CIRCUIT_HALF_OPEN_CALLS=1, OPENAI_CIRCUIT_MIN_CALLS=2)
+class OpenAICircuitTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for target in (
+            "badgeup.circuit_breaker.get_redis",
+            "badgeup.rate_limit.get_redis",
+            "achievements.tasks.get_redis",
+        ):
+            patcher = mock.patch(target, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.breaker = get_openai_breaker()
+
+    def _half_open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.redis.hset(self.breaker.state_key, "until", 0)
+
+    def test_probe_answered_with_a_client_error_closes_the_circuit(self):
+        self._half_open()
+
+        with self.assertRaises(ValueError):
+            services._create_with_limits(mock.Mock(side_effect=ValueError("bad request")), 10)
+
+        self.assertEqual(self.breaker.status()[0], CLOSED)
+
+    def test_probe_that_never_ran_is_given_back(self):
+        self._half_open()
+
+        with mock.patch("badgeup.rate_limit.TokenBucketLimiter._try_acquire", return_value=30):
+            with self.assertRaises(services.RateLimited):
+                services._create_with_limits(mock.Mock(), 10)
+        response = services._create_with_limits(mock.Mock(return_value="ok"), 10)
+
+        self.assertEqual(response, "ok")
+        self.assertEqual(self.breaker.status()[0], CLOSED)
+
+    def test_schedule_deferred_resume_is_shared(self):
+        with mock.patch.object(tasks.resume_deferred_validations, "apply_async") as apply_async:
+            tasks.schedule_deferred_resume(12.5)
+            tasks.schedule_deferred_resume(40)
+
+        apply_async.assert_called_once_with(countdown=13)
+
+    def _deferred(self):
+        user = User.objects.create_user(username="collector", email="collector@example.com", password="secret")
+        album = Album.objects.create(title="Deportivos")
+        captures = [
+            UserSticker.objects.create(
+                user=user,
+                sticker=Sticker.objects.create(album=album, name=f"Sticker {i}"),
+                status=UserSticker.STATUS_DEFERRED,
+            )
+            for i in range(2)
+        ]
+        job = MatchPhotoJob.objects.create(user=user, album=album, status=MatchPhotoJob.STATUS_DEFERRED)
+        return captures, job
+
+    def test_resume_waits_while_the_circuit_is_open(self):
+        captures, job = self._deferred()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.status()[0], OPEN)
+
+        with mock.patch("achievements.tasks.schedule_deferred_resume") as schedule:
+            tasks.resume_deferred_validations.apply()
+
+        self.assertAlmostEqual(schedule.call_args.args[0], 30, delta=1)
+        self.assertEqual(UserSticker.objects.filter(status=UserSticker.STATUS_DEFERRED).count(), 2)
+
+    def test_resume_sends_only_probes_while_half_open(self):
+        captures, job = self._deferred()
+        self._half_open()
+        self.breaker.allow()
+        self.assertEqual(self.breaker.status()[0], HALF_OPEN)
+
+        with mock.patch.object(tasks.validate_user_sticker, "delay") as validate, mock.patch.object(
+            tasks.run_match_photo_job, "delay"
+        ) as run_job:
+            tasks.resume_deferred_validations.apply()
+
+        validate.assert_called_once_with(captures[0].id)
+        run_job.assert_not_called()
+
+    def test_resume_requeues_everything_once_closed(self):
+        captures, job = self._deferred()
+
+        with mock.patch.object(tasks.validate_user_sticker, "delay") as validate, mock.patch.object(
+            tasks.run_match_photo_job, "delay"
+        ) as run_job:
+            tasks.resume_deferred_validations.apply()
+
+        self.assertEqual(sorted(call.args[0] for call in validate.call_args_list), sorted(c.id for c in captures))
+        run_job.assert_called_once_with(str(job.id))
+        self.assertFalse(UserSticker.objects.filter(status=UserSticker.STATUS_DEFERRED).exists())
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchPhotoJob.STATUS_PENDING)
@@ -8,6 +8,9 @@ from .views import (
     FriendRequestRejectView,
     FriendsListView,
     MemberListView,
+    NotificationListView,
+    NotificationReadView,
+    NotificationUnreadCountView,
     StickerUnlockView,
     UserStickerHistoryView,
     ChatMessageView,
@@ -40,4 +43,7 @@ urlpatterns = [
         name="friend-remove",
     ),
     path("chat/<int:other_id>/", ChatMessageView.as_view(), name="chat-messages"),
+    path("notifications/", NotificationListView.as_view(), name="notification-list"),
+    path("notifications/read/", NotificationReadView.as_view(), name="notification-read"),
+    path("notifications/unread/", NotificationUnreadCountView.as_view(), name="notification-unread"),
 ]
@@ -1,8 +1,8 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.apps import apps
-from django.db.models import Sum
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 
+from . import notifications, outbox
 from .models import FriendRequest, UserSticker
 
 
@@ -19,16 +19,39 @@ def get_friend_ids(user_id: int) -> list[int]:
 
 
 def send_notification(user_ids: list[int], payload: dict, broadcast: bool = False):
-    channel_layer = get_channel_layer()
-    if not channel_layer:
-        return
-    if broadcast:
-        async_to_sync(channel_layer.group_send)("broadcast", {"type": "notification", "payload": payload})
-    for uid in user_ids:
-        async_to_sync(channel_layer.group_send)(
-            f"user_{uid}",
-            {"type": "notification", "payload": payload},
-        )
+    """
+    Store ``payload`` for ``user_ids`` and record it in the outbox, inside the
+    caller's transaction; ``drain_outbox`` delivers it once that transaction
+    commits. Broadcasts are only pushed, not stored.
+    """
+    notifications.record(user_ids, payload)
+    groups = (["broadcast"] if broadcast else []) + [f"user_{uid}" for uid in user_ids]
+    outbox.enqueue(groups, {"type": "notification", "payload": payload})
+
+
+def annotate_user_points(queryset):
+    """
+    Annotate users with ``computed_points`` (approved captures' reward points)
+    in the same query, so serializers do not aggregate once per user.
+    """
+    points = (
+        UserSticker.objects.filter(user=OuterRef("pk"), status=UserSticker.STATUS_APPROVED)
+        .order_by()
+        .values("user")
+        .annotate(total=Sum("sticker__reward_points"))
+        .values("total")
+    )
+    return queryset.annotate(
+        computed_points=Coalesce(Subquery(points, output_field=IntegerField()), Value(0))
+    )
+
+
+def user_points(user) -> int:
+    """``computed_points`` from ``annotate_user_points`` when present, else one aggregate."""
+    annotated = getattr(user, "computed_points", None)
+    if annotated is not None:
+        return annotated
+    return compute_user_points(user)
 
 
 def compute_user_points(user) -> int:
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import generics, permissions, status
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
@@ -10,22 +11,21 @@ from albums.models import Sticker
 
 from users.models import User
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
+from . import notifications, outbox
 from .consumers import chat_room_name
-from .models import ChatMessage, FriendRequest, UserSticker
+from .models import ChatMessage, FriendRequest, Notification, UserSticker
 from .serializers import (
     ChatMessageSerializer,
     FriendRequestSerializer,
     MemberSerializer,
     MemberWithRelationSerializer,
+    NotificationSerializer,
     StickerUnlockSerializer,
     UserStickerHistorySerializer,
     UserStickerSerializer,
 )
 from .tasks import validate_user_sticker
-from .utils import send_notification
+from .utils import annotate_user_points, send_notification
 
 
 class StickerUnlockView(APIView):
@@ -67,7 +67,11 @@ class FriendRequestListCreateView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         scope = self.request.query_params.get("scope", "all")
-        qs = FriendRequest.objects.select_related("from_user", "to_user")
+        users = annotate_user_points(User.objects.all())
+        qs = FriendRequest.objects.prefetch_related(
+            models.Prefetch("from_user", queryset=users),
+            models.Prefetch("to_user", queryset=users),
+        )
         if scope == "received":
             qs = qs.filter(to_user=self.request.user)
         elif scope == "sent":
@@ -117,19 +121,20 @@ class FriendRequestListCreateView(generics.ListCreateAPIView):
                 serializer = self.get_serializer(existing)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        friend_request = FriendRequest.objects.create(
-            from_user=request.user,
-            to_user=target,
-            status=FriendRequest.STATUS_PENDING,
-        )
-        send_notification(
-            [target.id],
-            {
-                "title": "Solicitud de amistad",
-                "message": f"{request.user.username} quiere agregarte",
-                "category": "friend_request",
-            },
-        )
+        with transaction.atomic():
+            friend_request = FriendRequest.objects.create(
+                from_user=request.user,
+                to_user=target,
+                status=FriendRequest.STATUS_PENDING,
+            )
+            send_notification(
+                [target.id],
+                {
+                    "title": "Solicitud de amistad",
+                    "message": f"{request.user.username} quiere agregarte",
+                    "category": "friend_request",
+                },
+            )
         serializer = self.get_serializer(friend_request)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -147,15 +152,16 @@ class FriendRequestActionView(APIView):
                 return Response({"detail": "No puedes aceptar esta solicitud."}, status=status.HTTP_400_BAD_REQUEST)
             fr.status = FriendRequest.STATUS_ACCEPTED
             fr.responded_at = timezone.now()
-            fr.save(update_fields=["status", "responded_at"])
-            send_notification(
-                [fr.from_user_id],
-                {
-                    "title": "Solicitud aceptada",
-                    "message": f"{request.user.username} ahora es tu amigo",
-                    "category": "friend_accept",
-                },
-            )
+            with transaction.atomic():
+                fr.save(update_fields=["status", "responded_at"])
+                send_notification(
+                    [fr.from_user_id],
+                    {
+                        "title": "Solicitud aceptada",
+                        "message": f"{request.user.username} ahora es tu amigo",
+                        "category": "friend_accept",
+                    },
+                )
         elif action == "reject":
             if fr.to_user != request.user or fr.status != FriendRequest.STATUS_PENDING:
                 return Response({"detail": "No puedes rechazar esta solicitud."}, status=status.HTTP_400_BAD_REQUEST)
@@ -224,7 +230,7 @@ class FriendsListView(generics.ListAPIView):
                 "request_id": fr.id,
             }
         self.relationship_map = relationship_map
-        return User.objects.filter(id__in=other_ids)
+        return annotate_user_points(User.objects.filter(id__in=other_ids))
 
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
@@ -236,7 +242,7 @@ class MemberListView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        users = User.objects.exclude(id=request.user.id)
+        users = annotate_user_points(User.objects.exclude(id=request.user.id))
         serializer = MemberSerializer(users, many=True, context={"request": request})
         return Response(serializer.data)
 
@@ -261,21 +267,17 @@ class ChatMessageView(generics.ListCreateAPIView):
         if not self._is_friend(user.id, other_id):
             raise PermissionDenied("No tienes permiso para chatear con este usuario.")
         other = get_object_or_404(User, pk=other_id)
-        instance = serializer.save(sender=user, recipient=other)
-        payload = ChatMessageSerializer(instance, context={"request": self.request}).data
-        channel_layer = get_channel_layer()
-        group = chat_room_name(user.id, other_id)
-        async_to_sync(channel_layer.group_send)(group, {"type": "chat.message", "message": payload})
-        async_to_sync(channel_layer.group_send)(
-            f"user_{other_id}",
-            {
-                "type": "notification",
-                "payload": {
+        with transaction.atomic():
+            instance = serializer.save(sender=user, recipient=other)
+            payload = ChatMessageSerializer(instance, context={"request": self.request}).data
+            outbox.enqueue([chat_room_name(user.id, other_id)], {"type": "chat.message", "message": payload})
+            send_notification(
+                [other_id],
+                {
                     "title": "Nuevo mensaje",
                     "message": f"{user.username}: {(instance.text or '')[:80]}",
                 },
-            },
-        )
+            )
 
     def _is_friend(self, user_id: int, other_id: int) -> bool:
         if user_id == other_id:
@@ -297,3 +299,46 @@ class UserStickerHistoryView(generics.ListAPIView):
             .select_related("sticker__album")
             .order_by("-unlocked_at")
         )
+
+
+class NotificationPagination(CursorPagination):
+    # Keyset on the primary key: each page is one range scan of
+    # ``notification_user_id_idx`` however deep the user scrolls.
+    ordering = "-id"
+    page_size = 20
+    page_size_query_param = "limit"
+    max_page_size = 100
+
+
+class NotificationListView(generics.ListAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+
+    def get_queryset(self):
+        return Notification.objects.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data["unread"] = notifications.unread_count(request.user.id)
+        return response
+
+
+class NotificationReadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        try:
+            up_to = int(request.data.get("up_to"))
+        except (TypeError, ValueError):
+            return Response({"detail": "Indica up_to (id de notificación)."}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            updated = notifications.mark_read(request.user.id, up_to)
+        return Response({"updated": updated, "unread": notifications.unread_count(request.user.id)})
+
+
+class NotificationUnreadCountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response({"unread": notifications.unread_count(request.user.id)})
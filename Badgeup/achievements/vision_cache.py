@@ -0,0 +1,105 @@
+"""
+Result cache for vision-model calls, keyed by the SHA-256 of the prepared
+image plus whatever else shaped the prompt (sticker list, sticker version).
+
+Entries live in Redis with a TTL; a sorted-set index keeps the cache bounded
+by evicting the least recently used keys, without relying on the server's
+``maxmemory-policy`` (the same Redis also hosts Celery and Channels).
+"""
+
+import hashlib
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from django.conf import settings
+
+from badgeup.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+PREFIX = "vision:result"
+INDEX_KEY = f"{PREFIX}:lru"
+STATS_KEY = f"{PREFIX}:stats"
+
+# Set by ``bypassed()``; process-wide so worker threads see it too.
+_bypass = {"active": False}
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "VISION_CACHE_TIMEOUT", 60 * 60 * 24))
+
+
+def _max_entries() -> int:
+    return int(getattr(settings, "VISION_CACHE_MAX_ENTRIES", 10_000))
+
+
+def result_key(kind: str, *parts: Any) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return f"{PREFIX}:{kind}:{digest.hexdigest()}"
+
+
+@contextmanager
+def bypassed():
+    """Skip the cache (no reads, writes or stats) in this process, e.g. while benchmarking."""
+    previous = _bypass["active"]
+    _bypass["active"] = True
+    try:
+        yield
+    finally:
+        _bypass["active"] = previous
+
+
+def get_result(key: str) -> Optional[dict]:
+    if _bypass["active"]:
+        return None
+    kind = key.split(":")[2]
+    try:
+        client = get_redis()
+        raw = client.get(key)
+        pipe = client.pipeline()
+        pipe.hincrby(STATS_KEY, f"{kind}:{'hits' if raw else 'misses'}", 1)
+        if raw:
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+        pipe.execute()
+    except (RedisError, RuntimeError):
+        logger.warning("Vision result cache unavailable")
+        return None
+    return json.loads(raw) if raw else None
+
+
+def store_result(key: str, result: dict) -> None:
+    if _bypass["active"]:
+        return
+    try:
+        client = get_redis()
+        pipe = client.pipeline()
+        pipe.set(key, json.dumps(result), ex=_ttl())
+        pipe.zadd(INDEX_KEY, {key: time.time()})
+        pipe.zcard(INDEX_KEY)
+        size = pipe.execute()[-1]
+        overflow = size - _max_entries()
+        if overflow > 0:
+            evicted = [member for member, _ in client.zpopmin(INDEX_KEY, overflow)]
+            if evicted:
+                client.delete(*evicted)
+    except (RedisError, RuntimeError):
+        logger.warning("Could not store vision result %s", key)
+
+
+def cache_stats() -> dict[str, int]:
+    try:
+        raw = get_redis().hgetall(STATS_KEY)
+    except (RedisError, RuntimeError):
+        return {}
+    return {k.decode(): int(v) for k, v in raw.items()}
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AlbumsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'albums'
+
+    def ready(self):
+        from badgeup.images import register_variant_field
+
+        from . import signals  # noqa: F401
+        from .models import Album, Sticker
+
+        register_variant_field(Album, "cover_image", "cover_variants")
+        register_variant_field(Sticker, "image_reference", "image_variants")
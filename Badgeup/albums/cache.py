@@ -0,0 +1,124 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.shortcuts import get_object_or_404
+
+from achievements.models import UserSticker
+from badgeup.redis_client import get_redis
+
+from .models import Sticker
+from .serializers import AlbumDetailSerializer, StickerSerializer
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+CAPTURE_FIELDS = (
+    "is_unlocked",
+    "status",
+    "unlocked_photo_url",
+    "unlocked_photo_variants",
+    "user_message",
+    "fun_fact",
+    "unlocked_at",
+    "location_label",
+    "location_lat",
+    "location_lng",
+)
+
+
+def _version_key(album_id: int) -> str:
+    return f"album:catalog:version:{album_id}"
+
+
+def _catalog_key(album_id: int, version: int, host: str) -> str:
+    return f"album:catalog:{album_id}:v{version}:{host}"
+
+
+def _timeout() -> int:
+    return int(getattr(settings, "ALBUM_CATALOG_CACHE_TIMEOUT", 60 * 60))
+
+
+def bump_catalog_version(album_id: int) -> None:
+    """Invalidate every cached catalog of the album by moving to a new version."""
+    try:
+        get_redis().incr(_version_key(album_id))
+    except (RedisError, RuntimeError):
+        logger.warning("Could not bump catalog version for album %s", album_id)
+
+
+def build_album_catalog(album_id: int, request, queryset) -> dict:
+    """
+    Serialize the user-independent part of the album detail (album fields and
+    sticker catalog). Capture fields come out with their anonymous defaults.
+    """
+    album = get_object_or_404(queryset, pk=album_id)
+    context = {"request": request, "catalog_only": True}
+    return AlbumDetailSerializer(album, context=context).data
+
+
+def get_album_catalog(album_id: int, request, queryset) -> dict:
+    try:
+        client = get_redis()
+        version = int(client.get(_version_key(album_id)) or 0)
+        key = _catalog_key(album_id, version, request.get_host())
+        cached = client.get(key)
+    except (RedisError, RuntimeError):
+        logger.warning("Album catalog cache unavailable; serializing album %s", album_id)
+        return build_album_catalog(album_id, request, queryset)
+
+    if cached:
+        return json.loads(cached)
+
+    catalog = build_album_catalog(album_id, request, queryset)
+    try:
+        client.set(key, json.dumps(catalog, cls=DjangoJSONEncoder), ex=_timeout())
+    except RedisError:
+        logger.warning("Could not store catalog for album %s", album_id)
+    return catalog
+
+
+def apply_user_overlay(catalog: dict, request) -> dict:
+    """
+    Merge the requesting user's captures into a cached catalog. Only stickers the
+    user has a UserSticker for are touched; the rest keep the catalog defaults.
+    """
+    data = dict(catalog)
+    stickers = [dict(entry) for entry in catalog.get("stickers", [])]
+    data["stickers"] = stickers
+    data["captured_count"] = 0
+    data["points_earned"] = 0
+    data["completion_pct"] = 0.0
+
+    user = getattr(request, "user", None)
+    if not user or not user.is_authenticated:
+        return data
+
+    captures = {
+        us.sticker_id: us
+        for us in UserSticker.objects.filter(user=user, sticker__album_id=catalog["id"])
+    }
+    overlay = StickerSerializer(context={"request": request, "user_stickers": captures})
+    for entry in stickers:
+        capture = captures.get(entry["id"])
+        if capture is None:
+            continue
+        sticker = Sticker(
+            id=entry["id"],
+            location_lat=entry["location_lat"],
+            location_lng=entry["location_lng"],
+        )
+        for field in CAPTURE_FIELDS:
+            entry[field] = getattr(overlay, f"get_{field}")(sticker)
+        if capture.status == UserSticker.STATUS_APPROVED:
+            data["captured_count"] += 1
+            data["points_earned"] += entry["reward_points"] or 0
+
+    if data.get("stickers_count"):
+        data["completion_pct"] = round(100 * data["captured_count"] / data["stickers_count"], 1)
+    return data
@@ -3,10 +3,18 @@ from urllib.parse import parse_qs
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework_simplejwt.tokens import AccessToken
 
+from achievements import notifications
 from achievements.models import ChatMessage, FriendRequest
 from achievements.serializers import ChatMessageSerializer
+from achievements.utils import send_notification
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
 
 
 User = get_user_model()
@@ -81,22 +89,20 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             self.room_group_name,
             {"type": "chat.message", "message": message},
         )
-        await self.channel_layer.group_send(
-            f"user_{other_id}",
-            {
-                "type": "notification",
-                "payload": {
-                    "title": "Nuevo mensaje",
-                    "message": f"{user.username}: {text[:80]}",
-                },
-            },
-        )
 
     @sync_to_async
     def _create_message(self, sender_id: int, recipient_id: int, text: str):
         sender = User.objects.get(pk=sender_id)
         recipient = User.objects.get(pk=recipient_id)
-        msg = ChatMessage.objects.create(sender=sender, recipient=recipient, text=text)
+        with transaction.atomic():
+            msg = ChatMessage.objects.create(sender=sender, recipient=recipient, text=text)
+            send_notification(
+                [recipient_id],
+                {
+                    "title": "Nuevo mensaje",
+                    "message": f"{sender.username}: {text[:80]}",
+                },
+            )
         return ChatMessageSerializer(msg).data
 
     async def chat_message(self, event):
@@ -121,6 +127,28 @@ class NotificationConsumer(AsyncJsonWebsocketConsumer):
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.channel_layer.group_add("broadcast", self.channel_name)
         await self.accept()
+        # Joined the groups first: anything sent during the replay also
+        # arrives live, and the client drops sequences it has already seen.
+        await self._replay(user.id, qs.get("last_seq", [None])[0])
+
+    async def _replay(self, user_id: int, raw_last_seq):
+        try:
+            last_seq = int(raw_last_seq) if raw_last_seq else None
+        except ValueError:
+            last_seq = None
+        try:
+            if last_seq is None:
+                current, missed = await sync_to_async(notifications.current_seq, thread_sensitive=False)(user_id), []
+            else:
+                current, missed = await sync_to_async(notifications.missed_since, thread_sensitive=False)(
+                    user_id, last_seq
+                )
+        except (RedisError, RuntimeError):
+            current, missed = None, None
+        for seq, payload in missed or []:
+            await self.send_json({"type": "notification", "seq": seq, "replayed": True, **payload})
+        # ``complete`` false: the gap is no longer in the stream, refetch over REST.
+        await self.send_json({"type": "sync", "seq": current, "complete": missed is not None})
 
     async def disconnect(self, close_code):
         if hasattr(self, "group_name"):
@@ -128,4 +156,7 @@ class NotificationConsumer(AsyncJsonWebsocketConsumer):
         await self.channel_layer.group_discard("broadcast", self.channel_name)
 
     async def notification(self, event):
-        await self.send_json({"type": "notification", **event.get("payload", {})})
+        message = {"type": "notification", **event.get("payload", {})}
+        if "seq" in event:
+            message["seq"] = event["seq"]
+        await self.send_json(message)
@@ -0,0 +1,314 @@
+"""
+Local image embeddings of sticker reference images.
+
+Every ``Sticker.image_reference`` is reduced to a unit vector made of an HSV
+colour histogram and a grid of gradient-orientation histograms over a
+downsampled grayscale copy (CPU only: Pillow decoding + NumPy). The vectors
+live in one compressed ``.npz`` file in default storage, rewritten by the
+``refresh_sticker_index`` task when stickers change; every process keeps the
+loaded index in memory and reloads it when the version in Redis moves.
+
+``shortlist_stickers`` ranks an album's stickers by cosine similarity to the
+user's photo so only the closest candidates go into the vision prompt.
+"""
+
+import io
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from badgeup.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    np = None  # type: ignore
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    Image = None  # type: ignore
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+INDEX_NAME = getattr(settings, "STICKER_INDEX_NAME", "stickers/index/embeddings.npz")
+SHORTLIST_SIZE = int(getattr(settings, "STICKER_SHORTLIST_SIZE", 12))
+VERSION_KEY = "sticker:index:version"
+LOCK_KEY = "sticker:index:lock"
+PENDING_KEY = "sticker:index:pending"
+SCHEDULED_KEY = "sticker:index:scheduled"
+
+FEATURE_EDGE = 64
+HSV_BINS = (8, 4, 4)
+GRID = 4
+ORIENTATIONS = 8
+# Without Redis, reload the index from storage at most this often.
+RELOAD_SECONDS = 60
+
+_loaded = {"version": None, "at": 0.0, "index": None}
+
+
+def available() -> bool:
+    return np is not None and Image is not None
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def extract_features(fileobj):
+    """
+    Return the float32 unit feature vector of the image in ``fileobj``.
+    Unreadable or oversized images raise ``OSError``/``ValueError``.
+    """
+    start = fileobj.tell() if hasattr(fileobj, "tell") else 0
+    try:
+        with Image.open(fileobj) as original:
+            original.draft("RGB", (FEATURE_EDGE * 2, FEATURE_EDGE * 2))
+            image = ImageOps.exif_transpose(original).convert("RGB")
+            image = image.resize((FEATURE_EDGE, FEATURE_EDGE), Image.BILINEAR)
+    except Image.DecompressionBombError as exc:
+        raise ValueError(str(exc)) from exc
+    finally:
+        fileobj.seek(start)
+
+    hsv = np.asarray(image.convert("HSV"), dtype=np.uint16)
+    h_bins, s_bins, v_bins = HSV_BINS
+    bins = (
+        (hsv[..., 0] * h_bins >> 8) * s_bins * v_bins
+        + (hsv[..., 1] * s_bins >> 8) * v_bins
+        + (hsv[..., 2] * v_bins >> 8)
+    )
+    colour = np.sqrt(np.bincount(bins.ravel(), minlength=h_bins * s_bins * v_bins))
+
+    gray = np.asarray(image.convert("L"), dtype=np.float32)
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    magnitude = np.hypot(gx, gy)
+    orientation = np.minimum(
+        (np.mod(np.arctan2(gy, gx), np.pi) * ORIENTATIONS / np.pi).astype(np.int64), ORIENTATIONS - 1
+    )
+    cell = np.arange(FEATURE_EDGE) * GRID // FEATURE_EDGE
+    cells = cell[:, None] * GRID + cell[None, :]
+    gradients = np.bincount(
+        (cells * ORIENTATIONS + orientation).ravel(),
+        weights=magnitude.ravel(),
+        minlength=GRID * GRID * ORIENTATIONS,
+    )
+
+    return _unit(np.concatenate([_unit(colour), _unit(gradients)])).astype(np.float32)
+
+
+def _empty_index() -> dict:
+    return {
+        "ids": np.zeros(0, dtype=np.int64),
+        "album_ids": np.zeros(0, dtype=np.int64),
+        "names": np.zeros(0, dtype=str),
+        "vectors": np.zeros((0, feature_size()), dtype=np.float16),
+    }
+
+
+def feature_size() -> int:
+    h_bins, s_bins, v_bins = HSV_BINS
+    return h_bins * s_bins * v_bins + GRID * GRID * ORIENTATIONS
+
+
+def load_index() -> dict:
+    try:
+        with default_storage.open(INDEX_NAME, "rb") as fh:
+            with np.load(io.BytesIO(fh.read())) as data:
+                return {key: data[key] for key in ("ids", "album_ids", "names", "vectors")}
+    except FileNotFoundError:
+        return _empty_index()
+    except (OSError, ValueError, KeyError):
+        logger.exception("Could not read sticker index %s", INDEX_NAME)
+        return _empty_index()
+
+
+def _write_index(content: bytes) -> None:
+    """
+    Replace the index file without a window where it is missing: the new
+    index is written under a temporary name and renamed over the old one.
+    Storages without local paths (object stores) get delete + save, and a
+    reader caught in between falls back to the full album until the next
+    version bump.
+    """
+    try:
+        target = default_storage.path(INDEX_NAME)
+    except NotImplementedError:
+        if default_storage.exists(INDEX_NAME):
+            default_storage.delete(INDEX_NAME)
+        default_storage.save(INDEX_NAME, ContentFile(content))
+        return
+
+    folder, filename = os.path.split(INDEX_NAME)
+    temporary = default_storage.save(os.path.join(folder, f".{uuid.uuid4().hex}-{filename}"), ContentFile(content))
+    try:
+        os.replace(default_storage.path(temporary), target)
+    except OSError:
+        default_storage.delete(temporary)
+        raise
+
+
+def save_index(index: dict) -> None:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **index)
+    _write_index(buffer.getvalue())
+    try:
+        get_redis().incr(VERSION_KEY)
+    except (RedisError, RuntimeError):
+        logger.warning("Could not bump sticker index version")
+    _loaded.update(version=None, at=0.0, index=index)
+
+
+def get_index() -> dict:
+    """The in-memory index, reloaded when another process rewrote it."""
+    try:
+        version = get_redis().get(VERSION_KEY)
+        stale = version != _loaded["version"]
+    except (RedisError, RuntimeError):
+        version = None
+        stale = time.monotonic() - _loaded["at"] > RELOAD_SECONDS
+    if _loaded["index"] is None or stale:
+        _loaded.update(version=version, at=time.monotonic(), index=load_index())
+    return _loaded["index"]
+
+
+def refresh_index(sticker_ids=None) -> int:
+    """
+    Bring the vectors of ``sticker_ids`` (every sticker when ``None``) up to
+    date: deleted stickers and removed images drop out, new or replaced images
+    are recomputed, unchanged ones are kept. Returns the number of vectors
+    computed.
+    """
+    from .models import Sticker
+
+    try:
+        lock = get_redis().lock(LOCK_KEY, timeout=300, blocking_timeout=300)
+        lock.acquire()
+    except (RedisError, RuntimeError):
+        lock = None
+    try:
+        index = _empty_index() if sticker_ids is None else load_index()
+        stickers = Sticker.objects.exclude(image_reference="").exclude(image_reference__isnull=True)
+        if sticker_ids is not None:
+            stickers = stickers.filter(pk__in=sticker_ids)
+        indexed = dict(zip(index["ids"].tolist(), index["names"].tolist()))
+        current = list(stickers.only("pk", "album_id", "image_reference"))
+        unchanged = {s.pk for s in current if indexed.get(s.pk) == s.image_reference.name}
+        changed = [s for s in current if s.pk not in unchanged]
+        stale = set(sticker_ids or []) - unchanged
+        if sticker_ids is not None and not changed and not stale & set(indexed):
+            return 0
+
+        keep = ~np.isin(index["ids"], list(stale) + [s.pk for s in changed])
+        index = {key: value[keep] for key, value in index.items()}
+
+        rows = []
+        for sticker in changed:
+            try:
+                with sticker.image_reference.open("rb") as fh:
+                    vector = extract_features(fh)
+            except (OSError, ValueError):
+                logger.warning("Could not index reference image of sticker %s", sticker.pk)
+                continue
+            rows.append((sticker.pk, sticker.album_id, sticker.image_reference.name, vector))
+
+        if rows:
+            ids, album_ids, names, vectors = zip(*rows)
+            index = {
+                "ids": np.concatenate([index["ids"], np.array(ids, dtype=np.int64)]),
+                "album_ids": np.concatenate([index["album_ids"], np.array(album_ids, dtype=np.int64)]),
+                "names": np.concatenate([index["names"], np.array(names, dtype=str)]),
+                "vectors": np.concatenate([index["vectors"], np.stack(vectors).astype(np.float16)]),
+            }
+        save_index(index)
+        return len(rows)
+    finally:
+        if lock is not None:
+            try:
+                lock.release()
+            except (RedisError, RuntimeError):
+                pass
+
+
+def enqueue_index_refresh(sticker_ids=None) -> None:
+    """
+    Queue a refresh of ``sticker_ids`` (the whole index when ``None``). Ids
+    are collected in a Redis set and picked up by a single
+    ``refresh_sticker_index`` run ``STICKER_INDEX_BATCH_SECONDS`` later, so a
+    burst of sticker edits rewrites the index once.
+    """
+    from .tasks import refresh_sticker_index
+
+    args, countdown = [sticker_ids], None
+    if sticker_ids is not None:
+        sticker_ids = list(sticker_ids)
+        if not sticker_ids:
+            return
+        countdown = int(getattr(settings, "STICKER_INDEX_BATCH_SECONDS", 10))
+        try:
+            pipe = get_redis().pipeline()
+            pipe.sadd(PENDING_KEY, *sticker_ids)
+            pipe.set(SCHEDULED_KEY, 1, nx=True, ex=countdown + 300)
+            if not pipe.execute()[1]:
+                return
+            args = [None, True]
+        except (RedisError, RuntimeError):
+            countdown = None
+    try:
+        refresh_sticker_index.apply_async(args=args, countdown=countdown)
+    except Exception:  # pragma: no cover - fallback for missing broker
+        refresh_sticker_index.apply(args=args)
+
+
+def pop_pending_ids() -> list[int]:
+    """Take the ids collected by ``enqueue_index_refresh``; later ones schedule a new run."""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.smembers(PENDING_KEY)
+        pipe.delete(PENDING_KEY, SCHEDULED_KEY)
+        return sorted(int(pk) for pk in pipe.execute()[0])
+    except (RedisError, RuntimeError):
+        # The ids stay queued; the next enqueue after SCHEDULED_KEY expires picks them up.
+        logger.warning("Could not read pending sticker index refreshes")
+        return []
+
+
+def shortlist_stickers(photo_file, stickers, size: int = SHORTLIST_SIZE) -> list:
+    """
+    The ``size`` indexed stickers most similar to ``photo_file``, plus every
+    sticker the index cannot rank (no reference image or not indexed yet), in
+    album order. Small albums and failures return ``stickers`` unchanged.
+    """
+    stickers = list(stickers)
+    if not available() or size <= 0 or len(stickers) <= size:
+        return stickers
+    try:
+        index = get_index()
+        mask = np.isin(index["ids"], [s.id for s in stickers])
+        if mask.sum() <= size:
+            return stickers
+        query = extract_features(photo_file)
+    except (OSError, ValueError):
+        logger.warning("Sticker shortlist unavailable; sending the whole album")
+        return stickers
+
+    ids = index["ids"][mask]
+    scores = index["vectors"][mask].astype(np.float32) @ query
+    chosen = set(ids[np.argpartition(-scores, size - 1)[:size]].tolist())
+    indexed = set(ids.tolist())
+    return [s for s in stickers if s.id in chosen or s.id not in indexed]
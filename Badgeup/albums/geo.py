@@ -0,0 +1,148 @@
+import math
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Q, Sum, Window
+from django.db.models.functions import Cast, Floor, RowNumber
+from rest_framework.exceptions import ValidationError
+
+from . import geohash
+
+# Grid cells per 256px map tile: at a given zoom a cell is ~64px on screen.
+CELLS_PER_TILE = 4
+MAX_ZOOM = 20
+MAX_CLUSTERS = 400
+
+
+def parse_bbox(raw: str) -> tuple[float, float, float, float]:
+    """Parse ``minLng,minLat,maxLng,maxLat`` and validate its ranges."""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in raw.split(","))
+    except ValueError:
+        raise ValidationError({"bbox": "Usa el formato minLng,minLat,maxLng,maxLat."})
+    if not (-90 <= min_lat <= max_lat <= 90) or not all(-180 <= v <= 180 for v in (min_lng, max_lng)):
+        raise ValidationError({"bbox": "Coordenadas fuera de rango."})
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def filter_bbox(queryset, bbox):
+    """
+    Restrict ``queryset`` to rows whose ``location_lat/lng`` fall inside ``bbox``.
+    A viewport crossing the antimeridian (minLng > maxLng) is split in two.
+    """
+    min_lng, min_lat, max_lng, max_lat = bbox
+    queryset = queryset.filter(location_lat__gte=min_lat, location_lat__lte=max_lat)
+    if min_lng <= max_lng:
+        return queryset.filter(location_lng__gte=min_lng, location_lng__lte=max_lng)
+    return queryset.filter(Q(location_lng__gte=min_lng) | Q(location_lng__lte=max_lng))
+
+
+def grid_cell_size(zoom: int, bbox=None) -> float:
+    """
+    Cell size in degrees for ``zoom``, widened when needed so the viewport never
+    holds more than ``MAX_CLUSTERS`` cells.
+    """
+    cell = 360.0 / (2 ** zoom * CELLS_PER_TILE)
+    min_lng, min_lat, max_lng, max_lat = bbox or (-180.0, -90.0, 180.0, 90.0)
+    lng_span = max_lng - min_lng if min_lng <= max_lng else 360.0 - (min_lng - max_lng)
+    lat_span = max_lat - min_lat
+    min_cell = math.sqrt(max(lng_span, 1e-9) * max(lat_span, 1e-9) / MAX_CLUSTERS)
+    return max(cell, min_cell)
+
+
+def cluster_locations(queryset, zoom: int, bbox=None) -> dict:
+    """
+    Group located captures into a lat/lng grid. One GROUP BY on the cell gives
+    each cluster's count and centroid; a second on (cell, album), ranked per
+    cell and filtered to the first, gives its top album. Both return one row
+    per cell however many albums share it.
+    """
+    cell = grid_cell_size(zoom, bbox)
+    if bbox:
+        queryset = filter_bbox(queryset, bbox)
+
+    located = (
+        queryset.order_by()
+        .annotate(
+            lat=Cast(F("location_lat"), FloatField()),
+            lng=Cast(F("location_lng"), FloatField()),
+        )
+        .annotate(
+            cell_y=Floor((F("lat") + 90.0) / cell),
+            cell_x=Floor((F("lng") + 180.0) / cell),
+        )
+    )
+    cells = located.values("cell_x", "cell_y").annotate(
+        total=Count("id"), lat_sum=Sum("lat"), lng_sum=Sum("lng")
+    )
+    top_albums = (
+        located.values("cell_x", "cell_y", "sticker__album_id", "sticker__album__title")
+        .annotate(total=Count("id"))
+        .annotate(
+            rank=Window(
+                RowNumber(),
+                partition_by=[F("cell_x"), F("cell_y")],
+                order_by=[F("total").desc(), F("sticker__album_id").asc()],
+            )
+        )
+        .filter(rank=1)
+    )
+    top_by_cell = {
+        (row["cell_x"], row["cell_y"]): {
+            "id": row["sticker__album_id"],
+            "title": row["sticker__album__title"],
+            "count": row["total"],
+        }
+        for row in top_albums
+    }
+
+    clusters = [
+        {
+            "lat": round(row["lat_sum"] / row["total"], 6),
+            "lng": round(row["lng_sum"] / row["total"], 6),
+            "count": row["total"],
+            "top_album": top_by_cell.get((row["cell_x"], row["cell_y"])),
+        }
+        for row in cells
+    ]
+    clusters.sort(key=lambda c: c["count"], reverse=True)
+    return {"zoom": zoom, "cell_size": cell, "clusters": clusters}
+
+
+def radius_bbox(lat: float, lng: float, radius_km: float) -> tuple[float, float, float, float]:
+    """Smallest ``(minLng, minLat, maxLng, maxLat)`` box holding the circle of ``radius_km``."""
+    lat_delta = radius_km / geohash.KM_PER_DEGREE
+    min_lat, max_lat = max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 0 or radius_km / (geohash.KM_PER_DEGREE * cos_lat) >= 180:
+        return -180.0, min_lat, 180.0, max_lat
+    lng_delta = radius_km / (geohash.KM_PER_DEGREE * cos_lat)
+    min_lng, max_lng = ((value + 180) % 360 - 180 for value in (lng - lng_delta, lng + lng_delta))
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def nearby(queryset, lat: float, lng: float, radius_km: float, limit: int) -> list:
+    """
+    Rows of ``queryset`` within ``radius_km`` of (lat, lng), closest first.
+    A geohash prefix scan over the centre cell and its neighbours plus the
+    circle's lat/lng bounding box narrow the candidates in the query, capped
+    at ``NEARBY_MAX_CANDIDATES``; the exact haversine distance then filters
+    and orders them. Each returned object gets a ``distance_km`` attribute.
+    """
+    precision = geohash.precision_for_radius(radius_km, lat)
+    if precision:
+        prefixes = Q()
+        for cell in geohash.neighbours(geohash.encode(lat, lng, precision)):
+            prefixes |= Q(geohash__startswith=cell)
+        queryset = queryset.filter(prefixes)
+    else:
+        queryset = queryset.exclude(geohash="")
+    queryset = filter_bbox(queryset, radius_bbox(lat, lng, radius_km))
+
+    max_candidates = int(getattr(settings, "NEARBY_MAX_CANDIDATES", 5000))
+    results = []
+    for obj in queryset[:max_candidates]:
+        distance = geohash.haversine_km(lat, lng, float(obj.location_lat), float(obj.location_lng))
+        if distance <= radius_km:
+            obj.distance_km = round(distance, 3)
+            results.append(obj)
+    results.sort(key=lambda obj: obj.distance_km)
+    return results[:limit]
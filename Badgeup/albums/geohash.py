@@ -0,0 +1,117 @@
+"""
+Minimal geohash helpers used to index ``location_lat/location_lng`` pairs so
+"nearby" lookups can use a btree prefix scan instead of PostGIS.
+"""
+
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def encode(lat: float, lng: float, precision: int = PRECISION) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def decode(geohash: str) -> tuple[float, float, float, float]:
+    """Return ``(lat, lng, lat_err, lng_err)`` for the centre of the cell."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (
+        (lat_range[0] + lat_range[1]) / 2,
+        (lng_range[0] + lng_range[1]) / 2,
+        (lat_range[1] - lat_range[0]) / 2,
+        (lng_range[1] - lng_range[0]) / 2,
+    )
+
+
+def neighbours(geohash: str) -> list[str]:
+    """The cell itself plus its (up to) eight surrounding cells."""
+    lat, lng, lat_err, lng_err = decode(geohash)
+    cells = []
+    for dy in (-1, 0, 1):
+        n_lat = lat + dy * 2 * lat_err
+        if not -90 < n_lat < 90:
+            continue
+        for dx in (-1, 0, 1):
+            n_lng = (lng + dx * 2 * lng_err + 180) % 360 - 180
+            cell = encode(n_lat, n_lng, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def cell_size_km(precision: int, lat: float) -> tuple[float, float]:
+    """Height and width in km of a geohash cell of ``precision`` at ``lat``."""
+    bits = 5 * precision
+    lat_bits, lng_bits = bits // 2, bits - bits // 2
+    height = 180.0 / 2 ** lat_bits * KM_PER_DEGREE
+    width = 360.0 / 2 ** lng_bits * KM_PER_DEGREE * math.cos(math.radians(lat))
+    return height, width
+
+
+def precision_for_radius(radius_km: float, lat: float) -> int:
+    """Longest prefix whose 3x3 neighbourhood still covers ``radius_km``."""
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size_km(precision, lat)
+        if height >= radius_km and width >= radius_km:
+            return precision
+    return 0
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def location_geohash(lat, lng) -> str:
+    if lat is None or lng is None:
+        return ""
+    return encode(float(lat), float(lng))
+
+
+def with_geohash_field(update_fields):
+    """Add ``geohash`` to ``update_fields`` when a location field is being saved."""
+    if update_fields is None:
+        return None
+    update_fields = set(update_fields)
+    if update_fields & {"location_lat", "location_lng"}:
+        update_fields.add("geohash")
+    return update_fields
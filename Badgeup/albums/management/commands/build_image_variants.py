@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from albums.tasks import generate_image_variants
+from badgeup.images import VARIANT_FIELDS, needs_variants
+
+
+class Command(BaseCommand):
+    help = "Encola la generación de miniaturas para imágenes que aún no tienen variantes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sync", action="store_true", help="Generar en este proceso en lugar de Celery")
+
+    def handle(self, *args, **options):
+        total = 0
+        for (label, field_name), variants_field in VARIANT_FIELDS.items():
+            model = apps.get_model(label)
+            rows = (
+                model.objects.exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .only("pk", field_name, variants_field)
+            )
+            queued = 0
+            for instance in rows.iterator():
+                if not needs_variants(getattr(instance, field_name), getattr(instance, variants_field)):
+                    continue
+                if options["sync"]:
+                    generate_image_variants.apply(args=[label, instance.pk, field_name])
+                else:
+                    generate_image_variants.delay(label, instance.pk, field_name)
+                queued += 1
+            self.stdout.write(f"{label}.{field_name}: {queued}")
+            total += queued
+        self.stdout.write(self.style.SUCCESS(f"{total} imágenes en cola"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from albums import embeddings
+from albums.tasks import refresh_sticker_index
+
+
+class Command(BaseCommand):
+    help = "Recalcula el índice de embeddings de las imágenes de referencia de los stickers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--async",
+            dest="use_celery",
+            action="store_true",
+            help="Encolar en Celery en lugar de calcular aquí",
+        )
+
+    def handle(self, *args, **options):
+        if not embeddings.available():
+            raise CommandError("NumPy y Pillow son necesarios para el índice de stickers")
+        if options["use_celery"]:
+            refresh_sticker_index.delay()
+            self.stdout.write(self.style.SUCCESS("Reconstrucción del índice en cola"))
+            return
+        computed = embeddings.refresh_index()
+        self.stdout.write(self.style.SUCCESS(f"{computed} stickers indexados en {embeddings.INDEX_NAME}"))
@@ -0,0 +1,261 @@
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from achievements.utils import send_notification
+from albums.cache import bump_catalog_version
+from albums.embeddings import enqueue_index_refresh
+from albums.geohash import location_geohash
+from albums.models import Album, Sticker
+from badgeup.images import enqueue_variants
+
+ALBUM_FIELDS = ("title", "description", "theme", "is_premium", "price")
+STICKER_UPDATE_FIELDS = [
+    "description",
+    "location_lat",
+    "location_lng",
+    "geohash",
+    "image_reference",
+    "reward_points",
+    "order",
+    "rarity",
+    "updated_at",
+]
+
+
+def _decimal(value):
+    if value in (None, ""):
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise CommandError(f"Valor numérico inválido: {value!r}")
+
+
+def _int(value, field: str, row: int):
+    """Non-negative integer ``value`` of ``field``; ``None`` when empty."""
+    if value in (None, ""):
+        return None
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise CommandError(f"Fila {row}: '{field}' debe ser un entero, no {value!r}")
+    if number < 0:
+        raise CommandError(f"Fila {row}: '{field}' no puede ser negativo ({number})")
+    return number
+
+
+def _bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa (o actualiza) un álbum y sus stickers desde un manifiesto CSV o JSON "
+        "y un directorio de imágenes de referencia"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", help="Ruta al manifiesto .json o .csv")
+        parser.add_argument("--images", help="Directorio de imágenes (por defecto, el del manifiesto)")
+        parser.add_argument("--album-id", type=int, help="Actualizar este álbum en vez de buscarlo por título")
+        parser.add_argument("--title", help="Título del álbum (obligatorio para CSV si no se usa --album-id)")
+        parser.add_argument("--workers", type=int, default=8, help="Hilos para subir imágenes")
+        parser.add_argument(
+            "--replace-images",
+            action="store_true",
+            help="Volver a subir imágenes aunque el sticker ya tenga una",
+        )
+        parser.add_argument("--no-notify", action="store_true", help="No enviar la notificación global")
+
+    def handle(self, *args, **options):
+        manifest = Path(options["manifest"])
+        if not manifest.exists():
+            raise CommandError(f"No existe el manifiesto {manifest}")
+        images_dir = Path(options.get("images") or manifest.parent)
+
+        album_data, rows = self._read_manifest(manifest)
+        if options.get("title"):
+            album_data["title"] = options["title"]
+        if not rows:
+            raise CommandError("El manifiesto no contiene stickers")
+        self._validate_rows(rows)
+
+        album = self._upsert_album(album_data, options.get("album_id"), images_dir)
+        existing = dict(
+            Sticker.objects.filter(album=album).values_list("name", "image_reference")
+        )
+
+        stickers = []
+        uploads = {}
+        for index, row in enumerate(rows):
+            name = row["name"].strip()
+            order = _int(row.get("order"), "order", index + 1)
+            lat = _decimal(row.get("location_lat"))
+            lng = _decimal(row.get("location_lng"))
+            sticker = Sticker(
+                album=album,
+                name=name,
+                description=row.get("description") or "",
+                location_lat=lat,
+                location_lng=lng,
+                geohash=location_geohash(lat, lng),
+                image_reference=existing.get(name) or None,
+                reward_points=_int(row.get("reward_points"), "reward_points", index + 1) or 0,
+                order=order if order is not None else index,
+                rarity=row.get("rarity") or "",
+            )
+            image = row.get("image")
+            if image and (options["replace_images"] or not existing.get(name)):
+                path = images_dir / image
+                if not path.exists():
+                    raise CommandError(f"Fila {index + 1}: no existe la imagen {path}")
+                uploads[name] = path
+            stickers.append(sticker)
+
+        self.stdout.write(f"Subiendo {len(uploads)} imágenes con {options['workers']} hilos...")
+        by_name = {s.name: s for s in stickers}
+        stored = []
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options["workers"])) as pool:
+                futures = {
+                    pool.submit(self._store_image, by_name[name], path): name
+                    for name, path in uploads.items()
+                }
+            failed = None
+            for future, name in futures.items():
+                try:
+                    stored_name = future.result()
+                except Exception as exc:
+                    failed = failed or exc
+                else:
+                    by_name[name].image_reference = stored_name
+                    stored.append(stored_name)
+            if failed:
+                raise failed
+
+            with transaction.atomic():
+                Sticker.objects.bulk_create(
+                    stickers,
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=["album", "name"],
+                    update_fields=STICKER_UPDATE_FIELDS,
+                )
+        except BaseException:
+            # Nothing references the files written above: remove them.
+            self._delete_images(stored)
+            raise
+
+        bump_catalog_version(album.id)
+
+        # bulk_create skips post_save, so thumbnails and embeddings are queued here.
+        uploaded = list(Sticker.objects.filter(album=album, name__in=list(uploads)).values_list("pk", flat=True))
+        for pk in uploaded:
+            enqueue_variants(Sticker, pk, "image_reference")
+        if uploaded:
+            enqueue_index_refresh(uploaded)
+
+        created = len([s for s in stickers if s.name not in existing])
+        updated = len(stickers) - created
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Álbum '{album.title}' (id={album.id}): {created} stickers nuevos, {updated} actualizados"
+            )
+        )
+
+        if created and not options["no_notify"]:
+            send_notification(
+                [],
+                {
+                    "title": "Nuevos stickers",
+                    "message": f"Se agregaron {created} stickers a {album.title}",
+                    "category": "sticker_new",
+                },
+                broadcast=True,
+            )
+
+    @staticmethod
+    def _validate_rows(rows) -> None:
+        """
+        Reject the manifest before anything is uploaded or written. A name
+        repeated in one manifest would hit the same row twice in the upsert,
+        which PostgreSQL refuses.
+        """
+        seen = {}
+        for index, row in enumerate(rows, start=1):
+            name = str(row.get("name") or "").strip()
+            if not name:
+                raise CommandError(f"Fila {index}: falta 'name'")
+            if name in seen:
+                raise CommandError(f"Fila {index}: el sticker '{name}' ya aparece en la fila {seen[name]}")
+            seen[name] = index
+            row["name"] = name
+            _int(row.get("reward_points"), "reward_points", index)
+            _int(row.get("order"), "order", index)
+
+    def _read_manifest(self, manifest: Path):
+        if manifest.suffix.lower() == ".json":
+            with manifest.open(encoding="utf-8") as handle:
+                payload = json.load(handle)
+            if isinstance(payload, list):
+                return {}, payload
+            return dict(payload.get("album") or {}), list(payload.get("stickers") or [])
+        if manifest.suffix.lower() == ".csv":
+            with manifest.open(encoding="utf-8", newline="") as handle:
+                return {}, list(csv.DictReader(handle))
+        raise CommandError("El manifiesto debe ser .json o .csv")
+
+    def _upsert_album(self, album_data: dict, album_id, images_dir: Path) -> Album:
+        values = {key: album_data[key] for key in ALBUM_FIELDS if key in album_data}
+        if "is_premium" in values:
+            values["is_premium"] = _bool(values["is_premium"])
+        if "price" in values:
+            values["price"] = _decimal(values["price"])
+
+        if album_id:
+            album = Album.objects.filter(pk=album_id).first()
+            if album is None:
+                raise CommandError(f"No existe el álbum {album_id}")
+            for key, value in values.items():
+                setattr(album, key, value)
+        else:
+            title = values.pop("title", None)
+            if not title:
+                raise CommandError("Indica el título del álbum (--title o 'album.title' en el JSON)")
+            album, _ = Album.objects.get_or_create(title=title, defaults=values)
+            for key, value in values.items():
+                setattr(album, key, value)
+
+        cover = album_data.get("cover_image")
+        if cover:
+            path = images_dir / cover
+            if not path.exists():
+                raise CommandError(f"No existe la portada {path}")
+            with path.open("rb") as handle:
+                album.cover_image.save(path.name, File(handle), save=False)
+        album.save()
+        return album
+
+    def _delete_images(self, names) -> None:
+        storage = Sticker._meta.get_field("image_reference").storage
+        for name in names:
+            try:
+                storage.delete(name)
+            except Exception:  # pragma: no cover - best effort cleanup
+                self.stderr.write(f"No se pudo borrar la imagen {name}")
+
+    @staticmethod
+    def _store_image(sticker: Sticker, path: Path) -> str:
+        field = sticker.image_reference.field
+        name = field.generate_filename(sticker, path.name)
+        with path.open("rb") as handle:
+            return field.storage.save(name, File(handle), max_length=field.max_length)
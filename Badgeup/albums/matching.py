@@ -0,0 +1,235 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from achievements import car_lookup
+from achievements.models import UserSticker
+from achievements.services import aanalyze_car_photo, aidentify_car, analyze_car_photo, identify_car
+from achievements.utils import get_friend_ids, send_notification
+from .serializers import StickerSerializer
+
+MIN_MATCH_CONFIDENCE = 0.6
+
+UNLOCK_UPDATE_FIELDS = [
+    "unlocked_photo",
+    "unlocked_at",
+    "validation_score",
+    "validation_notes",
+    "detected_make",
+    "detected_model",
+    "detected_generation",
+    "detected_year_range",
+    "matched_by_lookup",
+    "fun_fact",
+    "location_lat",
+    "location_lng",
+    "status",
+    "validated",
+    "updated_at",
+]
+
+
+def _lookup_result(identified, album_id):
+    """
+    Complete an identify-only answer with the sticker from the car lookup.
+    ``None`` means the lookup cannot decide and the full prompt is needed.
+    """
+    if not identified or identified.get("error"):
+        return None
+    if not identified.get("recognized"):
+        return identified
+    if float(identified.get("confidence") or 0) < MIN_MATCH_CONFIDENCE:
+        return None
+    sticker_id = car_lookup.lookup_sticker(
+        album_id, identified.get("make"), identified.get("model"), identified.get("generation")
+    )
+    if sticker_id is None:
+        return None
+    return {**identified, "sticker_id": sticker_id, "matched_by_lookup": True}
+
+
+def analyze_album_photo(photo, album, stickers):
+    """
+    ``analyze_car_photo`` for an album. When the car lookup knows enough of
+    the album, the model is first asked to identify the car only and the
+    sticker comes from the lookup; misses fall back to the full prompt.
+    """
+    if car_lookup.covers(album.pk, len(stickers)):
+        result = _lookup_result(identify_car(photo), album.pk)
+        if result is not None:
+            return result
+    return analyze_car_photo(photo, stickers)
+
+
+async def aanalyze_album_photo(photo, album, stickers):
+    if await sync_to_async(car_lookup.covers)(album.pk, len(stickers)):
+        identified = await aidentify_car(photo)
+        result = await sync_to_async(_lookup_result)(identified, album.pk)
+        if result is not None:
+            return result
+    return await aanalyze_car_photo(photo, stickers)
+
+
+def _resolve_match(result, stickers):
+    """
+    Interpret the model answer against the album ``stickers``. Returns
+    ``(sticker, info, None)`` when ``sticker`` should be unlocked, otherwise
+    ``(None, info, payload)`` with the response to serve.
+    """
+    if not result:
+        return None, {}, {
+            "unlocked": False,
+            "message": "No pudimos analizar la foto. Intenta de nuevo.",
+        }
+
+    info = {
+        "confidence": float(result.get("confidence") or 0),
+        "fun_fact": result.get("fun_fact") or "",
+        "reason": result.get("reason") or "",
+        "matched_by_lookup": bool(result.get("matched_by_lookup")),
+        "car": {
+            "make": result.get("make"),
+            "model": result.get("model"),
+            "generation": result.get("generation"),
+            "year_range": result.get("year_range"),
+        },
+    }
+    car_info = info["car"]
+    sticker_id = result.get("sticker_id")
+
+    def rejected(message):
+        return None, info, {
+            "unlocked": False,
+            "message": message,
+            "car": car_info,
+            "reason": info["reason"],
+            "fun_fact": info["fun_fact"],
+        }
+
+    if not result.get("recognized"):
+        return rejected(info["fun_fact"] or "Uy, esta foto no parece un coche reconocible.")
+
+    if not sticker_id:
+        return rejected(
+            "Detectamos un coche "
+            f"{car_info.get('make') or ''} {car_info.get('model') or ''}".strip()
+            + ", pero aún no existe un sticker para este modelo en este álbum."
+        )
+
+    sticker = next((s for s in stickers if str(s.id) == str(sticker_id)), None)
+    if sticker is None:
+        return rejected("El sticker sugerido por la IA no pertenece a este álbum.")
+
+    if info["confidence"] < MIN_MATCH_CONFIDENCE:
+        return rejected("La IA no está lo suficientemente segura para desbloquear este sticker.")
+
+    return sticker, info, None
+
+
+def _unlocked_payload(sticker_data, info, already_unlocked: bool) -> dict:
+    return {
+        "unlocked": True,
+        "already_unlocked": already_unlocked,
+        "sticker": sticker_data,
+        "match_score": info["confidence"],
+        "car": info["car"],
+        "reason": "Ya habías desbloqueado este sticker." if already_unlocked else info["reason"],
+        "fun_fact": info["fun_fact"],
+    }
+
+
+def _is_unlocked(user_sticker) -> bool:
+    return user_sticker.validated and user_sticker.status == UserSticker.STATUS_APPROVED
+
+
+def _apply_unlock(user_sticker, photo, info, lat, lng) -> None:
+    car_info = info["car"]
+    try:
+        photo.seek(0)
+    except Exception:
+        pass
+
+    user_sticker.unlocked_photo = photo
+    user_sticker.unlocked_at = user_sticker.unlocked_at or timezone.now()
+    user_sticker.validation_score = info["confidence"]
+    user_sticker.validation_notes = info["reason"]
+    user_sticker.detected_make = car_info.get("make") or ""
+    user_sticker.detected_model = car_info.get("model") or ""
+    user_sticker.detected_generation = car_info.get("generation") or ""
+    user_sticker.detected_year_range = car_info.get("year_range") or ""
+    user_sticker.matched_by_lookup = info["matched_by_lookup"]
+    user_sticker.fun_fact = info["fun_fact"] or user_sticker.fun_fact
+    if lat not in (None, ""):
+        try:
+            user_sticker.location_lat = float(lat)
+        except (TypeError, ValueError):
+            pass
+    if lng not in (None, ""):
+        try:
+            user_sticker.location_lng = float(lng)
+        except (TypeError, ValueError):
+            pass
+
+    user_sticker.status = UserSticker.STATUS_APPROVED
+    user_sticker.validated = True
+
+
+def _friend_unlock_payload(user, sticker) -> dict:
+    return {
+        "title": "Captura de amigo",
+        "message": f"{user.username} desbloqueó {sticker.name}",
+        "category": "sticker_unlock",
+    }
+
+
+def _save_unlock(user_sticker, user, sticker) -> None:
+    """Save the unlock and queue the friends' notification in one transaction."""
+    with transaction.atomic():
+        user_sticker.save(update_fields=UNLOCK_UPDATE_FIELDS)
+        send_notification(get_friend_ids(user.id), _friend_unlock_payload(user, sticker))
+
+
+def match_album_photo(user, album, photo, lat=None, lng=None, request=None) -> dict:
+    """
+    Identify the car in ``photo`` among ``album``'s stickers and unlock the
+    match for ``user``. Returns the payload served by the match-photo endpoint.
+    """
+    stickers = list(album.stickers.all())
+    sticker, info, payload = _resolve_match(analyze_album_photo(photo, album, stickers), stickers)
+    if sticker is None:
+        return payload
+
+    user_sticker, _ = UserSticker.objects.get_or_create(user=user, sticker=sticker)
+    context = {"request": request, "user": user}
+
+    if _is_unlocked(user_sticker):
+        return _unlocked_payload(StickerSerializer(sticker, context=context).data, info, True)
+
+    _apply_unlock(user_sticker, photo, info, lat, lng)
+    _save_unlock(user_sticker, user, sticker)
+
+    return _unlocked_payload(StickerSerializer(sticker, context=context).data, info, False)
+
+
+async def amatch_album_photo(user, album, photo, lat=None, lng=None, request=None) -> dict:
+    """
+    ``match_album_photo`` for async views: the model call is awaited on the
+    event loop and the ORM work goes through Django's async queryset API.
+    """
+    stickers = [sticker async for sticker in album.stickers.all()]
+    result = await aanalyze_album_photo(photo, album, stickers)
+    sticker, info, payload = _resolve_match(result, stickers)
+    if sticker is None:
+        return payload
+
+    user_sticker, _ = await UserSticker.objects.aget_or_create(user=user, sticker=sticker)
+    context = {"request": request, "user": user}
+    serialize = sync_to_async(lambda: StickerSerializer(sticker, context=context).data)
+
+    if _is_unlocked(user_sticker):
+        return _unlocked_payload(await serialize(), info, True)
+
+    _apply_unlock(user_sticker, photo, info, lat, lng)
+    await sync_to_async(_save_unlock)(user_sticker, user, sticker)
+
+    return _unlocked_payload(await serialize(), info, False)
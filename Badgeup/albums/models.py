@@ -4,6 +4,8 @@ from uuid import uuid4
 from django.db import models
 from django.utils.text import slugify
 
+from .geohash import location_geohash, with_geohash_field
+
 
 def _generate_filename(prefix: str, base: str, filename: str) -> str:
     """Return a deterministic, short, slugified filename."""
@@ -33,6 +35,7 @@ class Album(models.Model):
         blank=True,
         null=True,
     )
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_premium = models.BooleanField(default=False)
     price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -55,12 +58,14 @@ class Sticker(models.Model):
     description = models.TextField(blank=True)
     location_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     image_reference = models.ImageField(
         upload_to=sticker_image_upload,
         max_length=255,
         blank=True,
         null=True,
     )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     reward_points = models.PositiveIntegerField(default=0)
     order = models.PositiveIntegerField(default=0)
     rarity = models.CharField(max_length=20, blank=True)
@@ -73,3 +78,8 @@ class Sticker(models.Model):
 
     def __str__(self) -> str:
         return f"{self.album.title} - {self.name}"
+
+    def save(self, *args, **kwargs):
+        self.geohash = location_geohash(self.location_lat, self.location_lng)
+        kwargs["update_fields"] = with_geohash_field(kwargs.get("update_fields"))
+        super().save(*args, **kwargs)
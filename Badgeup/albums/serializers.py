@@ -1,15 +1,26 @@
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
 
 from achievements.models import UserSticker
+from badgeup.images import variant_urls
 
 from .models import Album, Sticker
 
 
+class StickerListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        stickers = list(data.all() if isinstance(data, BaseManager) else data)
+        self.child.load_user_stickers(stickers)
+        return super().to_representation(stickers)
+
+
 class StickerSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(source="image_reference", required=False, allow_null=True)
+    image_variants = serializers.SerializerMethodField()
     is_unlocked = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField()
     unlocked_photo_url = serializers.SerializerMethodField()
+    unlocked_photo_variants = serializers.SerializerMethodField()
     user_message = serializers.SerializerMethodField()
     fun_fact = serializers.SerializerMethodField()
     unlocked_at = serializers.SerializerMethodField()
@@ -30,12 +41,14 @@ class StickerSerializer(serializers.ModelSerializer):
             "location_lng",
             "image_reference",
             "image",
+            "image_variants",
             "reward_points",
             "order",
             "rarity",
             "is_unlocked",
             "status",
             "unlocked_photo_url",
+            "unlocked_photo_variants",
             "user_message",
             "fun_fact",
             "unlocked_at",
@@ -46,29 +59,48 @@ class StickerSerializer(serializers.ModelSerializer):
             "album_id",
         )
         read_only_fields = ("album",)
+        list_serializer_class = StickerListSerializer
 
-    def get_is_unlocked(self, obj):
-        request = self.context.get("request")
-        if not request or not request.user.is_authenticated:
-            return False
-        return obj.user_stickers.filter(
-            user=request.user,
-            status=UserSticker.STATUS_APPROVED,
-        ).exists()
-
-    def get_status(self, obj):
+    def _get_user(self):
+        if self.context.get("catalog_only"):
+            return None
         request = self.context.get("request")
-        if not request or not request.user.is_authenticated:
+        user = getattr(request, "user", None) or self.context.get("user")
+        if not user or not user.is_authenticated:
             return None
-        capture = obj.user_stickers.filter(user=request.user).first()
-        return capture.status if capture else None
+        return user
+
+    def load_user_stickers(self, stickers):
+        """
+        Fetch the requesting user's captures for ``stickers`` in a single query
+        and keep them in the serializer context as ``{sticker_id: UserSticker}``.
+        """
+        captures = self.context.setdefault("user_stickers", {})
+        user = self._get_user()
+        missing = [s.id for s in stickers if s.id not in captures]
+        if user is None or not missing:
+            return
+        found = {
+            us.sticker_id: us
+            for us in UserSticker.objects.filter(user=user, sticker_id__in=missing)
+        }
+        for sticker_id in missing:
+            captures[sticker_id] = found.get(sticker_id)
 
     def _get_user_sticker(self, obj):
-        request = self.context.get("request")
-        user = getattr(request, "user", None)
-        if not user or not user.is_authenticated:
+        if self._get_user() is None:
             return None
-        return obj.user_stickers.filter(user=user).first()
+        if obj.id not in self.context.get("user_stickers", {}):
+            self.load_user_stickers([obj])
+        return self.context["user_stickers"].get(obj.id)
+
+    def get_is_unlocked(self, obj):
+        us = self._get_user_sticker(obj)
+        return bool(us and us.status == UserSticker.STATUS_APPROVED)
+
+    def get_status(self, obj):
+        us = self._get_user_sticker(obj)
+        return us.status if us else None
 
     def get_unlocked_photo_url(self, obj):
         us = self._get_user_sticker(obj)
@@ -78,6 +110,15 @@ class StickerSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(url) if request else url
         return None
 
+    def get_unlocked_photo_variants(self, obj):
+        us = self._get_user_sticker(obj)
+        if us and us.unlocked_photo:
+            return variant_urls(us.unlocked_photo_variants, self.context.get("request"))
+        return {}
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants, self.context.get("request"))
+
     def get_user_message(self, obj):
         us = self._get_user_sticker(obj)
         return us.user_message if us and us.user_message else None
@@ -128,7 +169,11 @@ class StickerLocationSerializer(serializers.ModelSerializer):
 
 
 class AlbumSerializer(serializers.ModelSerializer):
-    stickers_count = serializers.IntegerField(source="stickers.count", read_only=True)
+    stickers_count = serializers.IntegerField(read_only=True)
+    captured_count = serializers.IntegerField(read_only=True)
+    completion_pct = serializers.SerializerMethodField()
+    points_earned = serializers.IntegerField(read_only=True)
+    cover_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Album
@@ -138,11 +183,24 @@ class AlbumSerializer(serializers.ModelSerializer):
             "description",
             "theme",
             "cover_image",
+            "cover_variants",
             "is_premium",
             "price",
             "stickers_count",
+            "captured_count",
+            "completion_pct",
+            "points_earned",
         )
 
+    def get_cover_variants(self, obj):
+        return variant_urls(obj.cover_variants, self.context.get("request"))
+
+    def get_completion_pct(self, obj):
+        total = getattr(obj, "stickers_count", 0) or 0
+        if not total:
+            return 0.0
+        return round(100 * (getattr(obj, "captured_count", 0) or 0) / total, 1)
+
 
 class AlbumDetailSerializer(AlbumSerializer):
     stickers = StickerSerializer(many=True, read_only=True)
@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .embeddings import enqueue_index_refresh
+from .models import Album, Sticker
+
+
+def _bump_on_commit(*album_ids) -> None:
+    # After commit, so a concurrent read cannot cache the old rows under the new version.
+    ids = {album_id for album_id in album_ids if album_id is not None}
+
+    def bump():
+        for album_id in ids:
+            bump_catalog_version(album_id)
+
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Album)
+def album_changed(sender, instance, **kwargs):
+    _bump_on_commit(instance.pk)
+
+
+@receiver(pre_save, sender=Sticker)
+def sticker_moving(sender, instance, raw=False, **kwargs):
+    instance._previous_album_id = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_album_id = (
+        Sticker.objects.filter(pk=instance.pk).values_list("album_id", flat=True).first()
+    )
+
+
+@receiver([post_save, post_delete], sender=Sticker)
+def sticker_changed(sender, instance, **kwargs):
+    _bump_on_commit(instance.album_id, getattr(instance, "_previous_album_id", None))
+
+
+@receiver(post_save, sender=Sticker)
+def sticker_image_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and "image_reference" not in update_fields):
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: enqueue_index_refresh([pk]))
+
+
+@receiver(post_delete, sender=Sticker)
+def sticker_image_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: enqueue_index_refresh([pk]))
@@ -0,0 +1,56 @@
+import logging
+
+from celery import shared_task
+from django.apps import apps
+
+from badgeup.images import VARIANT_FIELDS, delete_variants, needs_variants, render_variants
+from . import embeddings
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def generate_image_variants(self, model_label: str, pk: int, field_name: str):
+    model = apps.get_model(model_label)
+    variants_field = VARIANT_FIELDS[(model_label, field_name)]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        logger.warning("%s %s no longer exists.", model_label, pk)
+        return
+
+    fieldfile = getattr(instance, field_name)
+    previous = getattr(instance, variants_field) or {}
+    if not needs_variants(fieldfile, previous):
+        return
+
+    try:
+        variants = render_variants(fieldfile)
+    except FileNotFoundError:
+        logger.warning("Image %s for %s %s not found.", fieldfile.name, model_label, pk)
+        return
+    except (OSError, ValueError):
+        logger.exception("Could not render variants for %s %s (%s)", model_label, pk, fieldfile.name)
+        return
+
+    stale = {k: v for k, v in previous.items() if v not in variants.values()}
+    delete_variants(fieldfile.storage, stale)
+
+    setattr(instance, variants_field, variants)
+    update_fields = [variants_field]
+    if any(f.name == "updated_at" for f in model._meta.concrete_fields):
+        update_fields.append("updated_at")
+    instance.save(update_fields=update_fields)
+    logger.info("Rendered %s variants for %s %s", len(variants) - 1, model_label, pk)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def refresh_sticker_index(self, sticker_ids=None, batched=False):
+    if not embeddings.available():
+        logger.warning("NumPy/Pillow missing; sticker index disabled.")
+        return
+    if batched:
+        sticker_ids = embeddings.pop_pending_ids()
+        if not sticker_ids:
+            return
+    computed = embeddings.refresh_index(sticker_ids)
+    logger.info("Sticker index refreshed (%s vectors computed)", computed)
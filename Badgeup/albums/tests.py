@@ -1,3 +1,719 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from achievements import car_lookup
+from achievements.models import CarStickerLookup, FriendRequest, MatchPhotoJob, Outbox, UserSticker
+from achievements.tasks import drain_outbox, refresh_car_lookup, run_match_photo_job
+from badgeup.openai_client import get_openai_client
+from users.models import User
+
+from . import cache, embeddings, geohash
+from .tasks import generate_image_variants, refresh_sticker_index
+from .models import Album, Sticker
+
+
+class AlbumDetailQueryCountTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+
+    def _make_album(self, title: str, size: int) -> Album:
+        album = Album.objects.create(title=title)
+        stickers = Sticker.objects.bulk_create(
+            Sticker(album=album, name=f"Sticker {i}", order=i, reward_points=10)
+            for i in range(size)
+        )
+        for sticker in stickers[::2]:
+            UserSticker.objects.create(
+                user=self.user,
+                sticker=sticker,
+                status=UserSticker.STATUS_APPROVED,
+                validated=True,
+            )
+        return album
+
+    def _count_queries(self, album: Album) -> int:
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("album-detail", args=[album.pk]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_stickers(self):
+        small = self._make_album("Small", 3)
+        large = self._make_album("Large", 60)
+
+        self.assertEqual(self._count_queries(small), self._count_queries(large))
+
+    def test_capture_state_is_serialized_per_sticker(self):
+        album = self._make_album("Garage", 4)
+
+        response = self.client.get(reverse("album-detail", args=[album.pk]))
+
+        unlocked = [s["is_unlocked"] for s in response.data["stickers"]]
+        statuses = [s["status"] for s in response.data["stickers"]]
+        self.assertEqual(unlocked, [True, False, True, False])
+        self.assertEqual(statuses, ["approved", None, "approved", None])
+
+
+class AlbumCatalogCacheTests(APITestCase):
+    def setUp(self):
+        patcher = mock.patch("albums.cache.get_redis", return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+        self.album = Album.objects.create(title="Deportivos")
+        self.stickers = Sticker.objects.bulk_create(
+            Sticker(album=self.album, name=f"Sticker {i}", order=i, reward_points=10) for i in range(2)
+        )
+        self.url = reverse("album-detail", args=[self.album.pk])
+
+    def test_catalog_is_built_once_and_overlaid_per_user(self):
+        UserSticker.objects.create(
+            user=self.user, sticker=self.stickers[0], status=UserSticker.STATUS_APPROVED, validated=True
+        )
+        rival = User.objects.create_user(username="rival", email="rival@example.com", password="secret")
+
+        with mock.patch("albums.cache.build_album_catalog", wraps=cache.build_album_catalog) as build:
+            mine = self.client.get(self.url).data
+            self.client.force_authenticate(rival)
+            theirs = self.client.get(self.url).data
+
+        build.assert_called_once()
+        self.assertEqual([s["is_unlocked"] for s in mine["stickers"]], [True, False])
+        self.assertEqual((mine["captured_count"], mine["points_earned"]), (1, 10))
+        self.assertEqual([s["is_unlocked"] for s in theirs["stickers"]], [False, False])
+        self.assertEqual((theirs["captured_count"], theirs["points_earned"]), (0, 0))
+
+    def test_committed_change_invalidates_the_catalog(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            sticker = self.stickers[0]
+            sticker.name = "Supra"
+            sticker.save()
+            # Not bumped until the transaction commits.
+            self.assertEqual(self.client.get(self.url).data["stickers"][0]["name"], "Sticker 0")
+
+        self.assertEqual(self.client.get(self.url).data["stickers"][0]["name"], "Supra")
+
+
+class AlbumListProgressTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.other = User.objects.create_user(
+            username="rival", email="rival@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_list_annotates_counts_and_user_progress(self):
+        album = Album.objects.create(title="Clasicos")
+        stickers = Sticker.objects.bulk_create(
+            Sticker(album=album, name=f"Sticker {i}", reward_points=5 * (i + 1))
+            for i in range(4)
+        )
+        UserSticker.objects.create(user=self.user, sticker=stickers[0], status=UserSticker.STATUS_APPROVED)
+        UserSticker.objects.create(user=self.user, sticker=stickers[1], status=UserSticker.STATUS_PENDING)
+        UserSticker.objects.create(user=self.other, sticker=stickers[2], status=UserSticker.STATUS_APPROVED)
+        Album.objects.create(title="Vacio")
+
+        response = self.client.get(reverse("album-list-create"))
+
+        rows = response.data["results"] if isinstance(response.data, dict) else response.data
+        by_title = {row["title"]: row for row in rows}
+        self.assertEqual(by_title["Clasicos"]["stickers_count"], 4)
+        self.assertEqual(by_title["Clasicos"]["captured_count"], 1)
+        self.assertEqual(by_title["Clasicos"]["points_earned"], 5)
+        self.assertEqual(by_title["Clasicos"]["completion_pct"], 25.0)
+        self.assertEqual(by_title["Vacio"]["stickers_count"], 0)
+        self.assertEqual(by_title["Vacio"]["completion_pct"], 0.0)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+        self.album = Album.objects.create(title="Deportivos")
+        self.sticker = Sticker.objects.create(album=self.album, name="Supra")
+
+    def test_album_detail_returns_304_until_something_changes(self):
+        url = reverse("album-detail", args=[self.album.pk])
+        first = self.client.get(url)
+        etag = first["ETag"]
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        UserSticker.objects.create(user=self.user, sticker=self.sticker, status=UserSticker.STATUS_APPROVED)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+    def test_etag_is_per_user(self):
+        url = reverse("sticker-list-create")
+        etag = self.client.get(url)["ETag"]
+        other = User.objects.create_user(username="rival", email="rival@example.com", password="secret")
+        self.client.force_authenticate(other)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class StickerLocationParamsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_malformed_album_is_a_400(self):
+        for name in ("sticker-locations", "sticker-location-clusters"):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name), {"album": "abc"})
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("album", response.data)
+
+    def test_impossible_since_is_a_400(self):
+        for since in ("2024-02-30", "2024-01-01T25:00:00", "ayer"):
+            with self.subTest(since=since):
+                response = self.client.get(reverse("sticker-locations"), {"since": since})
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("since", response.data)
+
+
+class StickerLocationClusterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+        self.coupes = Album.objects.create(title="Coupés")
+        self.trucks = Album.objects.create(title="Camiones")
+
+    def _capture(self, album, lat, lng):
+        sticker = Sticker.objects.create(album=album, name=f"{album.title} {lat} {lng}")
+        UserSticker.objects.create(user=self.user, sticker=sticker, location_lat=lat, location_lng=lng)
+
+    def test_groups_captures_per_cell_with_their_top_album(self):
+        for lng in ("-3.700", "-3.702", "-3.704"):
+            self._capture(self.coupes, "40.400", lng)
+        self._capture(self.trucks, "40.402", "-3.700")
+        self._capture(self.trucks, "-33.870", "151.200")
+
+        response = self.client.get(reverse("sticker-location-clusters"), {"zoom": 3})
+
+        self.assertEqual(response.status_code, 200)
+        madrid, sydney = response.data["clusters"]
+        self.assertEqual(madrid["count"], 4)
+        self.assertAlmostEqual(madrid["lat"], 40.4005)
+        self.assertAlmostEqual(madrid["lng"], -3.7015)
+        self.assertEqual(madrid["top_album"], {"id": self.coupes.id, "title": "Coupés", "count": 3})
+        self.assertEqual(sydney["count"], 1)
+        self.assertEqual(sydney["top_album"]["id"], self.trucks.id)
+
+
+class GeohashTests(SimpleTestCase):
+    def test_encode_matches_the_reference_hash(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(geohash.encode(57.64911, 10.40744), "u4pruydqq")
+
+    def test_neighbours_surround_the_cell(self):
+        cells = geohash.neighbours("u4pruyd")
+
+        self.assertEqual(len(cells), 9)
+        self.assertEqual(cells[4], "u4pruyd")
+        self.assertIn("u4pruy9", cells)
+        self.assertIn("u4pruyf", cells)
+        self.assertTrue(all(len(cell) == 7 for cell in cells))
+
+    def test_neighbours_wrap_the_antimeridian(self):
+        cells = geohash.neighbours(geohash.encode(0.0, 179.99, 5))
+
+        self.assertIn(geohash.encode(0.0, -179.99, 5), cells)
+
+    def test_haversine_km(self):
+        self.assertEqual(geohash.haversine_km(40.4, -3.7, 40.4, -3.7), 0)
+        self.assertAlmostEqual(geohash.haversine_km(48.8566, 2.3522, 51.5074, -0.1278), 343.5, delta=1)
+
+
+class NearbyStickersTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+        self.album = Album.objects.create(title="Ruta")
+
+    def _sticker(self, name, lat, lng):
+        return Sticker.objects.create(album=self.album, name=name, location_lat=lat, location_lng=lng)
+
+    def test_returns_only_what_is_inside_the_radius_closest_first(self):
+        self._sticker("Lejos", "40.500", "-3.700")
+        self._sticker("Cerca", "40.401", "-3.700")
+        self._sticker("Centro", "40.400", "-3.700")
+        UserSticker.objects.create(
+            user=self.user, sticker=self._sticker("Sin ubicar", None, None), location_lat="40.402", location_lng="-3.701"
+        )
+
+        response = self.client.get(reverse("sticker-nearby"), {"lat": 40.4, "lng": -3.7, "radius_km": 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["name"] for row in response.data["stickers"]], ["Centro", "Cerca"])
+        self.assertEqual(response.data["stickers"][1]["distance_km"], 0.111)
+        self.assertEqual(len(response.data["captures"]), 1)
+
+    def test_finds_stickers_across_the_antimeridian(self):
+        self._sticker("Fiyi", "-16.500", "179.995")
+
+        response = self.client.get(reverse("sticker-nearby"), {"lat": -16.5, "lng": -179.995, "radius_km": 5})
+
+        self.assertEqual([row["name"] for row in response.data["stickers"]], ["Fiyi"])
+
+    def test_rejects_missing_or_out_of_range_coordinates(self):
+        for params in ({"lat": 40.4}, {"lat": 91, "lng": 0}, {"lat": 0, "lng": 0, "radius_km": 0}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse("sticker-nearby"), params)
+
+                self.assertEqual(response.status_code, 400)
+
+
+class ImportAlbumCommandTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.manifest_dir = tempfile.mkdtemp()
+        for path in (self.media_root, self.manifest_dir):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        Image.new("RGB", (32, 32), "red").save(Path(self.manifest_dir) / "coupe.png")
+
+    def _write(self, name: str, content: str) -> str:
+        path = Path(self.manifest_dir) / name
+        path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    def _stored_images(self) -> list:
+        return [path for path in Path(self.media_root).rglob("*") if path.is_file()]
+
+    def _import(self, manifest: str, *args):
+        with mock.patch("albums.management.commands.import_album.enqueue_variants") as variants, mock.patch(
+            "albums.management.commands.import_album.enqueue_index_refresh"
+        ) as index:
+            call_command("import_album", manifest, "--no-notify", *args, stdout=io.StringIO())
+        return variants, index
+
+    def test_json_manifest_creates_the_album_and_queues_its_images(self):
+        manifest = self._write(
+            "album.json",
+            json.dumps(
+                {
+                    "album": {"title": "Coupés"},
+                    "stickers": [
+                        {"name": "Coupé", "image": "coupe.png", "reward_points": 20},
+                        {"name": "Roadster", "order": "5"},
+                    ],
+                }
+            ),
+        )
+
+        variants, index = self._import(manifest)
+
+        album = Album.objects.get(title="Coupés")
+        coupe, roadster = album.stickers.order_by("name")
+        self.assertEqual((coupe.reward_points, coupe.order), (20, 0))
+        self.assertEqual((roadster.reward_points, roadster.order), (0, 5))
+        self.assertTrue(coupe.image_reference.name)
+        variants.assert_called_once_with(Sticker, coupe.pk, "image_reference")
+        index.assert_called_once_with([coupe.pk])
+
+    def test_csv_manifest_updates_existing_stickers(self):
+        manifest = self._write("album.csv", "name,reward_points\nCoupé,10\nRoadster,\n")
+        self._import(manifest, "--title", "Coupés")
+        self._write("album.csv", "name,reward_points\nCoupé,30\n")
+
+        self._import(manifest, "--title", "Coupés")
+
+        album = Album.objects.get(title="Coupés")
+        self.assertEqual(
+            dict(album.stickers.values_list("name", "reward_points")), {"Coupé": 30, "Roadster": 0}
+        )
+
+    def test_rejects_duplicate_names_and_bad_integers_before_writing(self):
+        cases = {
+            "duplicate.csv": ("name,image\nCoupé,coupe.png\n Coupé ,coupe.png\n", "ya aparece en la fila 1"),
+            "points.csv": ("name,reward_points\nCoupé,diez\n", "'reward_points' debe ser un entero"),
+            "duplicate.json": (json.dumps([{"name": "Coupé"}, {"name": "Coupé"}]), "ya aparece en la fila 1"),
+            "order.json": (json.dumps([{"name": "Coupé", "order": -1}]), "'order' no puede ser negativo"),
+        }
+        for name, (content, message) in cases.items():
+            with self.subTest(manifest=name):
+                with self.assertRaisesMessage(CommandError, message):
+                    self._import(self._write(name, content), "--title", "Coupés")
+
+        self.assertFalse(Album.objects.exists())
+        self.assertEqual(self._stored_images(), [])
+
+    def test_failed_upsert_deletes_the_uploaded_images(self):
+        manifest = self._write("album.csv", "name,image\nCoupé,coupe.png\n")
+
+        with mock.patch.object(Sticker.objects, "bulk_create", side_effect=DatabaseError("boom")):
+            with self.assertRaises(DatabaseError):
+                self._import(manifest, "--title", "Coupés")
+
+        self.assertEqual(self._stored_images(), [])
+        self.assertFalse(Sticker.objects.exists())
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.album = Album.objects.create(title="Deportivos")
+
+    def _sticker(self, size) -> Sticker:
+        buffer = io.BytesIO()
+        Image.new("RGB", size, "blue").save(buffer, "PNG")
+        return Sticker.objects.create(
+            album=self.album,
+            name="Coupé",
+            image_reference=SimpleUploadedFile("coupe.png", buffer.getvalue(), content_type="image/png"),
+        )
+
+    def test_renders_one_variant_per_width_without_upscaling(self):
+        sticker = self._sticker((600, 300))
+
+        result = generate_image_variants.apply(args=["albums.Sticker", sticker.pk, "image_reference"])
+
+        self.assertEqual(result.state, "SUCCESS")
+        sticker.refresh_from_db()
+        variants = sticker.image_variants
+        self.assertEqual(variants["source"], sticker.image_reference.name)
+        sizes = {}
+        for width in ("128", "384", "1024"):
+            with default_storage.open(variants[width]) as handle, Image.open(handle) as image:
+                sizes[width] = image.size
+        self.assertEqual(sizes, {"128": (128, 64), "384": (384, 192), "1024": (600, 300)})
+
+    def test_decompression_bomb_is_skipped_without_retrying(self):
+        sticker = self._sticker((64, 64))
+
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            result = generate_image_variants.apply(args=["albums.Sticker", sticker.pk, "image_reference"])
+
+        self.assertEqual(result.state, "SUCCESS")
+        sticker.refresh_from_db()
+        self.assertEqual(sticker.image_variants, {})
+
+
+class StickerIndexTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, STICKER_INDEX_BATCH_SECONDS=10)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("albums.embeddings.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        embeddings._loaded.update(version=None, at=0.0, index=None)
+        self.addCleanup(embeddings._loaded.update, version=None, at=0.0, index=None)
+        self.album = Album.objects.create(title="Colores")
+
+    @staticmethod
+    def _image(colour, name="photo.png") -> SimpleUploadedFile:
+        buffer = io.BytesIO()
+        Image.new("RGB", (96, 96), colour).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def _sticker(self, colour) -> Sticker:
+        image = self._image(colour, f"{colour}.png") if colour else None
+        return Sticker.objects.create(album=self.album, name=colour or "Sin imagen", image_reference=image)
+
+    def test_shortlist_ranks_by_similarity_and_keeps_unindexed_stickers(self):
+        stickers = [self._sticker(colour) for colour in ("red", "green", "blue", "yellow")]
+        stickers.append(self._sticker(None))
+
+        self.assertEqual(embeddings.refresh_index(), 4)
+
+        shortlist = embeddings.shortlist_stickers(self._image("red"), stickers, size=1)
+        self.assertEqual([s.name for s in shortlist], ["red", "Sin imagen"])
+        self.assertEqual(embeddings.shortlist_stickers(self._image("red"), stickers[:1], size=1), stickers[:1])
+
+    def test_refresh_drops_deleted_stickers_and_keeps_unchanged_vectors(self):
+        red, green = self._sticker("red"), self._sticker("green")
+        embeddings.refresh_index()
+        green_id = green.pk
+        green.delete()
+
+        self.assertEqual(embeddings.refresh_index([red.pk, green_id]), 0)
+        self.assertEqual(embeddings.load_index()["ids"].tolist(), [red.pk])
+
+    def test_index_is_replaced_without_deleting_it_first(self):
+        self._sticker("red")
+        embeddings.refresh_index()
+
+        with mock.patch.object(default_storage, "delete", wraps=default_storage.delete) as delete:
+            self._sticker("green")
+            embeddings.refresh_index()
+
+        delete.assert_not_called()
+        folder = Path(self.media_root) / Path(embeddings.INDEX_NAME).parent
+        self.assertEqual([path.name for path in folder.iterdir()], [Path(embeddings.INDEX_NAME).name])
+        self.assertEqual(len(embeddings.load_index()["ids"]), 2)
+
+    def test_refreshes_are_batched(self):
+        with mock.patch.object(refresh_sticker_index, "apply_async") as apply_async:
+            embeddings.enqueue_index_refresh([3])
+            embeddings.enqueue_index_refresh([1, 2])
+            apply_async.assert_called_once_with(args=[None, True], countdown=10)
+
+            self.assertEqual(embeddings.pop_pending_ids(), [1, 2, 3])
+            embeddings.enqueue_index_refresh([4])
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_decompression_bomb_is_a_value_error(self):
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            with self.assertRaises(ValueError):
+                embeddings.extract_features(self._image("red"))
+
+
+class MatchPhotoTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=self.media_root,
+            USE_OPENAI_STICKER_VALIDATION=True,
+            OPENAI_API_KEY="test",
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="secret"
+        )
+        self.client.force_authenticate(self.user)
+        self.album = Album.objects.create(title="Deportivos")
+        self.sticker = Sticker.objects.create(album=self.album, name="Supra", reward_points=10)
+
+    def _photo(self):
+        buf = io.BytesIO()
+        Image.new("RGB", (8, 8), "red").save(buf, format="JPEG")
+        return SimpleUploadedFile("car.jpg", buf.getvalue(), content_type="image/jpeg")
+
+    def test_job_mode_returns_202_and_pushes_result(self):
+        match = {"recognized": True, "confidence": 0.9, "sticker_id": self.sticker.id, "make": "Toyota"}
+        url = reverse("album-match-photo", args=[self.album.pk]) + "?mode=job"
+        with mock.patch("albums.matching.analyze_car_photo", return_value=match), mock.patch(
+            "achievements.tasks.send_notification"
+        ) as notify, mock.patch.object(run_match_photo_job, "delay") as delay:
+            response = self.client.post(url, {"photo": self._photo(), "lat": "19.4"}, format="multipart")
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data["status"], MatchPhotoJob.STATUS_PENDING)
+            delay.assert_called_once_with(str(response.data["id"]))
+
+            run_match_photo_job.apply(args=[str(response.data["id"])])
+
+        job = MatchPhotoJob.objects.get(pk=response.data["id"])
+        self.assertEqual(job.status, MatchPhotoJob.STATUS_DONE)
+        self.assertTrue(job.result["unlocked"])
+        self.assertTrue(job.result["sticker"]["is_unlocked"])
+        self.assertFalse(job.photo)
+        capture = UserSticker.objects.get(user=self.user, sticker=self.sticker)
+        self.assertEqual(capture.status, UserSticker.STATUS_APPROVED)
+        self.assertTrue(capture.unlocked_photo)
+
+        user_ids, payload = notify.call_args.args
+        self.assertEqual(user_ids, [self.user.id])
+        self.assertEqual(payload["category"], "match_photo")
+        self.assertEqual(payload["job"]["id"], str(job.id))
+
+        polled = self.client.get(reverse("match-photo-job-detail", args=[job.id]))
+        self.assertEqual(polled.status_code, 200)
+        self.assertEqual(polled.data["status"], MatchPhotoJob.STATUS_DONE)
+
+    def test_job_is_private_to_its_owner(self):
+        job = MatchPhotoJob.objects.create(user=self.user, album=self.album)
+        other = User.objects.create_user(username="rival", email="rival@example.com", password="secret")
+        self.client.force_authenticate(other)
+
+        response = self.client.get(reverse("match-photo-job-detail", args=[job.id]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def _match_as(self, username, **patches):
+        user = User.objects.create_user(username=username, email=f"{username}@example.com", password="secret")
+        self.client.force_authenticate(user)
+        with mock.patch.multiple("albums.matching", **patches), self.captureOnCommitCallbacks():
+            response = self.client.post(
+                reverse("album-match-photo", args=[self.album.pk]), {"photo": self._photo()}, format="multipart"
+            )
+        # The commit hook only queues the refresh; run it here whatever the eager setting.
+        refresh_car_lookup.apply(args=[self.sticker.id])
+        return response
+
+    def _teach_car_lookup(self, match, fans=3):
+        for index in range(fans):
+            identify, analyze = mock.Mock(), mock.Mock(return_value=match)
+            self._match_as(f"fan{index}", identify_car=identify, analyze_car_photo=analyze)
+            # Below the approval threshold the lookup does not cover the album yet.
+            identify.assert_not_called()
+            analyze.assert_called_once()
+
+    def test_approved_captures_teach_the_car_lookup(self):
+        match = {
+            "recognized": True,
+            "confidence": 0.9,
+            "sticker_id": self.sticker.id,
+            "make": "Toyota",
+            "model": "Supra",
+            "generation": "A80",
+        }
+        self._teach_car_lookup(match)
+
+        lookup = CarStickerLookup.objects.get(album=self.album)
+        self.assertEqual((lookup.make, lookup.model, lookup.generation), ("toyota", "supra", "a80"))
+        self.assertEqual((lookup.sticker_id, lookup.approvals), (self.sticker.id, 3))
+
+        identify = mock.Mock(return_value={**match, "make": "TOYOTA ", "sticker_id": None})
+        analyze = mock.Mock()
+        response = self._match_as("rival", identify_car=identify, analyze_car_photo=analyze)
+
+        identify.assert_called_once()
+        analyze.assert_not_called()
+        self.assertTrue(response.data["unlocked"])
+        self.assertEqual(response.data["sticker"]["id"], self.sticker.id)
+        self.assertTrue(UserSticker.objects.get(user__username="rival").matched_by_lookup)
+        # Unlocks the lookup resolved do not vote for themselves.
+        self.assertEqual(CarStickerLookup.objects.get(album=self.album).approvals, 3)
+
+    def test_car_lookup_thresholds_are_read_per_call(self):
+        match = {"recognized": True, "confidence": 0.9, "sticker_id": self.sticker.id, "make": "Mazda", "model": "MX-5"}
+        self._teach_car_lookup(match)
+
+        with override_settings(CAR_LOOKUP_MIN_APPROVALS=4):
+            identify, analyze = mock.Mock(), mock.Mock(return_value=match)
+            self._match_as("rival", identify_car=identify, analyze_car_photo=analyze)
+
+        identify.assert_not_called()
+        analyze.assert_called_once()
+
+    def test_car_lookup_covers_only_confident_stickers(self):
+        rival = Sticker.objects.create(album=self.album, name="Supra A90")
+        for sticker in (self.sticker, rival):
+            CarStickerLookup.objects.create(
+                album=self.album, sticker=sticker, make="toyota", model="supra", generation="", approvals=3
+            )
+
+        # Split votes: neither sticker has the required share.
+        self.assertFalse(car_lookup.covers(self.album.pk, 2))
+        CarStickerLookup.objects.filter(sticker=rival).update(generation="a90")
+        self.assertTrue(car_lookup.covers(self.album.pk, 2))
+        with override_settings(CAR_LOOKUP_MIN_COVERAGE=1):
+            self.assertTrue(car_lookup.covers(self.album.pk, 2))
+            self.assertFalse(car_lookup.covers(self.album.pk, 3))
+
+    def test_unlock_notifies_friends_through_the_outbox(self):
+        friend = User.objects.create_user(username="amigo", email="amigo@example.com", password="secret")
+        FriendRequest.objects.create(from_user=self.user, to_user=friend, status=FriendRequest.STATUS_ACCEPTED)
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"user_{friend.id}", channel)
+
+        match = {"recognized": True, "confidence": 0.9, "sticker_id": self.sticker.id}
+        url = reverse("album-match-photo", args=[self.album.pk])
+        with mock.patch(
+            "albums.matching.analyze_car_photo", return_value=match
+        ), self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(url, {"photo": self._photo()}, format="multipart")
+        self.assertEqual(Outbox.objects.get().groups, [f"user_{friend.id}"])
+        self.assertTrue(callbacks)
+
+        # The commit hook only queues the task; run it here whatever the eager setting.
+        drain_outbox.apply()
+        self.assertFalse(Outbox.objects.exists())
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event["payload"]["category"], "sticker_unlock")
+
+    @override_settings(OPENAI_BACKEND="synthetic", OPENAI_SYNTHETIC_MATCH_RATE=1, OPENAI_FAKE_LATENCY=0)
+    def test_synthetic_backend_runs_the_pipeline_offline(self):
+        get_openai_client.cache_clear()
+        self.addCleanup(get_openai_client.cache_clear)
+
+        response = self.client.post(
+            reverse("album-match-photo", args=[self.album.pk]), {"photo": self._photo()}, format="multipart"
+        )
+
+        self.assertTrue(response.data["unlocked"])
+        self.assertEqual(response.data["sticker"]["id"], self.sticker.id)
+
+    async def test_async_view_unlocks_sticker(self):
+        match = {"recognized": True, "confidence": 0.9, "sticker_id": self.sticker.id}
+        url = reverse("album-match-photo-async", args=[self.album.pk])
+        token = str(AccessToken.for_user(self.user))
+        with mock.patch("albums.matching.aanalyze_car_photo", mock.AsyncMock(return_value=match)):
+            response = await self.async_client.post(
+                url,
+                {"photo": self._photo(), "lng": "-99.1"},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body["unlocked"])
+        self.assertFalse(body["already_unlocked"])
+        capture = await UserSticker.objects.aget(user=self.user, sticker=self.sticker)
+        self.assertEqual(capture.status, UserSticker.STATUS_APPROVED)
+        self.assertEqual(float(capture.location_lng), -99.1)
+
+    async def test_async_view_answers_json_404_for_a_missing_album(self):
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.post(
+            reverse("album-match-photo-async", args=[self.album.pk + 1000]),
+            {"photo": self._photo()},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"detail": "No encontrado."})
+
+    async def test_async_view_requires_token(self):
+        response = await self.async_client.post(
+            reverse("album-match-photo-async", args=[self.album.pk]), {"photo": self._photo()}
+        )
+
+        self.assertEqual(response.status_code, 401)
@@ -1,14 +1,33 @@
+import math
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db.models import F
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-
-from achievements.models import UserSticker
-from achievements.services import analyze_car_photo
-from achievements.utils import get_friend_ids, send_notification
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from achievements.models import MatchPhotoJob, UserSticker
+from achievements.serializers import MatchPhotoJobSerializer
+from achievements.tasks import run_match_photo_job, schedule_deferred_resume
+from achievements.utils import send_notification
+from badgeup.circuit_breaker import CircuitOpen
+from badgeup.conditional import ConditionalGetMixin
+from badgeup.rate_limit import RateLimited
+from .cache import apply_user_overlay, get_album_catalog
+from .geo import MAX_ZOOM, cluster_locations, filter_bbox, nearby, parse_bbox
+from .matching import amatch_album_photo, match_album_photo
 from .models import Album, Sticker
 from .permissions import IsAdminOrReadOnly
 from .serializers import (
@@ -21,37 +40,107 @@ from .serializers import (
 )
 
 
+def annotate_album_progress(queryset, user):
+    """
+    Annotate albums with ``stickers_count`` and the user's ``captured_count`` /
+    ``points_earned`` so the album grid is served by a single query.
+    """
+    stickers = (
+        Sticker.objects.filter(album=OuterRef("pk"))
+        .order_by()
+        .values("album")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    captures = (
+        UserSticker.objects.filter(
+            user_id=getattr(user, "id", None),
+            status=UserSticker.STATUS_APPROVED,
+            sticker__album=OuterRef("pk"),
+        )
+        .order_by()
+        .values("sticker__album")
+    )
+    return queryset.annotate(
+        stickers_count=Coalesce(Subquery(stickers, output_field=IntegerField()), Value(0)),
+        captured_count=Coalesce(
+            Subquery(captures.annotate(total=Count("id")).values("total"), output_field=IntegerField()),
+            Value(0),
+        ),
+        points_earned=Coalesce(
+            Subquery(
+                captures.annotate(total=Sum("sticker__reward_points")).values("total"),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        ),
+    )
+
+
 class AlbumListCreateView(generics.ListCreateAPIView):
-    queryset = Album.objects.prefetch_related("stickers").all()
+    queryset = Album.objects.all()
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        return annotate_album_progress(super().get_queryset(), self.request.user)
+
     def get_serializer_class(self):
         if self.request.method == "POST":
             return AlbumCreateSerializer
         return AlbumSerializer
 
 
-class AlbumDetailView(generics.RetrieveUpdateAPIView):
+class AlbumDetailView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Album.objects.prefetch_related("stickers").all()
     permission_classes = [IsAdminOrReadOnly]
 
+    def get_queryset(self):
+        # GET is served from the cached catalog plus the user overlay.
+        if self.request.method in ("PUT", "PATCH"):
+            return annotate_album_progress(super().get_queryset(), self.request.user)
+        return super().get_queryset()
+
     def get_serializer_class(self):
         if self.request.method in ("PUT", "PATCH"):
             return AlbumCreateSerializer
         return AlbumDetailSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        catalog = get_album_catalog(
+            self.kwargs["pk"],
+            request,
+            annotate_album_progress(Album.objects.prefetch_related("stickers"), None),
+        )
+        return Response(apply_user_overlay(catalog, request))
 
-class StickerDetailView(generics.RetrieveUpdateAPIView):
+    def get_validator_querysets(self):
+        pk = self.kwargs["pk"]
+        return [
+            Album.objects.filter(pk=pk),
+            Sticker.objects.filter(album_id=pk),
+            UserSticker.objects.filter(user=self.request.user, sticker__album_id=pk),
+        ]
+
+
+class StickerDetailView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Sticker.objects.select_related("album")
     permission_classes = [IsAdminOrReadOnly]
 
+    def get_validator_querysets(self):
+        pk = self.kwargs["pk"]
+        return [
+            Sticker.objects.filter(pk=pk),
+            Album.objects.filter(stickers__pk=pk),
+            UserSticker.objects.filter(user=self.request.user, sticker_id=pk),
+        ]
+
     def get_serializer_class(self):
         if self.request.method in ("PUT", "PATCH"):
             return StickerCreateSerializer
         return StickerSerializer
 
 
-class StickerListCreateView(generics.ListCreateAPIView):
+class StickerListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Sticker.objects.select_related("album")
     permission_classes = [IsAdminOrReadOnly]
 
@@ -67,21 +156,54 @@ class StickerListCreateView(generics.ListCreateAPIView):
             return StickerCreateSerializer
         return StickerSerializer
 
+    def get_validator_querysets(self):
+        albums = Album.objects.all()
+        captures = UserSticker.objects.filter(user=self.request.user)
+        album_id = self.request.query_params.get("album")
+        if album_id:
+            albums = albums.filter(pk=album_id)
+            captures = captures.filter(sticker__album_id=album_id)
+        return [self.get_queryset(), albums, captures]
+
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
         return ctx
 
     def perform_create(self, serializer):
-        sticker = serializer.save()
-        send_notification(
-            [],
-            {
-                "title": "Nuevo sticker",
-                "message": f"Se agregó el sticker {sticker.name}",
-                "category": "sticker_new",
-            },
-            broadcast=True,
-        )
+        with transaction.atomic():
+            sticker = serializer.save()
+            send_notification(
+                [],
+                {
+                    "title": "Nuevo sticker",
+                    "message": f"Se agregó el sticker {sticker.name}",
+                    "category": "sticker_new",
+                },
+                broadcast=True,
+            )
+
+
+def parse_since(raw: str):
+    try:
+        # Well-formed but impossible values (2024-02-30, 25:00) raise ValueError.
+        value = parse_datetime(raw)
+        day = parse_date(raw) if value is None else None
+    except ValueError:
+        value = day = None
+    if value is None:
+        if day is None:
+            raise ValidationError({"since": "Fecha inválida, usa ISO 8601."})
+        value = datetime.combine(day, time.min)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def parse_album_id(raw: str) -> int:
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise ValidationError({"album": "album debe ser un entero."})
 
 
 class StickerLocationListView(generics.ListAPIView):
@@ -89,17 +211,141 @@ class StickerLocationListView(generics.ListAPIView):
     serializer_class = StickerLocationSerializer
 
     def get_queryset(self):
-        return (
-            UserSticker.objects.filter(
-                location_lat__isnull=False,
-                location_lng__isnull=False,
-            )
-            .select_related("sticker__album", "user")
-            .order_by("-unlocked_at")
+        qs = UserSticker.objects.filter(
+            location_lat__isnull=False,
+            location_lng__isnull=False,
+        )
+        params = self.request.query_params
+
+        bbox = params.get("bbox")
+        if bbox:
+            qs = filter_bbox(qs, parse_bbox(bbox))
+
+        since = params.get("since")
+        if since:
+            qs = qs.filter(unlocked_at__gte=parse_since(since))
+
+        album_id = params.get("album")
+        if album_id:
+            qs = qs.filter(sticker__album_id=parse_album_id(album_id))
+
+        return qs.select_related("sticker__album", "user").order_by("-unlocked_at")
+
+
+class StickerLocationClusterView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            zoom = int(request.query_params.get("zoom", 0))
+        except (TypeError, ValueError):
+            raise ValidationError({"zoom": "zoom debe ser un entero."})
+        zoom = max(0, min(zoom, MAX_ZOOM))
+
+        bbox = request.query_params.get("bbox")
+        qs = UserSticker.objects.filter(
+            location_lat__isnull=False,
+            location_lng__isnull=False,
         )
+        album_id = request.query_params.get("album")
+        if album_id:
+            qs = qs.filter(sticker__album_id=parse_album_id(album_id))
+
+        data = cluster_locations(qs, zoom, parse_bbox(bbox) if bbox else None)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class NearbyStickersView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    max_radius_km = 500
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            lat = float(params["lat"])
+            lng = float(params["lng"])
+            radius_km = float(params.get("radius_km", 5))
+            limit = int(params.get("limit", 50))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({"detail": "Envía lat, lng y opcionalmente radius_km y limit numéricos."})
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radius_km <= 0:
+            raise ValidationError({"detail": "Coordenadas o radio fuera de rango."})
+        radius_km = min(radius_km, self.max_radius_km)
+        limit = max(1, min(limit, 200))
+
+        stickers = nearby(
+            Sticker.objects.select_related("album").exclude(geohash=""),
+            lat,
+            lng,
+            radius_km,
+            limit,
+        )
+        captures = nearby(
+            UserSticker.objects.select_related("sticker__album", "user").exclude(geohash=""),
+            lat,
+            lng,
+            radius_km,
+            limit,
+        )
+
+        sticker_data = StickerSerializer(stickers, many=True, context={"request": request}).data
+        capture_data = StickerLocationSerializer(captures, many=True).data
+        for row, obj in zip(sticker_data, stickers):
+            row["distance_km"] = obj.distance_km
+        for row, obj in zip(capture_data, captures):
+            row["distance_km"] = obj.distance_km
+        return Response(
+            {"radius_km": radius_km, "stickers": sticker_data, "captures": capture_data},
+            status=status.HTTP_200_OK,
+        )
+
+
+RATE_LIMITED_MESSAGE = "El servicio de IA está saturado. Intenta de nuevo en unos segundos."
+
+
+def retry_after_header(exc: RateLimited) -> str:
+    return str(math.ceil(exc.retry_after or 1))
+
+
+CIRCUIT_OPEN_MESSAGE = (
+    "El servicio de IA no está disponible ahora. Guardamos tu foto y te avisaremos "
+    "con el resultado en cuanto vuelva."
+)
+
+
+def defer_match_photo(user, album, photo, lat, lng, exc: CircuitOpen) -> dict:
+    """
+    Park a match-photo request as a deferred job while the OpenAI circuit is
+    open; it is re-enqueued automatically when the circuit closes.
+    """
+    job = MatchPhotoJob.objects.create(
+        user=user,
+        album=album,
+        photo=photo,
+        location_lat=lat,
+        location_lng=lng,
+        status=MatchPhotoJob.STATUS_DEFERRED,
+    )
+    schedule_deferred_resume(exc.retry_after)
+    return {**MatchPhotoJobSerializer(job).data, "unlocked": False, "message": CIRCUIT_OPEN_MESSAGE}
+
+
+def parse_coordinate(value):
+    if value in (None, ""):
+        return None
+    try:
+        return round(float(value), 6)
+    except (TypeError, ValueError):
+        return None
 
 
 class MatchAlbumPhotoView(APIView):
+    """
+    Match a photo against the album. With ``?mode=job`` the photo is queued and
+    a ``202`` with the job is returned; the result arrives over the
+    notifications socket (``category: match_photo``) or via polling.
+    """
+
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
@@ -110,7 +356,6 @@ class MatchAlbumPhotoView(APIView):
             )
 
         album = get_object_or_404(Album.objects.prefetch_related("stickers"), pk=pk)
-        stickers = list(album.stickers.all())
 
         photo = request.FILES.get("photo")
         if not photo:
@@ -119,177 +364,104 @@ class MatchAlbumPhotoView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        result = analyze_car_photo(photo, stickers)
-        if not result:
-            return Response(
-                {
-                    "unlocked": False,
-                    "message": "No pudimos analizar la foto. Intenta de nuevo.",
-                },
-                status=status.HTTP_200_OK,
+        lat = parse_coordinate(request.data.get("lat"))
+        lng = parse_coordinate(request.data.get("lng"))
+
+        mode = request.query_params.get("mode") or request.data.get("mode")
+        if mode == "job":
+            job = MatchPhotoJob.objects.create(
+                user=request.user,
+                album=album,
+                photo=photo,
+                location_lat=lat,
+                location_lng=lng,
             )
+            try:
+                run_match_photo_job.delay(str(job.id))
+            except Exception:  # pragma: no cover - fallback for missing broker
+                run_match_photo_job.apply(args=[str(job.id)])
+                job.refresh_from_db()
+            return Response(MatchPhotoJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
-        recognized = bool(result.get("recognized"))
-        confidence = float(result.get("confidence") or 0)
-        sticker_id = result.get("sticker_id")
-        fun_fact = result.get("fun_fact") or ""
-        reason = result.get("reason") or ""
-        car_info = {
-            "make": result.get("make"),
-            "model": result.get("model"),
-            "generation": result.get("generation"),
-            "year_range": result.get("year_range"),
-        }
-        lat = request.data.get("lat")
-        lng = request.data.get("lng")
-
-        if not recognized:
+        try:
+            result = match_album_photo(request.user, album, photo, lat=lat, lng=lng, request=request)
+        except RateLimited as exc:
             return Response(
-                {
-                    "unlocked": False,
-                    "message": fun_fact or "Uy, esta foto no parece un coche reconocible.",
-                    "car": car_info,
-                    "reason": reason,
-                    "fun_fact": fun_fact,
-                },
-                status=status.HTTP_200_OK,
-            )
-
-        if not sticker_id:
-            msg = (
-                "Detectamos un coche "
-                f"{car_info.get('make') or ''} {car_info.get('model') or ''}".strip()
-                + ", pero aún no existe un sticker para este modelo en este álbum."
+                {"detail": RATE_LIMITED_MESSAGE},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": retry_after_header(exc)},
             )
+        except CircuitOpen as exc:
             return Response(
-                {
-                    "unlocked": False,
-                    "message": msg,
-                    "car": car_info,
-                    "reason": reason,
-                    "fun_fact": fun_fact,
-                },
-                status=status.HTTP_200_OK,
+                defer_match_photo(request.user, album, photo, lat, lng, exc),
+                status=status.HTTP_202_ACCEPTED,
             )
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class AsyncMatchAlbumPhotoView(View):
+    """
+    Native async counterpart of ``MatchAlbumPhotoView`` for ASGI deployments:
+    the OpenAI call is awaited, so in-flight matches do not pin a thread each.
+    """
 
+    http_method_names = ["post", "options"]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # JWT in the Authorization header, like every DRF view.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def post(self, request, pk):
         try:
-            sticker = album.stickers.get(pk=sticker_id)
-        except Sticker.DoesNotExist:
-            return Response(
-                {
-                    "unlocked": False,
-                    "message": "El sticker sugerido por la IA no pertenece a este álbum.",
-                    "car": car_info,
-                    "reason": reason,
-                    "fun_fact": fun_fact,
-                },
-                status=status.HTTP_200_OK,
+            auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as exc:
+            data = exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail}
+            return JsonResponse(data, status=exc.status_code)
+        if auth is None:
+            return JsonResponse(
+                {"detail": "Las credenciales de autenticación no se proveyeron."},
+                status=status.HTTP_401_UNAUTHORIZED,
             )
+        user = auth[0]
 
-        if confidence < 0.6:
-            return Response(
-                {
-                    "unlocked": False,
-                    "message": "La IA no está lo suficientemente segura para desbloquear este sticker.",
-                    "car": car_info,
-                    "reason": reason,
-                    "fun_fact": fun_fact,
-                },
-                status=status.HTTP_200_OK,
-            )
+        if not settings.USE_OPENAI_STICKER_VALIDATION or not settings.OPENAI_API_KEY:
+            return JsonResponse({"unlocked": False, "message": "Validación por IA deshabilitada."})
 
-        user_sticker, created = UserSticker.objects.get_or_create(
-            user=request.user,
-            sticker=sticker,
-        )
+        try:
+            album = await Album.objects.aget(pk=pk)
+        except Album.DoesNotExist:
+            return JsonResponse({"detail": "No encontrado."}, status=status.HTTP_404_NOT_FOUND)
 
-        if user_sticker.validated and user_sticker.status == UserSticker.STATUS_APPROVED:
-            serializer = StickerSerializer(
-                sticker, context={"request": request, "user": request.user}
-            )
-            return Response(
-                {
-                    "unlocked": True,
-                    "already_unlocked": True,
-                    "sticker": serializer.data,
-                    "match_score": confidence,
-                    "car": car_info,
-                    "reason": "Ya habías desbloqueado este sticker.",
-                    "fun_fact": fun_fact,
-                },
-                status=status.HTTP_200_OK,
+        photo = request.FILES.get("photo")
+        if not photo:
+            return JsonResponse(
+                {"detail": "Debes enviar una foto en el campo 'photo'."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
+        lat = parse_coordinate(request.POST.get("lat"))
+        lng = parse_coordinate(request.POST.get("lng"))
         try:
-            photo.seek(0)
-        except Exception:
-            pass
-
-        user_sticker.unlocked_photo = photo
-        user_sticker.unlocked_at = user_sticker.unlocked_at or timezone.now()
-        user_sticker.validation_score = confidence
-        user_sticker.validation_notes = reason
-        user_sticker.detected_make = car_info.get("make") or ""
-        user_sticker.detected_model = car_info.get("model") or ""
-        user_sticker.detected_generation = car_info.get("generation") or ""
-        user_sticker.detected_year_range = car_info.get("year_range") or ""
-        user_sticker.fun_fact = fun_fact or user_sticker.fun_fact
-        if lat not in (None, ""):
-            try:
-                user_sticker.location_lat = float(lat)
-            except (TypeError, ValueError):
-                pass
-        if lng not in (None, ""):
-            try:
-                user_sticker.location_lng = float(lng)
-            except (TypeError, ValueError):
-                pass
-
-        user_sticker.status = UserSticker.STATUS_APPROVED
-        user_sticker.validated = True
-        user_sticker.save(
-            update_fields=[
-                "unlocked_photo",
-                "unlocked_at",
-                "validation_score",
-                "validation_notes",
-                "detected_make",
-                "detected_model",
-                "detected_generation",
-                "detected_year_range",
-                "fun_fact",
-                "location_lat",
-                "location_lng",
-                "status",
-                "validated",
-                "updated_at",
-            ]
-        )
+            result = await amatch_album_photo(user, album, photo, lat=lat, lng=lng, request=request)
+        except RateLimited as exc:
+            response = JsonResponse(
+                {"detail": RATE_LIMITED_MESSAGE}, status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+            response["Retry-After"] = retry_after_header(exc)
+            return response
+        except CircuitOpen as exc:
+            payload = await sync_to_async(defer_match_photo)(user, album, photo, lat, lng, exc)
+            return JsonResponse(payload, status=status.HTTP_202_ACCEPTED)
+        return JsonResponse(result)
 
-        send_notification(
-            get_friend_ids(request.user.id),
-            {
-                "title": "Captura de amigo",
-                "message": f"{request.user.username} desbloqueó {sticker.name}",
-                "category": "sticker_unlock",
-            },
-        )
 
-        serializer = StickerSerializer(
-            sticker, context={"request": request, "user": request.user}
-        )
-        return Response(
-            {
-                "unlocked": True,
-                "already_unlocked": False,
-                "sticker": serializer.data,
-                "match_score": confidence,
-                "car": car_info,
-                "reason": reason,
-                "fun_fact": fun_fact,
-            },
-            status=status.HTTP_200_OK,
-        )
+class MatchPhotoJobDetailView(generics.RetrieveAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = MatchPhotoJobSerializer
+
+    def get_queryset(self):
+        return MatchPhotoJob.objects.filter(user=self.request.user)
 
 
 class StickerMessageView(APIView):
@@ -1,9 +1,53 @@
 import os
 
 from celery import Celery
+from kombu import Queue
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "badgeup.settings")
 
+# OpenAI-bound validations and match-photo jobs (I/O-bound, high concurrency).
+VALIDATION_QUEUE = "validation"
+# Notification fan-out; must never wait behind model calls.
+REALTIME_QUEUE = "realtime"
+# Thumbnails, indexes, point sync and other background upkeep.
+MAINTENANCE_QUEUE = "maintenance"
+
+# Safety net for the outbox: rows whose drain_outbox message was lost are
+# picked up within this many seconds (run ``celery -A badgeup beat``).
+OUTBOX_SWEEP_INTERVAL = float(os.environ.get("OUTBOX_SWEEP_INTERVAL", 30))
+
 app = Celery("badgeup")
 app.config_from_object("django.conf:settings", namespace="CELERY")
+app.conf.update(
+    task_queues=[
+        Queue(VALIDATION_QUEUE),
+        Queue(REALTIME_QUEUE),
+        Queue(MAINTENANCE_QUEUE),
+    ],
+    task_default_queue=MAINTENANCE_QUEUE,
+    # With the Redis transport 0 is the highest priority; each queue is split
+    # into per-priority lists that workers drain in order.
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
+    task_default_priority=5,
+    task_routes={
+        "achievements.tasks.drain_outbox": {"queue": REALTIME_QUEUE, "priority": 0},
+        "achievements.tasks.run_match_photo_job": {"queue": VALIDATION_QUEUE, "priority": 2},
+        "achievements.tasks.validate_user_sticker": {"queue": VALIDATION_QUEUE, "priority": 6},
+        "achievements.tasks.resume_deferred_validations": {"queue": MAINTENANCE_QUEUE, "priority": 3},
+        "achievements.tasks.refresh_car_lookup": {"queue": MAINTENANCE_QUEUE, "priority": 5},
+        "albums.tasks.refresh_sticker_index": {"queue": MAINTENANCE_QUEUE, "priority": 5},
+        "albums.tasks.generate_image_variants": {"queue": MAINTENANCE_QUEUE, "priority": 7},
+    },
+    beat_schedule={
+        "sweep-outbox": {
+            "task": "achievements.tasks.drain_outbox",
+            "schedule": OUTBOX_SWEEP_INTERVAL,
+            "options": {"queue": REALTIME_QUEUE, "priority": 0, "expires": OUTBOX_SWEEP_INTERVAL},
+        },
+    },
+)
 app.autodiscover_tasks()
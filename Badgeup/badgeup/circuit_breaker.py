@@ -0,0 +1,203 @@
+"""
+Circuit breaker shared through Redis.
+
+``closed``: calls go through and their outcome is counted in a rolling window;
+once at least ``min_calls`` were made and the share of failures (errors or
+calls slower than ``slow_call_seconds``) reaches ``failure_rate``, the circuit
+opens. ``open``: calls fail fast with ``CircuitOpen`` for ``open_seconds``.
+``half_open``: up to ``half_open_calls`` probes go through; a good probe closes
+the circuit (and sends ``circuit_closed``), a bad one opens it again. Callers
+record an outcome for every call that was made and ``cancel`` the ones that
+were not, so a probe is never left pending.
+
+Every process reads the same state, so one worker seeing the outage protects
+the whole cluster. Without Redis the breaker stays closed.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django.dispatch import Signal
+
+from badgeup.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Outcomes are counted in slices of the rolling window.
+SLICES = 6
+
+# Only decrement a live probe counter, keeping its TTL; it is gone once the
+# circuit closed or reopened.
+RELEASE_PROBE_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') > 0 then
+  return redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+
+circuit_closed = Signal()
+
+
+class CircuitOpen(Exception):
+    """The protected service is considered down; the call was not made."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open (retry after {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        min_calls: int,
+        window: float,
+        slow_call_seconds: float,
+        open_seconds: float,
+        half_open_calls: int,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.prefix = f"circuit:{name}"
+        self.state_key = f"{self.prefix}:state"
+        self.probes_key = f"{self.prefix}:probes"
+
+    def _slice_key(self, index: int) -> str:
+        return f"{self.prefix}:stats:{index}"
+
+    def _slice_index(self, now: float) -> int:
+        return int(now // (self.window / SLICES))
+
+    def status(self) -> tuple[str, float]:
+        """``(state, seconds_until_probes_are_allowed)``."""
+        try:
+            raw = get_redis().hgetall(self.state_key)
+        except (RedisError, RuntimeError):
+            return CLOSED, 0
+        state = (raw.get(b"state") or b"").decode() or CLOSED
+        until = float(raw.get(b"until") or 0)
+        return state, max(0.0, until - time.time()) if state == OPEN else 0.0
+
+    def allow(self) -> None:
+        """Raise ``CircuitOpen`` unless a call may be made now."""
+        state, remaining = self.status()
+        if state == CLOSED:
+            return
+        if remaining > 0:
+            raise CircuitOpen(self.name, remaining)
+        try:
+            client = get_redis()
+            pipe = client.pipeline()
+            pipe.incr(self.probes_key)
+            pipe.expire(self.probes_key, int(self.open_seconds) or 1)
+            probes = pipe.execute()[0]
+            if probes > self.half_open_calls:
+                raise CircuitOpen(self.name, self.open_seconds)
+            if state == OPEN:
+                client.hset(self.state_key, "state", HALF_OPEN)
+                logger.info("Circuit %s half-open", self.name)
+        except (RedisError, RuntimeError):
+            return
+
+    def cancel(self) -> None:
+        """Give back the probe taken by ``allow`` for a call that was never made."""
+        try:
+            get_redis().eval(RELEASE_PROBE_SCRIPT, 1, self.probes_key)
+        except (RedisError, RuntimeError):
+            return
+
+    def record_success(self, elapsed: float) -> None:
+        if elapsed > self.slow_call_seconds:
+            logger.warning("Slow call through circuit %s: %.1fs", self.name, elapsed)
+            self.record_failure()
+            return
+        self._record(failed=False)
+
+    def record_failure(self) -> None:
+        self._record(failed=True)
+
+    def _record(self, failed: bool) -> None:
+        try:
+            state, _ = self.status()
+            if state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._close()
+                return
+            if state == OPEN:
+                # A call that started before the circuit opened.
+                return
+
+            now = time.time()
+            current = self._slice_index(now)
+            client = get_redis()
+            pipe = client.pipeline()
+            pipe.hincrby(self._slice_key(current), "calls", 1)
+            if failed:
+                pipe.hincrby(self._slice_key(current), "failures", 1)
+            pipe.expire(self._slice_key(current), int(self.window) * 2)
+            pipe.execute()
+            if not failed:
+                return
+
+            pipe = client.pipeline()
+            for index in range(current - SLICES + 1, current + 1):
+                pipe.hmget(self._slice_key(index), "calls", "failures")
+            calls = failures = 0
+            for slice_calls, slice_failures in pipe.execute():
+                calls += int(slice_calls or 0)
+                failures += int(slice_failures or 0)
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open()
+        except (RedisError, RuntimeError):
+            logger.warning("Circuit %s state unavailable", self.name)
+
+    def _clear_stats(self, pipe) -> None:
+        current = self._slice_index(time.time())
+        pipe.delete(self.probes_key, *(self._slice_key(i) for i in range(current - SLICES + 1, current + 1)))
+
+    def _open(self) -> None:
+        pipe = get_redis().pipeline()
+        pipe.hset(self.state_key, mapping={"state": OPEN, "until": time.time() + self.open_seconds})
+        self._clear_stats(pipe)
+        pipe.execute()
+        logger.warning("Circuit %s opened for %ss", self.name, self.open_seconds)
+
+    def _close(self) -> None:
+        pipe = get_redis().pipeline()
+        pipe.delete(self.state_key)
+        self._clear_stats(pipe)
+        deleted = pipe.execute()[0]
+        if deleted:
+            logger.info("Circuit %s closed", self.name)
+            circuit_closed.send(sender=self.__class__, name=self.name)
+
+
+def get_openai_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "openai",
+        failure_rate=float(getattr(settings, "OPENAI_CIRCUIT_FAILURE_RATE", 0.5)),
+        min_calls=int(getattr(settings, "OPENAI_CIRCUIT_MIN_CALLS", 10)),
+        window=float(getattr(settings, "OPENAI_CIRCUIT_WINDOW", 60)),
+        slow_call_seconds=float(getattr(settings, "OPENAI_CIRCUIT_SLOW_CALL_SECONDS", 20)),
+        open_seconds=float(getattr(settings, "OPENAI_CIRCUIT_OPEN_SECONDS", 30)),
+        half_open_calls=int(getattr(settings, "OPENAI_CIRCUIT_HALF_OPEN_CALLS", 2)),
+    )
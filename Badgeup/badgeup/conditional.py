@@ -0,0 +1,53 @@
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET requests with ``304 Not Modified`` when the client's validators
+    still match, before any serializer runs.
+
+    Views return the querysets their payload depends on from
+    ``get_validator_querysets()``; each one is reduced to ``max(updated_at)``
+    and a row count (so deletions also change the ETag).
+    """
+
+    use_last_modified = True
+
+    def get_validator_querysets(self):
+        raise NotImplementedError
+
+    def get_etag_extra(self):
+        return ()
+
+    def get_validators(self, request):
+        parts = [request.user.pk, request.get_full_path(), *self.get_etag_extra()]
+        last_modified = None
+        for queryset in self.get_validator_querysets():
+            stats = queryset.order_by().aggregate(last=Max("updated_at"), total=Count("pk"))
+            parts.extend([stats["last"] and stats["last"].isoformat(), stats["total"]])
+            if stats["last"] and (last_modified is None or stats["last"] > last_modified):
+                last_modified = stats["last"]
+        etag = quote_etag(hashlib.md5(repr(parts).encode("utf-8")).hexdigest())
+        if not self.use_last_modified or last_modified is None:
+            return etag, None
+        return etag, timegm(last_modified.utctimetuple())
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ("Authorization",))
+        return response
@@ -0,0 +1,169 @@
+"""
+Fixed-width image variants (thumbnails) for uploaded images.
+
+Each model registers ``(image field, variants JSONField)`` pairs with
+``register_variant_field``. When the stored image changes, a Celery task
+renders one variant per width in ``VARIANT_WIDTHS`` and records the storage
+names as ``{"source": <original name>, "128": <name>, ...}``.
+"""
+
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    Image = None  # type: ignore
+
+VARIANT_WIDTHS = tuple(getattr(settings, "IMAGE_VARIANT_WIDTHS", (128, 384, 1024)))
+VARIANT_QUALITY = int(getattr(settings, "IMAGE_VARIANT_QUALITY", 80))
+
+# {("app_label.Model", image field): variants field}
+VARIANT_FIELDS: dict[tuple[str, str], str] = {}
+
+
+VISION_LONG_EDGE = int(getattr(settings, "VISION_IMAGE_LONG_EDGE", 768))
+VISION_QUALITY = int(getattr(settings, "VISION_IMAGE_QUALITY", 80))
+VISION_MAX_PIXELS = int(getattr(settings, "VISION_IMAGE_MAX_PIXELS", 40_000_000))
+
+
+class UnreadableImage(ValueError):
+    """The file is not an image Pillow can safely decode (corrupt, bomb or too large)."""
+
+
+def prepare_for_vision(fileobj, long_edge: int = VISION_LONG_EDGE, quality: int = VISION_QUALITY) -> bytes:
+    """
+    Return JPEG bytes of ``fileobj`` with EXIF orientation applied and the long
+    edge capped at ``long_edge``. JPEG sources are decoded at reduced scale
+    (``draft``) so huge phone photos never get fully decompressed in memory.
+    Raises ``UnreadableImage`` when Pillow cannot read the file, for
+    decompression bombs and for images above ``VISION_IMAGE_MAX_PIXELS``
+    after drafting.
+    """
+    if Image is None:
+        return fileobj.read()
+    try:
+        with Image.open(fileobj) as original:
+            original.draft("RGB", (long_edge, long_edge))
+            if original.width * original.height > VISION_MAX_PIXELS:
+                raise UnreadableImage(f"Image too large ({original.width}x{original.height})")
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            return buffer.getvalue()
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise UnreadableImage(str(exc)) from exc
+
+
+def _variant_format() -> tuple[str, str]:
+    if Image is not None and features.check("webp"):
+        return "WEBP", "webp"
+    return "JPEG", "jpg"
+
+
+def _is_local_name(name: str) -> bool:
+    return bool(name) and not name.startswith(("http://", "https://"))
+
+
+def needs_variants(fieldfile, variants) -> bool:
+    name = getattr(fieldfile, "name", "") or ""
+    return _is_local_name(name) and (variants or {}).get("source") != name
+
+
+def render_variants(fieldfile) -> dict:
+    """
+    Render and store one resized copy of ``fieldfile`` per configured width.
+    Images are never upscaled; widths above the original reuse its size.
+    Raises ValueError for decompression bombs.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+
+    fmt, ext = _variant_format()
+    storage = fieldfile.storage
+    folder, filename = os.path.split(fieldfile.name)
+    stem = os.path.splitext(filename)[0]
+
+    with fieldfile.open("rb") as handle:
+        try:
+            with Image.open(handle) as original:
+                image = ImageOps.exif_transpose(original)
+                image = image.convert("RGBA" if fmt == "WEBP" and image.mode in ("RGBA", "LA", "P") else "RGB")
+        except Image.DecompressionBombError as exc:
+            raise ValueError(str(exc)) from exc
+
+    variants = {"source": fieldfile.name}
+    for width in VARIANT_WIDTHS:
+        target = min(width, image.width)
+        height = max(1, round(image.height * target / image.width))
+        resized = image.resize((target, height), Image.LANCZOS) if target != image.width else image
+        buffer = io.BytesIO()
+        resized.save(buffer, fmt, quality=VARIANT_QUALITY, optimize=True)
+        name = os.path.join(folder, "variants", f"{stem}-{width}.{ext}")
+        if storage.exists(name):
+            storage.delete(name)
+        variants[str(width)] = storage.save(name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_variants(storage, variants) -> None:
+    for key, name in (variants or {}).items():
+        if key == "source" or not name:
+            continue
+        try:
+            storage.delete(name)
+        except Exception:  # pragma: no cover - best effort cleanup
+            logger.warning("Could not delete image variant %s", name)
+
+
+def variant_urls(variants, request=None) -> dict:
+    """Map each width to an (absolute when possible) URL; ``{}`` until rendered."""
+    from django.core.files.storage import default_storage
+
+    urls = {}
+    for key, name in (variants or {}).items():
+        if key == "source" or not name:
+            continue
+        url = default_storage.url(name)
+        urls[key] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+def enqueue_variants(model, pk: int, field_name: str) -> None:
+    """Queue ``generate_image_variants``, rendering inline when the broker is unreachable."""
+    from albums.tasks import generate_image_variants
+
+    label = model._meta.label
+    try:
+        generate_image_variants.delay(label, pk, field_name)
+    except Exception:  # pragma: no cover - fallback for missing broker
+        generate_image_variants.apply(args=[label, pk, field_name])
+
+
+def register_variant_field(model, field_name: str, variants_field: str) -> None:
+    """Queue variant generation whenever ``model.<field_name>`` points to a new file."""
+    VARIANT_FIELDS[(model._meta.label, field_name)] = variants_field
+
+    def handler(sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        if needs_variants(getattr(instance, field_name), getattr(instance, variants_field)):
+            transaction.on_commit(lambda: enqueue_variants(sender, instance.pk, field_name))
+
+    post_save.connect(
+        handler,
+        sender=model,
+        weak=False,
+        dispatch_uid=f"image_variants:{model._meta.label}:{field_name}",
+    )
@@ -0,0 +1,337 @@
+"""
+Alternative OpenAI clients for benchmarks without a live key.
+
+``OPENAI_BACKEND`` selects what ``get_openai_client`` returns:
+
+- ``live`` (default): the SDK client.
+- ``record``: the SDK client; every ``chat.completions.create`` and
+  ``responses.create`` call is also written to ``OPENAI_RECORD_DIR`` as
+  ``<kind>/<fingerprint>.json`` with the response and its latency.
+- ``replay``: serves those files back. Requests without a recording get one
+  of the same kind (chosen by fingerprint) unless ``OPENAI_REPLAY_STRICT``.
+- ``synthetic``: answers every prompt with schema-valid JSON built from the
+  request (album sticker ids, a plausible car, a match score).
+
+Offline backends wait ``OPENAI_FAKE_LATENCY`` seconds (the recorded latency
+when unset in replay) +/- ``OPENAI_FAKE_LATENCY_JITTER``, and fail with a 5xx
+or a 429 at ``OPENAI_FAKE_ERROR_RATE`` / ``OPENAI_FAKE_RATE_LIMIT_RATE``, so
+the rate limiter, circuit breaker and retries run as they would in production.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+SYNTHETIC = "synthetic"
+OFFLINE_BACKENDS = {REPLAY, SYNTHETIC}
+
+CHAT = "chat"
+RESPONSES = "responses"
+
+# Charged per photo by the vision model at VISION_IMAGE_LONG_EDGE.
+IMAGE_TOKENS = 765
+
+SYNTHETIC_CARS = [
+    ("Toyota", "Supra", "A80", "1993-2002"),
+    ("Nissan", "Skyline GT-R", "R34", "1999-2002"),
+    ("Volkswagen", "Golf GTI", "Mk7", "2013-2020"),
+    ("Ford", "Mustang", "S550", "2015-2023"),
+    ("Mazda", "MX-5", "NA", "1989-1997"),
+    ("Porsche", "911", "992", "2019-"),
+]
+
+STICKER_LINE = re.compile(r"^- ID (\d+): (.*?) —", re.MULTILINE)
+
+
+def backend_name() -> str:
+    return getattr(settings, "OPENAI_BACKEND", LIVE) or LIVE
+
+
+def _record_dir() -> Path:
+    return Path(getattr(settings, "OPENAI_RECORD_DIR", Path(settings.BASE_DIR) / "openai_recordings"))
+
+
+def _redact(value):
+    """Replace inline images by their hash so recordings stay small."""
+    if isinstance(value, dict):
+        return {key: _redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(item) for item in value]
+    if isinstance(value, str) and value.startswith("data:"):
+        return f"data:sha256:{hashlib.sha256(value.encode('utf-8')).hexdigest()}"
+    return value
+
+
+def fingerprint(kind: str, request: dict) -> str:
+    canonical = json.dumps([kind, _redact(request)], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _to_namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_to_namespace(item) for item in value]
+    return value
+
+
+def _from_namespace(value):
+    if isinstance(value, SimpleNamespace):
+        return {key: _from_namespace(item) for key, item in vars(value).items()}
+    if isinstance(value, list):
+        return [_from_namespace(item) for item in value]
+    return value
+
+
+def _dump_response(kind: str, response) -> dict:
+    data = response.model_dump(mode="json") if hasattr(response, "model_dump") else _from_namespace(response)
+    if kind == RESPONSES:
+        data["output_text"] = response.output_text
+    return data
+
+
+def _injected_error(status: int) -> Exception:
+    import httpx
+    from openai import InternalServerError, RateLimitError
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/offline")
+    if status == 429:
+        response = httpx.Response(429, request=request, headers={"retry-after": "1"})
+        return RateLimitError("Injected rate limit", response=response, body=None)
+    return InternalServerError("Injected server error", response=httpx.Response(status, request=request), body=None)
+
+
+class _Endpoint:
+    def __init__(self, kind: str, call):
+        self._kind = kind
+        self._call = call
+
+    def create(self, **request):
+        return self._call(self._kind, request)
+
+
+class _Client:
+    """The ``chat.completions.create`` / ``responses.create`` surface over ``call(kind, request)``."""
+
+    def __init__(self, call):
+        self.chat = SimpleNamespace(completions=_Endpoint(CHAT, call))
+        self.responses = _Endpoint(RESPONSES, call)
+
+
+def _endpoint(client, kind: str):
+    return client.chat.completions.create if kind == CHAT else client.responses.create
+
+
+class Recorder:
+    def __init__(self, client, directory: Path):
+        self.client = client
+        self.directory = directory
+
+    def _save(self, kind: str, request: dict, response, elapsed: float) -> None:
+        fp = fingerprint(kind, request)
+        target = self.directory / kind / f"{fp}.json"
+        payload = {
+            "kind": kind,
+            "fingerprint": fp,
+            "request": _redact(request),
+            "response": _dump_response(kind, response),
+            "elapsed": round(elapsed, 4),
+        }
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, target)
+        except OSError:
+            logger.exception("Could not record OpenAI response %s", fp)
+
+    def call(self, kind: str, request: dict):
+        started = time.monotonic()
+        response = _endpoint(self.client, kind)(**request)
+        self._save(kind, request, response, time.monotonic() - started)
+        return response
+
+    async def acall(self, kind: str, request: dict):
+        started = time.monotonic()
+        response = await _endpoint(self.client, kind)(**request)
+        await sync_to_async(self._save, thread_sensitive=False)(kind, request, response, time.monotonic() - started)
+        return response
+
+
+class ReplaySource:
+    def __init__(self, directory: Path, strict: bool):
+        self.directory = directory
+        self.strict = strict
+        self._files: dict[str, list[Path]] = {}
+
+    def respond(self, kind: str, request: dict) -> tuple[dict, float | None]:
+        fp = fingerprint(kind, request)
+        path = self.directory / kind / f"{fp}.json"
+        if not path.exists():
+            if self.strict:
+                raise LookupError(f"No recorded OpenAI response for {kind} request {fp}")
+            if kind not in self._files:
+                self._files[kind] = sorted((self.directory / kind).glob("*.json"))
+            if not self._files[kind]:
+                raise LookupError(f"No recorded OpenAI responses in {self.directory / kind}")
+            path = self._files[kind][int(fp, 16) % len(self._files[kind])]
+        recording = json.loads(path.read_text(encoding="utf-8"))
+        return recording["response"], recording.get("elapsed")
+
+
+class SyntheticSource:
+    def __init__(self, match_rate: float):
+        self.match_rate = match_rate
+
+    @staticmethod
+    def _usage(request: dict, content: str) -> dict:
+        texts, images = [], 0
+        messages = request.get("messages") or request.get("input") or []
+        for message in messages:
+            parts = message.get("content")
+            for part in parts if isinstance(parts, list) else [{"text": parts or ""}]:
+                if part.get("type") in {"image_url", "input_image"}:
+                    images += 1
+                else:
+                    texts.append(part.get("text") or "")
+        prompt = sum(len(text) for text in texts) // 4 + images * IMAGE_TOKENS
+        completion = len(content) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def _car(self, rng: random.Random, prompt: str) -> dict:
+        stickers = STICKER_LINE.findall(prompt)
+        if rng.random() >= self.match_rate:
+            return {
+                "recognized": False,
+                "make": None,
+                "model": None,
+                "generation": None,
+                "year_range": None,
+                "confidence": 0,
+                "sticker_id": None,
+                "reason": "Respuesta sintética sin coche.",
+                "fun_fact": "Uy, esto no parece un coche.",
+            }
+        make, model, generation, years = rng.choice(SYNTHETIC_CARS)
+        sticker_id = None
+        if stickers:
+            sticker_id, model = rng.choice(stickers)
+            sticker_id = int(sticker_id)
+        return {
+            "recognized": True,
+            "make": make,
+            "model": model,
+            "generation": generation,
+            "year_range": years,
+            "confidence": round(rng.uniform(0.6, 0.98), 2),
+            "sticker_id": sticker_id,
+            "reason": "Respuesta sintética.",
+            "fun_fact": f"Dato sintético sobre el {make} {model}.",
+        }
+
+    def respond(self, kind: str, request: dict) -> tuple[dict, float | None]:
+        fp = fingerprint(kind, request)
+        rng = random.Random(fp)
+        if kind == RESPONSES:
+            is_match = rng.random() < self.match_rate
+            content = json.dumps(
+                {
+                    "match_score": round(rng.uniform(0.6, 0.98) if is_match else rng.uniform(0, 0.5), 2),
+                    "is_match": is_match,
+                    "reason": "Respuesta sintética.",
+                }
+            )
+            response = {"id": f"resp_synthetic_{fp[:16]}", "output_text": content}
+        else:
+            prompt = request["messages"][-1]["content"][0]["text"]
+            content = json.dumps(self._car(rng, prompt), ensure_ascii=False)
+            response = {
+                "id": f"chatcmpl-synthetic-{fp[:16]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [
+                    {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+                ],
+            }
+        response["usage"] = self._usage(request, content)
+        return response, None
+
+
+class OfflineBackend:
+    """Serves a source's responses with injected latency and failures."""
+
+    def __init__(self, source, latency: float | None, jitter: float, error_rate: float, rate_limit_rate: float):
+        self.source = source
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+
+    def _delay(self, recorded: float | None) -> float:
+        base = self.latency if self.latency is not None else recorded or 0.0
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _fault(self) -> Exception | None:
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return _injected_error(429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            return _injected_error(500)
+        return None
+
+    def call(self, kind: str, request: dict):
+        data, recorded = self.source.respond(kind, request)
+        time.sleep(self._delay(recorded))
+        fault = self._fault()
+        if fault is not None:
+            raise fault
+        return _to_namespace(data)
+
+    async def acall(self, kind: str, request: dict):
+        data, recorded = await sync_to_async(self.source.respond, thread_sensitive=False)(kind, request)
+        await asyncio.sleep(self._delay(recorded))
+        fault = self._fault()
+        if fault is not None:
+            raise fault
+        return _to_namespace(data)
+
+
+def _offline_backend(name: str) -> OfflineBackend:
+    if name == REPLAY:
+        source = ReplaySource(_record_dir(), bool(getattr(settings, "OPENAI_REPLAY_STRICT", False)))
+    else:
+        source = SyntheticSource(float(getattr(settings, "OPENAI_SYNTHETIC_MATCH_RATE", 0.8)))
+    latency = getattr(settings, "OPENAI_FAKE_LATENCY", None)
+    return OfflineBackend(
+        source,
+        latency=None if latency is None else float(latency),
+        jitter=float(getattr(settings, "OPENAI_FAKE_LATENCY_JITTER", 0.2)),
+        error_rate=float(getattr(settings, "OPENAI_FAKE_ERROR_RATE", 0)),
+        rate_limit_rate=float(getattr(settings, "OPENAI_FAKE_RATE_LIMIT_RATE", 0)),
+    )
+
+
+def offline_client(name: str, asynchronous: bool = False):
+    backend = _offline_backend(name)
+    return _Client(backend.acall if asynchronous else backend.call)
+
+
+def recording_client(client, asynchronous: bool = False):
+    recorder = Recorder(client, _record_dir())
+    return _Client(recorder.acall if asynchronous else recorder.call)
@@ -1,11 +1,57 @@
+import asyncio
+import weakref
 from functools import lru_cache
 
 from django.conf import settings
 
+from . import openai_backends
+
 try:
-    from openai import OpenAI
+    from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI, RateLimitError
 except ImportError:  # pragma: no cover - dependency guarded by requirements
-    OpenAI = None  # type: ignore
+    AsyncOpenAI = OpenAI = None  # type: ignore
+
+    class APIConnectionError(Exception):  # type: ignore
+        pass
+
+    class APIStatusError(Exception):  # type: ignore
+        status_code = 0
+
+    class RateLimitError(APIStatusError):  # type: ignore
+        pass
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _client_options(asynchronous: bool = False) -> dict:
+    options = {
+        "api_key": settings.OPENAI_API_KEY,
+        "timeout": float(getattr(settings, "OPENAI_TIMEOUT", 30)),
+    }
+    # The sync client keeps the SDK's retries unless OPENAI_MAX_RETRIES is set.
+    # The async client serves web requests, which answer 429 with Retry-After
+    # at once instead of holding the request in SDK retries.
+    if asynchronous:
+        options["max_retries"] = int(getattr(settings, "OPENAI_ASYNC_MAX_RETRIES", 0))
+    elif getattr(settings, "OPENAI_MAX_RETRIES", None) is not None:
+        options["max_retries"] = int(settings.OPENAI_MAX_RETRIES)
+    return options
+
+
+def is_outage(exc: Exception) -> bool:
+    """Whether ``exc`` means the API is unreachable or failing, not a bad request."""
+    if isinstance(exc, APIConnectionError):
+        return True
+    return isinstance(exc, APIStatusError) and getattr(exc, "status_code", 0) >= 500
+
+
+def _check_configured(client_class) -> None:
+    if not settings.OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not configured")
+    if client_class is None:
+        raise RuntimeError("openai package is not installed")
 
 
 @lru_cache(maxsize=1)
@@ -13,9 +59,37 @@ def get_openai_client():
     """
     Return a shared OpenAI client configured with the API key from settings.
     Raises RuntimeError if the SDK is missing or API key is not set.
+    ``OPENAI_BACKEND`` swaps in a recording, replay or synthetic client
+    (``badgeup.openai_backends``).
     """
-    if not settings.OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not configured")
-    if OpenAI is None:
-        raise RuntimeError("openai package is not installed")
-    return OpenAI(api_key=settings.OPENAI_API_KEY)
+    backend = openai_backends.backend_name()
+    if backend in openai_backends.OFFLINE_BACKENDS:
+        return openai_backends.offline_client(backend)
+    _check_configured(OpenAI)
+    client = OpenAI(**_client_options())
+    if backend == openai_backends.RECORD:
+        return openai_backends.recording_client(client)
+    return client
+
+
+def get_async_openai_client():
+    """
+    Return the AsyncOpenAI client of the running event loop. Its connection
+    pool is bound to the loop, so each loop (one per ASGI worker) gets its own.
+    """
+    backend = openai_backends.backend_name()
+    if backend not in openai_backends.OFFLINE_BACKENDS:
+        _check_configured(AsyncOpenAI)
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        if backend in openai_backends.OFFLINE_BACKENDS:
+            client = openai_backends.offline_client(backend, asynchronous=True)
+        elif backend == openai_backends.RECORD:
+            client = openai_backends.recording_client(
+                AsyncOpenAI(**_client_options(asynchronous=True)), asynchronous=True
+            )
+        else:
+            client = AsyncOpenAI(**_client_options(asynchronous=True))
+        _async_clients[loop] = client
+    return client
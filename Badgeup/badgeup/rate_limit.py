@@ -0,0 +1,150 @@
+"""
+Cluster-wide token bucket for OpenAI calls.
+
+Web processes and Celery workers share one Redis hash holding two buckets,
+requests and tokens per minute, refilled continuously. A call takes one
+request plus its estimated tokens; the estimate is corrected with the real
+usage once the response arrives. When Redis is unreachable the limiter lets
+calls through and the provider's own 429s take over.
+"""
+
+import asyncio
+import logging
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from badgeup.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import RedisError
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    RedisError = OSError  # type: ignore
+
+# Returns 0 and takes the capacity when both buckets allow the call, otherwise
+# the milliseconds until they will.
+ACQUIRE_SCRIPT = """
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts')
+local req = tonumber(state[1]) or rpm
+local tok = tonumber(state[2]) or tpm
+local ts = tonumber(state[3]) or now
+local elapsed = math.max(0, now - ts)
+req = math.min(rpm, req + elapsed * rpm / 60000)
+tok = math.min(tpm, tok + elapsed * tpm / 60000)
+local wait = 0
+if req < 1 then
+  wait = (1 - req) * 60000 / rpm
+end
+local need = math.min(cost, tpm)
+if tok < need then
+  wait = math.max(wait, (need - tok) * 60000 / tpm)
+end
+if wait == 0 then
+  req = req - 1
+  tok = tok - cost
+end
+redis.call('HSET', KEYS[1], 'req', tostring(req), 'tok', tostring(tok), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], 120000)
+return math.ceil(wait)
+"""
+
+
+class RateLimited(Exception):
+    """The call was not made: the shared budget is exhausted or the provider answered 429."""
+
+    def __init__(self, retry_after: float | None = None):
+        super().__init__(f"Rate limited (retry after {retry_after}s)")
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """
+    Full-jitter exponential backoff, never shorter than the ``Retry-After``
+    the provider asked for.
+    """
+    base = float(getattr(settings, "OPENAI_BACKOFF_BASE", 2))
+    cap = float(getattr(settings, "OPENAI_BACKOFF_MAX", 300))
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+def retry_after_from(exc) -> float | None:
+    """Seconds requested by the provider in a 429 response, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, rpm: int, tpm: int, max_wait: float):
+        self.key = f"ratelimit:{name}"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Seconds to wait before ``tokens`` are available; 0 means granted."""
+        try:
+            client = get_redis()
+            wait_ms = client.eval(ACQUIRE_SCRIPT, 1, self.key, self.rpm, self.tpm, tokens)
+        except (RedisError, RuntimeError):
+            logger.warning("Rate limiter unavailable; letting the call through")
+            return 0
+        return int(wait_ms) / 1000
+
+    def acquire(self, tokens: int) -> None:
+        """
+        Block until the call fits in the shared budget. Raises ``RateLimited``
+        instead of sleeping past ``max_wait`` so workers can reschedule.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimited(wait)
+            time.sleep(wait + random.uniform(0, 0.05))
+
+    async def aacquire(self, tokens: int) -> None:
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = await sync_to_async(self._try_acquire, thread_sensitive=False)(tokens)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimited(wait)
+            await asyncio.sleep(wait + random.uniform(0, 0.05))
+
+    def record_usage(self, estimated: int, used: int | None) -> None:
+        """Charge (or refund) the difference between the estimate and real usage."""
+        if used is None or used == estimated:
+            return
+        try:
+            get_redis().hincrbyfloat(self.key, "tok", estimated - used)
+        except (RedisError, RuntimeError):
+            logger.warning("Could not record OpenAI token usage")
+
+
+def get_openai_limiter() -> TokenBucketLimiter:
+    return TokenBucketLimiter(
+        "openai",
+        rpm=int(getattr(settings, "OPENAI_RPM_LIMIT", 500)),
+        tpm=int(getattr(settings, "OPENAI_TPM_LIMIT", 200_000)),
+        max_wait=float(getattr(settings, "OPENAI_RATE_LIMIT_MAX_WAIT", 5)),
+    )
@@ -0,0 +1,28 @@
+import os
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - dependency guarded by requirements
+    redis = None  # type: ignore
+
+
+def get_redis_url() -> str:
+    return getattr(settings, "REDIS_URL", "") or os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """
+    Return a shared Redis client pointing at the same server as the channel layer.
+    Raises RuntimeError if the redis package is missing.
+    """
+    if redis is None:
+        raise RuntimeError("redis package is not installed")
+    return redis.Redis.from_url(
+        get_redis_url(),
+        socket_connect_timeout=1,
+        socket_timeout=1,
+    )
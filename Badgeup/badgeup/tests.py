@@ -0,0 +1,192 @@
+import io
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, circuit_closed
+from .images import UnreadableImage, prepare_for_vision
+from .openai_client import _client_options
+from .rate_limit import RateLimited, TokenBucketLimiter
+
+
+def _png(size, mode="RGB") -> io.BytesIO:
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, "PNG")
+    buffer.seek(0)
+    return buffer
+
+
+class PrepareForVisionTests(SimpleTestCase):
+    def test_downscales_to_jpeg(self):
+        prepared = prepare_for_vision(_png((2000, 1000), "RGBA"), long_edge=768)
+
+        with Image.open(io.BytesIO(prepared)) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (768, 384))
+
+    def test_oversized_image_is_unreadable(self):
+        with mock.patch("badgeup.images.VISION_MAX_PIXELS", 100 * 100):
+            with self.assertRaises(UnreadableImage):
+                prepare_for_vision(_png((101, 100)))
+
+    def test_decompression_bomb_is_unreadable(self):
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            with self.assertRaises(UnreadableImage):
+                prepare_for_vision(_png((64, 64)))
+
+    def test_non_image_bytes_are_unreadable(self):
+        with self.assertRaises(UnreadableImage):
+            prepare_for_vision(io.BytesIO(b"not an image"))
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("badgeup.rate_limit.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = TokenBucketLimiter("test", rpm=2, tpm=1000, max_wait=0)
+
+    def _rewind(self, seconds: float) -> None:
+        ts = float(self.redis.hget(self.limiter.key, "ts"))
+        self.redis.hset(self.limiter.key, "ts", ts - seconds * 1000)
+
+    def test_rejects_once_the_request_bucket_is_empty(self):
+        self.limiter.acquire(10)
+        self.limiter.acquire(10)
+
+        with self.assertRaises(RateLimited) as caught:
+            self.limiter.acquire(10)
+        self.assertGreater(caught.exception.retry_after, 0)
+        self.assertLessEqual(caught.exception.retry_after, 30)
+
+    def test_rejects_when_the_tokens_do_not_fit(self):
+        self.limiter.acquire(900)
+
+        self.assertGreater(self.limiter._try_acquire(200), 0)
+        self.assertEqual(self.limiter._try_acquire(100), 0)
+
+    def test_buckets_refill_over_time(self):
+        self.limiter.acquire(500)
+        self.limiter.acquire(500)
+        self.assertGreater(self.limiter._try_acquire(500), 0)
+
+        self._rewind(30)
+
+        self.assertEqual(self.limiter._try_acquire(500), 0)
+        self.assertGreater(self.limiter._try_acquire(1), 0)
+
+    def test_real_usage_corrects_the_estimate(self):
+        self.limiter.acquire(900)
+        self.limiter.record_usage(900, 100)
+
+        self.assertEqual(self.limiter._try_acquire(900), 0)
+
+    def test_lets_calls_through_without_redis(self):
+        with mock.patch("badgeup.rate_limit.get_redis", side_effect=RuntimeError("no redis")):
+            for _ in range(5):
+                self.limiter.acquire(10)
+
+
+@override_settings(OPENAI_API_KEY="test")
+class OpenAIClientOptionsTests(SimpleTestCase):
+    def test_sync_client_keeps_sdk_retries_unless_configured(self):
+        self.assertNotIn("max_retries", _client_options())
+        with self.settings(OPENAI_MAX_RETRIES=5):
+            self.assertEqual(_client_options()["max_retries"], 5)
+
+    def test_async_client_does_not_retry_by_default(self):
+        self.assertEqual(_client_options(asynchronous=True)["max_retries"], 0)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("badgeup.circuit_breaker.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(
+            "test",
+            failure_rate=0.5,
+            min_calls=4,
+            window=60,
+            slow_call_seconds=5,
+            open_seconds=30,
+            half_open_calls=1,
+        )
+
+    def _open(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+
+    def _expire_open_period(self):
+        self.redis.hset(self.breaker.state_key, "until", 0)
+
+    def test_opens_once_enough_calls_fail(self):
+        self.breaker.record_success(0.1)
+        self.breaker.record_failure()
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.status()[0], CLOSED)
+
+        self.breaker.record_success(6)  # slow
+
+        state, remaining = self.breaker.status()
+        self.assertEqual(state, OPEN)
+        self.assertAlmostEqual(remaining, 30, delta=1)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.allow()
+
+    def test_half_open_allows_limited_probes(self):
+        self._open()
+        self._expire_open_period()
+
+        self.breaker.allow()
+
+        self.assertEqual(self.breaker.status()[0], HALF_OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.allow()
+
+    def test_good_probe_closes_and_announces_it(self):
+        self._open()
+        self._expire_open_period()
+        self.breaker.allow()
+        receiver = mock.Mock()
+        circuit_closed.connect(receiver)
+        self.addCleanup(circuit_closed.disconnect, receiver)
+
+        self.breaker.record_success(0.1)
+
+        self.assertEqual(self.breaker.status()[0], CLOSED)
+        receiver.assert_called_once()
+        self.assertEqual(receiver.call_args.kwargs["name"], "test")
+        self.breaker.allow()
+
+    def test_bad_probe_reopens(self):
+        self._open()
+        self._expire_open_period()
+        self.breaker.allow()
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.status()[0], OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.allow()
+
+    def test_cancelled_probe_is_given_back(self):
+        self._open()
+        self._expire_open_period()
+        self.breaker.allow()
+
+        self.breaker.cancel()
+
+        self.breaker.allow()
+        self.breaker.record_success(0.1)
+        self.breaker.cancel()
+        self.assertFalse(self.redis.exists(self.breaker.probes_key))
+
+    def test_stays_closed_without_redis(self):
+        with mock.patch("badgeup.circuit_breaker.get_redis", side_effect=RuntimeError("no redis")):
+            self._open()
+            self.breaker.allow()
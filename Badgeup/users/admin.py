@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 from .models import User
-from achievements.utils import compute_user_points
+from achievements.utils import annotate_user_points, user_points
 
 
 @admin.register(User)
@@ -14,6 +14,9 @@ class UserAdmin(BaseUserAdmin):
     list_display = ("username", "email", "first_name", "last_name", "points", "computed_points_display", "is_staff")
     search_fields = ("username", "email", "first_name", "last_name")
 
+    def get_queryset(self, request):
+        return annotate_user_points(super().get_queryset(request))
+
     def computed_points_display(self, obj):
-        return compute_user_points(obj)
+        return user_points(obj)
     computed_points_display.short_description = "Computed Points"
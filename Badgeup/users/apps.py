@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from badgeup.images import register_variant_field
+
+        from .models import User
+
+        register_variant_field(User, "avatar", "avatar_variants")
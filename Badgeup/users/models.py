@@ -9,6 +9,7 @@ class User(AbstractUser):
 
     email = models.EmailField(unique=True)
     avatar = models.ImageField(upload_to="avatars/", blank=True, null=True)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(blank=True)
     points = models.PositiveIntegerField(default=0)
 
@@ -3,13 +3,15 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 
 from achievements.models import UserSticker
-from achievements.utils import compute_user_points
+from achievements.utils import user_points
+from badgeup.images import variant_urls
 
 User = get_user_model()
 
 
 class UserSerializer(serializers.ModelSerializer):
     computed_points = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -20,6 +22,7 @@ class UserSerializer(serializers.ModelSerializer):
             "first_name",
             "last_name",
             "avatar",
+            "avatar_variants",
             "bio",
             "points",
             "computed_points",
@@ -35,7 +38,10 @@ class UserSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
     def get_computed_points(self, obj):
-        return compute_user_points(obj)
+        return user_points(obj)
+
+    def get_avatar_variants(self, obj):
+        return variant_urls(obj.avatar_variants, self.context.get("request"))
 
 
 class UserCaptureSerializer(serializers.Serializer):
@@ -12,6 +12,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 from achievements.models import UserSticker
+from achievements.utils import annotate_user_points
+from badgeup.conditional import ConditionalGetMixin
 
 from .serializers import (
     AdminUserManageSerializer,
@@ -58,12 +60,31 @@ class BadgeupTokenObtainPairView(TokenObtainPairView):
     serializer_class = BadgeupTokenObtainPairSerializer
 
 
-class ProfileView(generics.RetrieveUpdateAPIView):
+class ProfileView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
+    # Profile edits do not touch any timestamp, so only the ETag is reliable.
+    use_last_modified = False
 
     def get_object(self):
         return self.request.user
 
+    def get_validator_querysets(self):
+        return [UserSticker.objects.filter(user=self.request.user)]
+
+    def get_etag_extra(self):
+        user = self.request.user
+        return (
+            user.username,
+            user.email,
+            user.first_name,
+            user.last_name,
+            str(user.avatar or ""),
+            user.avatar_variants.get("source"),
+            user.bio,
+            user.points,
+            user.is_staff,
+        )
+
 
 class LeaderboardView(generics.ListAPIView):
     serializer_class = UserSerializer
@@ -72,10 +93,7 @@ class LeaderboardView(generics.ListAPIView):
     def get_queryset(self):
         limit = int(self.request.query_params.get("limit", 20))
         limit = max(1, min(limit, 100))
-        return (
-            User.objects.order_by("-points")
-            .prefetch_related("user_stickers")[:limit]
-        )
+        return annotate_user_points(User.objects.order_by("-points"))[:limit]
 
 
 class GoogleLoginStartView(APIView):
@@ -168,7 +186,7 @@ class GoogleCallbackView(APIView):
 class PublicUserProfileView(generics.RetrieveAPIView):
     serializer_class = PublicUserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
-    queryset = User.objects.all().prefetch_related("user_stickers")
+    queryset = annotate_user_points(User.objects.all())
 
     def get_object(self):
         obj = super().get_object()
@@ -1,7 +1,8 @@
-import { useEffect, useMemo, useRef, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { useUserStore } from "../store/useUserStore";
 import { useToast } from "../ui/ToastProvider";
 import type { NotificationEvent } from "../services/api";
+import { notificationsSocketUrl, readLastSeq, writeLastSeq } from "../services/notificationSeq";
 
 const wsBase = () => {
   const envUrl = import.meta.env.VITE_WS_URL as string | undefined;
@@ -11,46 +12,80 @@ const wsBase = () => {
   return `${protocol}//${window.location.host}`;
 };
 
+const MAX_RECONNECT_DELAY = 30000;
+
 export function NotificationsSocket({ onEvent }: { onEvent?: (ev: NotificationEvent) => void }) {
   const token = useUserStore((s) => s.token);
+  const userId = useUserStore((s) => s.user?.id);
   const { success } = useToast();
   const wsRef = useRef<WebSocket | null>(null);
+  const lastSeqRef = useRef<number | null>(null);
   const [lastEvent, setLastEvent] = useState<NotificationEvent | null>(null);
 
-  const wsUrl = useMemo(() => {
-    if (!token) return null;
-    const base = wsBase();
-    return `${base}/ws/notifications/?token=${token}`;
-  }, [token]);
-
   useEffect(() => {
-    if (!wsUrl) return;
-    const ws = new WebSocket(wsUrl);
-    wsRef.current = ws;
-    ws.onmessage = (event) => {
-      try {
-        const data = JSON.parse(event.data);
-        if (data.type === "notification") {
-          const title = data.title || "Notificación";
-          const msg = data.message || "";
-          const ev: NotificationEvent = {
-            title,
-            message: msg,
-            category: data.category || "info",
-            at: new Date().toISOString(),
-          };
-          setLastEvent(ev);
-          success(`${title}: ${msg}`);
-          if (onEvent) onEvent(ev);
+    if (!token) return;
+    lastSeqRef.current = readLastSeq(userId);
+    let attempts = 0;
+    let closed = false;
+    let timer: ReturnType<typeof setTimeout> | undefined;
+
+    const remember = (seq: number | null) => {
+      lastSeqRef.current = seq;
+      writeLastSeq(userId, seq);
+    };
+
+    const connect = () => {
+      // Al reconectar el servidor reenvía sólo lo posterior a `last_seq`.
+      const ws = new WebSocket(notificationsSocketUrl(wsBase(), token, lastSeqRef.current));
+      wsRef.current = ws;
+      ws.onopen = () => {
+        attempts = 0;
+      };
+      ws.onmessage = (event) => {
+        try {
+          const data = JSON.parse(event.data);
+          if (data.type === "sync") {
+            // Sin `complete` el hueco ya no está en el servidor: se parte de la secuencia actual.
+            if (data.seq != null && (!data.complete || lastSeqRef.current == null)) remember(data.seq);
+            return;
+          }
+          if (data.type === "notification") {
+            if (typeof data.seq === "number") {
+              // Puede llegar dos veces (en vivo y en la reproducción).
+              if (lastSeqRef.current != null && data.seq <= lastSeqRef.current) return;
+              remember(data.seq);
+            }
+            const title = data.title || "Notificación";
+            const msg = data.message || "";
+            const ev: NotificationEvent = {
+              title,
+              message: msg,
+              category: data.category || "info",
+              at: new Date().toISOString(),
+            };
+            setLastEvent(ev);
+            success(`${title}: ${msg}`);
+            if (onEvent) onEvent(ev);
+          }
+        } catch (err) {
+          console.error(err);
         }
-      } catch (err) {
-        console.error(err);
-      }
+      };
+      ws.onclose = () => {
+        if (closed) return;
+        const delay = Math.min(MAX_RECONNECT_DELAY, 1000 * 2 ** attempts) * (0.5 + Math.random() / 2);
+        attempts += 1;
+        timer = setTimeout(connect, delay);
+      };
     };
+
+    connect();
     return () => {
-      ws.close();
+      closed = true;
+      if (timer) clearTimeout(timer);
+      wsRef.current?.close();
     };
-  }, [wsUrl, success]);
+  }, [token, userId, success]);
 
   return null;
 }
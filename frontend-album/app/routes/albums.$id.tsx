@@ -65,7 +65,7 @@ export default function AlbumDetail() {
   const [unlockNote, setUnlockNote] = useState("");
   const [savingNote, setSavingNote] = useState(false);
 
-  const { error, success } = useToast();
+  const { error, success, info } = useToast();
   const user = useUserStore((s) => s.user);
   const fetchProfile = useUserStore.getState().fetchProfile;
 
@@ -229,7 +229,9 @@ export default function AlbumDetail() {
         }
       }
 
-      const result = await AlbumsAPI.matchPhoto(album.id, fileToUse, coords);
+      const job = await AlbumsAPI.waitForMatchPhotoJob(
+        await AlbumsAPI.submitMatchPhotoJob(album.id, fileToUse, coords),
+      );
 
       // limpiar selección siempre
       setMatchPhotoFile(null);
@@ -237,6 +239,13 @@ export default function AlbumDetail() {
         captureInputRef.current.value = "";
       }
 
+      // sigue en cola o diferido: el resultado llegará como notificación
+      if (!job.result) {
+        info("Estamos analizando tu foto. Te avisaremos cuando tengamos el resultado.");
+        return;
+      }
+      const result = job.result;
+
       // no hubo match
       if (!result.unlocked) {
         const msg =
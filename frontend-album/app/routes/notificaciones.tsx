@@ -1,6 +1,6 @@
 import type { Route } from "./+types/notificaciones";
-import { useEffect, useMemo, useRef, useState } from "react";
-import type { NotificationEvent } from "../services/api";
+import { useCallback, useEffect, useMemo, useRef, useState } from "react";
+import { NotificationsAPI, type NotificationEvent } from "../services/api";
 import { useToast } from "../ui/ToastProvider";
 import { useUserStore } from "../store/useUserStore";
 
@@ -31,6 +31,9 @@ const colorByCategory: Record<string, string> = {
 export default function Notificaciones() {
   const [events, setEvents] = useState<NotificationEvent[]>([]);
   const [connected, setConnected] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [unread, setUnread] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
   const token = useUserStore((s) => s.token);
   const { error } = useToast();
   const wsRef = useRef<WebSocket | null>(null);
@@ -41,6 +44,41 @@ export default function Notificaciones() {
     return `${base}/ws/notifications/?token=${token}`;
   }, [token]);
 
+  const loadPage = useCallback(
+    async (cursor?: string | null) => {
+      try {
+        const page = await NotificationsAPI.list(cursor);
+        const items: NotificationEvent[] = page.results.map((item) => ({
+          title: item.title,
+          message: item.message,
+          category: item.category || "info",
+          at: item.created_at,
+        }));
+        setEvents((prev) => (cursor ? [...prev, ...items] : items));
+        setNextCursor(page.next);
+        setUnread(page.unread);
+        if (!cursor && page.results.length && page.unread) {
+          const { unread: left } = await NotificationsAPI.markRead(page.results[0].id);
+          setUnread(left);
+        }
+      } catch (e) {
+        error("No pudimos cargar tus notificaciones.");
+      }
+    },
+    [error],
+  );
+
+  useEffect(() => {
+    if (token) loadPage();
+  }, [token, loadPage]);
+
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    await loadPage(nextCursor);
+    setLoadingMore(false);
+  };
+
   useEffect(() => {
     if (!wsUrl) return;
     const ws = new WebSocket(wsUrl);
@@ -57,7 +95,7 @@ export default function Notificaciones() {
             category: data.category || "info",
             at: new Date().toISOString(),
           };
-          setEvents((prev) => [next, ...prev].slice(0, 50));
+          setEvents((prev) => [next, ...prev]);
         }
       } catch (e) {
         error("No pudimos leer una notificación.");
@@ -73,7 +111,7 @@ export default function Notificaciones() {
           <div>
             <h2 className="text-3xl font-semibold text-gray-800">Notificaciones en vivo</h2>
             <p className="text-sm text-gray-500">
-              Conectado: {connected ? "Sí" : "No"} · Últimas {events.length}
+              Conectado: {connected ? "Sí" : "No"} · {events.length} cargadas · {unread} sin leer
             </p>
           </div>
         </div>
@@ -100,6 +138,16 @@ export default function Notificaciones() {
               );
             })
           )}
+          {nextCursor && (
+            <button
+              type="button"
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="w-full py-2 text-sm font-medium text-blue-600 hover:text-blue-800 disabled:text-gray-400"
+            >
+              {loadingMore ? "Cargando..." : "Cargar más"}
+            </button>
+          )}
         </div>
       </main>
     </div>
@@ -46,6 +46,8 @@ const unwrapList = <T,>(payload: PaginatedResponse<T> | T[]): T[] => {
   return payload?.results ?? [];
 };
 
+export type ImageVariants = Partial<Record<"128" | "384" | "1024", string>>;
+
 export interface ApiUser {
   id: number;
   username: string;
@@ -53,6 +55,7 @@ export interface ApiUser {
   first_name: string;
   last_name: string;
   avatar: string | null;
+  avatar_variants?: ImageVariants;
   bio: string;
   points: number;
   date_joined: string;
@@ -72,9 +75,13 @@ export interface AlbumSummary {
   description: string;
   theme: string;
   cover_image: string | null;
+  cover_variants?: ImageVariants;
   is_premium: boolean;
   price: string | null;
   stickers_count: number;
+  captured_count?: number;
+  completion_pct?: number;
+  points_earned?: number;
 }
 
 export interface Sticker {
@@ -86,12 +93,14 @@ export interface Sticker {
   location_lng: number | null;
   image_reference: string | null;
   image?: string | null;
+  image_variants?: ImageVariants;
   reward_points: number;
   order: number;
   rarity?: string | null;
   is_unlocked?: boolean;
   status?: string | null;
   unlocked_photo_url?: string | null;
+  unlocked_photo_variants?: ImageVariants;
   user_message?: string | null;
   fun_fact?: string | null;
   unlocked_at?: string | null;
@@ -201,6 +210,22 @@ export interface NotificationEvent {
   at?: string;
 }
 
+export interface NotificationItem {
+  id: number;
+  title: string;
+  message: string;
+  category: NotificationCategory | "";
+  data: Record<string, unknown>;
+  read: boolean;
+  created_at: string;
+}
+
+export interface NotificationPage {
+  results: NotificationItem[];
+  next: string | null;
+  unread: number;
+}
+
 export interface CreateAlbumPayload {
   title: string;
   description?: string;
@@ -244,6 +269,15 @@ export type MatchPhotoResult = {
   message?: string;
 };
 
+export type MatchPhotoJob = {
+  id: string;
+  album_id: number;
+  status: "pending" | "running" | "done" | "failed" | "deferred";
+  result: MatchPhotoResult | null;
+  created_at: string;
+  updated_at: string;
+};
+
 export const AuthAPI = {
   async login(username: string, password: string) {
     const { data } = await api.post<LoginResponse>("/auth/login/", {
@@ -350,11 +384,11 @@ export const AlbumsAPI = {
     const { data } = await api.post<UserSticker>(`/stickers/${stickerId}/unlock/`, { photo_url: photoUrl });
     return data;
   },
-  async matchPhoto(
+  async submitMatchPhotoJob(
     albumId: number | string,
     photo: File,
     coords?: { lat: number; lng: number },
-  ): Promise<MatchPhotoResult> {
+  ): Promise<MatchPhotoJob> {
     const formData = new FormData();
     formData.append("photo", photo);
     if (coords?.lat != null && coords?.lng != null) {
@@ -362,11 +396,28 @@ export const AlbumsAPI = {
       formData.append("lng", String(coords.lng));
     }
 
-    const resp = await api.post<MatchPhotoResult>(`/albums/${albumId}/match-photo/`, formData, {
+    const resp = await api.post<MatchPhotoJob>(`/albums/${albumId}/match-photo/`, formData, {
+      params: { mode: "job" },
       headers: { "Content-Type": "multipart/form-data" },
     });
     return resp.data;
   },
+  async getMatchPhotoJob(jobId: string): Promise<MatchPhotoJob> {
+    const { data } = await api.get<MatchPhotoJob>(`/albums/match-jobs/${jobId}/`);
+    return data;
+  },
+  // Consulta el job hasta que termina; devuelve el último estado si sigue
+  // pendiente o diferido al vencer `timeoutMs` (el resultado llega luego por socket).
+  async waitForMatchPhotoJob(job: MatchPhotoJob, intervalMs = 1500, timeoutMs = 60000): Promise<MatchPhotoJob> {
+    const deadline = Date.now() + timeoutMs;
+    let current = job;
+    while (current.status === "pending" || current.status === "running") {
+      if (Date.now() >= deadline) break;
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+      current = await AlbumsAPI.getMatchPhotoJob(current.id);
+    }
+    return current;
+  },
 };
 
 export const StickersAPI = {
@@ -376,8 +427,14 @@ export const StickersAPI = {
     });
     return unwrapList<Sticker>(data);
   },
-  async locations() {
-    const { data } = await api.get<PaginatedResponse<StickerLocation> | StickerLocation[]>("/stickers/locations/");
+  async locations(filters?: { bbox?: [number, number, number, number]; since?: string; album?: number }) {
+    const params: Record<string, string | number> = {};
+    if (filters?.bbox) params.bbox = filters.bbox.join(",");
+    if (filters?.since) params.since = filters.since;
+    if (filters?.album != null) params.album = filters.album;
+    const { data } = await api.get<PaginatedResponse<StickerLocation> | StickerLocation[]>("/stickers/locations/", {
+      params,
+    });
     return unwrapList<StickerLocation>(data);
   },
   async create(payload: CreateStickerPayload) {
@@ -505,3 +562,22 @@ export const StickersHistoryAPI = {
     return unwrapList<StickerHistoryItem>(data);
   },
 };
+
+export const NotificationsAPI = {
+  async list(cursorUrl?: string | null, limit = 20) {
+    const { data } = cursorUrl
+      ? await api.get<NotificationPage>(cursorUrl)
+      : await api.get<NotificationPage>("/notifications/", { params: { limit } });
+    return data;
+  },
+  async markRead(upTo: number) {
+    const { data } = await api.post<{ updated: number; unread: number }>("/notifications/read/", {
+      up_to: upTo,
+    });
+    return data;
+  },
+  async unread() {
+    const { data } = await api.get<{ unread: number }>("/notifications/unread/");
+    return data.unread;
+  },
+};
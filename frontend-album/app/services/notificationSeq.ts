@@ -0,0 +1,24 @@
+// Último número de secuencia de notificaciones visto por el usuario. Se envía
+// como `last_seq` al reconectar el websocket para recibir sólo lo perdido.
+const storageKey = (userId: number | string) => `badgeup_notifications_seq_${userId}`;
+
+export const readLastSeq = (userId?: number | string | null): number | null => {
+  if (userId == null || typeof window === "undefined") return null;
+  const raw = window.localStorage.getItem(storageKey(userId));
+  const value = raw ? Number(raw) : NaN;
+  return Number.isFinite(value) ? value : null;
+};
+
+export const writeLastSeq = (userId: number | string | null | undefined, seq: number | null) => {
+  if (userId == null || typeof window === "undefined") return;
+  if (seq == null) {
+    window.localStorage.removeItem(storageKey(userId));
+    return;
+  }
+  window.localStorage.setItem(storageKey(userId), String(seq));
+};
+
+export const notificationsSocketUrl = (base: string, token: string, lastSeq?: number | null) => {
+  const suffix = lastSeq != null ? `&last_seq=${lastSeq}` : "";
+  return `${base}/ws/notifications/?token=${token}${suffix}`;
+};